@@ -0,0 +1,179 @@
+"""Filter backends for the base geospaas API.
+
+The default backend of django-rest-framework-filters filters each
+related object with an `IN (SELECT ...)` subquery over the whole
+related table, which many database backends optimize poorly.
+`JoinFilterBackend` accepts the same query string syntax but compiles
+the whole tree of related filters into a single query:
+  - the filters across single-valued relations (foreign keys) are
+    applied on the main query, which results in joins;
+  - the filters across multi-valued relations (many-to-many and
+    reverse relations) are grouped in one `EXISTS` clause per relation,
+    so that all the conditions apply to the same related object and no
+    duplicate rows are returned.
+The related filtersets which use custom filter methods are applied with
+a subquery, as by the default backend.
+
+`CostGuardFilterBackend` filters like the default backend, after
+checking the cost of the filters (see the `cost` module).
+`JoinFilterBackend` also checks the cost of the filters.
+The views using `CostGuardMixin` check the cost of the filters when
+they are configured with the default backend, which is replaced with
+`CostGuardFilterBackend`.
+
+The backends can be enabled with the DEFAULT_FILTER_BACKENDS setting of
+the REST framework:
+    REST_FRAMEWORK = {
+        'DEFAULT_FILTER_BACKENDS': (
+            'geospaas_rest_api.base_api.backends.JoinFilterBackend',
+        ),
+    }
+"""
+import copy
+import functools
+
+import rest_framework_filters
+from django.db.models import Exists, OuterRef
+from django.db.models.constants import LOOKUP_SEP
+from django_filters.utils import get_model_field
+from rest_framework.settings import api_settings
+from rest_framework_filters.backends import RestFrameworkFilterBackend
+from rest_framework_filters.filterset import related
+
+import geospaas_rest_api.base_api.cost as cost
+
+
+def has_related_data(filterset, related_name):
+    """Returns True if the request contains parameters for the related
+    filterset `related_name` of `filterset`
+    """
+    prefix = f"{related(filterset, related_name)}{LOOKUP_SEP}"
+    return any(param.startswith(prefix) for param in filterset.data)
+
+
+def is_flattenable(filterset):
+    """Returns True if none of the filters applied by `filterset` and
+    its related filtersets use a custom method
+    """
+    return (all(filterset.filters[name].method is None for name in filterset.form.cleaned_data)
+            and all(is_flattenable(related_filterset)
+                    for related_filterset in filterset.related_filtersets.values()))
+
+
+def get_reverse_lookup(field):
+    """Returns the lookup which leads from the model targeted by the
+    relation `field` back to the model which declares it, or None if
+    the relation cannot be followed backwards
+    """
+    if field.auto_created and not field.concrete:
+        # reverse relation, the lookup is the name of the forward field
+        return field.field.name
+    lookup = field.related_query_name()
+    return None if lookup.endswith('+') else lookup
+
+
+def apply_filters(filterset, queryset, path):
+    """Applies the filters of `filterset` and of its related filtersets
+    to `queryset`. `path` is the lookup which leads from the model of
+    `queryset` to the model of `filterset`.
+    """
+    for name, value in filterset.form.cleaned_data.items():
+        queryset_filter = filterset.filters[name]
+        if path:
+            queryset_filter = copy.copy(queryset_filter)
+            queryset_filter.field_name = LOOKUP_SEP.join((path, queryset_filter.field_name))
+        queryset = queryset_filter.filter(queryset, value)
+    return filter_related(filterset, queryset, path)
+
+
+def filter_related(filterset, queryset, path=''):
+    """Applies the related filtersets of `filterset` to `queryset`,
+    using joins and EXISTS clauses instead of IN subqueries
+    """
+    model = filterset._meta.model
+    for related_name, related_filterset in filterset.related_filtersets.items():
+        if not has_related_data(filterset, related_name):
+            continue
+
+        related_filter = filterset.filters[related_name]
+        field = get_model_field(model, related_filter.field_name)
+        field_path = LOOKUP_SEP.join(filter(None, (path, related_filter.field_name)))
+        related_queryset = related_filterset.queryset
+        reverse_lookup = get_reverse_lookup(field)
+
+        if not is_flattenable(related_filterset) or reverse_lookup is None:
+            to_field_name = getattr(related_filter.field, 'to_field_name', 'pk') or 'pk'
+            queryset = queryset.filter(**{
+                f"{field_path}{LOOKUP_SEP}in": related_filterset.qs.values(to_field_name)})
+        elif field.many_to_many or field.one_to_many or related_queryset.query.has_filters():
+            # the conditions must apply to the same related object, and
+            # the restrictions of the RelatedFilter's queryset are kept
+            outer_ref = OuterRef(path) if path else OuterRef('pk')
+            related_queryset = apply_filters(related_filterset, related_queryset, '')
+            queryset = queryset.filter(Exists(
+                related_queryset.order_by().filter(**{reverse_lookup: outer_ref})))
+        else:
+            if field.null:
+                # the objects without related object never match, like
+                # with an IN subquery
+                queryset = queryset.filter(**{f"{field_path}{LOOKUP_SEP}isnull": False})
+            queryset = apply_filters(related_filterset, queryset, field_path)
+    return queryset
+
+
+class JoinFilterSetMixin:
+    """Applies the related filtersets of a FilterSet with joins and
+    EXISTS clauses
+    """
+
+    def filter_related_filtersets(self, queryset):
+        return filter_related(self, queryset)
+
+
+@functools.lru_cache(maxsize=None)
+def get_join_filterset_class(filterset_class):
+    """Returns a subclass of `filterset_class` which uses
+    JoinFilterSetMixin
+    """
+    return type(f"Join{filterset_class.__name__}", (JoinFilterSetMixin, filterset_class), {})
+
+
+class CostGuardFilterBackend(RestFrameworkFilterBackend):
+    """Filter backend which rejects or throttles the requests whose
+    filters are over budget
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        filterset_class = self.get_filterset_class(view, queryset)
+        if (filterset_class is not None and
+                issubclass(filterset_class, rest_framework_filters.FilterSet)):
+            cost.check_request(request, view, filterset_class)
+        return super().filter_queryset(request, queryset, view)
+
+
+class JoinFilterBackend(CostGuardFilterBackend):
+    """Filter backend which accepts the same parameters as
+    RestFrameworkFilterBackend and compiles the related filters into a
+    single query
+    """
+
+    def get_filterset_class(self, view, queryset=None):
+        filterset_class = super().get_filterset_class(view, queryset)
+        if (filterset_class is not None and
+                issubclass(filterset_class, rest_framework_filters.FilterSet)):
+            filterset_class = get_join_filterset_class(filterset_class)
+        return filterset_class
+
+
+class CostGuardMixin:
+    """Checks the cost of the filters of a view which uses the default
+    backend of django-rest-framework-filters
+    """
+
+    @property
+    def filter_backends(self):
+        """Returns the configured filter backends, with
+        CostGuardFilterBackend instead of RestFrameworkFilterBackend
+        """
+        return [CostGuardFilterBackend if backend is RestFrameworkFilterBackend else backend
+                for backend in api_settings.DEFAULT_FILTER_BACKENDS]
@@ -0,0 +1,252 @@
+"""Cost policy of the filters of the base geospaas API.
+
+Each filter parameter of a request is classified as:
+  - indexed: a cheap lookup (exact, comparisons...) on an indexed field,
+    or any lookup on a field with a spatial index;
+  - expensive: a lookup which can't use an index, like `icontains` or
+    `iregex`;
+  - scan: any other lookup.
+`startswith` is only considered indexed on indexed text fields, because
+it is case sensitive.
+Requests which follow too many relations, contain too many expensive or
+scan lookups or a regular expression which is not anchored with '^' are
+over budget. They are rejected or, if
+GEOSPAAS_REST_API_FILTER_OVER_BUDGET is 'throttle', allowed at a
+limited rate.
+
+The policy is configured by the following Django settings:
+  - GEOSPAAS_REST_API_FILTER_MAX_DEPTH: maximum number of relations
+    followed by a parameter (default 3).
+  - GEOSPAAS_REST_API_FILTER_MAX_EXPENSIVE_LOOKUPS: maximum number of
+    expensive lookups in a request (default 2).
+  - GEOSPAAS_REST_API_FILTER_MAX_SCAN_LOOKUPS: maximum number of scan
+    lookups in a request (default None, no limit).
+  - GEOSPAAS_REST_API_FILTER_EXPENSIVE_LOOKUPS: the lookups which are
+    considered expensive.
+  - GEOSPAAS_REST_API_FILTER_ALLOW_UNANCHORED_REGEX: accept the regular
+    expressions which do not start with '^' (default False).
+  - GEOSPAAS_REST_API_FILTER_OVER_BUDGET: 'reject' (default) or
+    'throttle'.
+  - GEOSPAAS_REST_API_FILTER_THROTTLE_RATE: rate at which the over
+    budget requests of a client are allowed (default '10/hour').
+  - GEOSPAAS_REST_API_FILTER_STATEMENT_TIMEOUT: maximum duration in
+    seconds of the queries run by the list endpoints (default 30, None
+    for no limit). It is enforced on PostgreSQL and SQLite.
+"""
+import collections
+import contextlib
+import time
+
+from django.conf import settings
+from django.contrib.gis.db.models import GeometryField
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+from django.db.models.constants import LOOKUP_SEP
+from django_filters.utils import get_model_field
+from rest_framework import status
+from rest_framework.exceptions import APIException, Throttled
+from rest_framework.throttling import SimpleRateThrottle
+
+
+INDEXED = 'indexed'
+SCAN = 'scan'
+EXPENSIVE = 'expensive'
+
+DEFAULT_EXPENSIVE_LOOKUPS = (
+    'contains', 'icontains', 'endswith', 'iendswith', 'regex', 'iregex', 'search')
+INDEXED_LOOKUPS = ('exact', 'in', 'gt', 'gte', 'lt', 'lte', 'range', 'isnull')
+# lookups which can use the index of a text field
+PREFIX_LOOKUPS = ('startswith',)
+TEXT_FIELDS = ('CharField', 'TextField')
+REGEX_LOOKUPS = ('regex', 'iregex')
+DEFAULT_STATEMENT_TIMEOUT = 30
+
+# SQLite checks the timeout every time this number of instructions
+# has been executed
+SQLITE_PROGRESS_STEPS = 10000
+
+QueryCost = collections.namedtuple('QueryCost', ('lookups', 'over_budget'))
+
+
+class QueryTooExpensive(APIException):
+    """Raised when the filters of a request are over budget"""
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = 'The query is too expensive'
+    default_code = 'query_too_expensive'
+
+
+class QueryTimeout(APIException):
+    """Raised when a query exceeds the statement timeout"""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The query took too long, please use more selective filters'
+    default_code = 'query_timeout'
+
+
+def get_setting(name, default):
+    """Returns the value of a filter cost setting"""
+    return getattr(settings, f"GEOSPAAS_REST_API_FILTER_{name}", default)
+
+
+def resolve_param(filterset_class, param):
+    """Returns a (depth, model field, lookup) tuple for a query
+    parameter, or None if it does not match any filter
+    """
+    depth = 0
+    while True:
+        name = filterset_class.get_param_filter_name(param)
+        if name is None:
+            return None
+        if name in filterset_class.related_filters and param.startswith(name + LOOKUP_SEP):
+            param = param[len(name) + len(LOOKUP_SEP):]
+            filterset_class = filterset_class.related_filters[name].filterset
+            depth += 1
+            continue
+        param_filter = filterset_class.base_filters[name]
+        field = get_model_field(filterset_class._meta.model, param_filter.field_name)
+        return depth, field, param_filter.lookup_expr
+
+
+def is_indexed(field):
+    """Returns True if the database has an index on the field"""
+    return bool(field.primary_key or field.unique or field.db_index or
+                getattr(field, 'spatial_index', False))
+
+
+def classify(field, lookup):
+    """Returns the cost class of a lookup on a model field"""
+    if isinstance(field, GeometryField):
+        return INDEXED if is_indexed(field) else SCAN
+    if lookup in get_setting('EXPENSIVE_LOOKUPS', DEFAULT_EXPENSIVE_LOOKUPS):
+        return EXPENSIVE
+    if lookup in INDEXED_LOOKUPS and is_indexed(field):
+        return INDEXED
+    if (lookup in PREFIX_LOOKUPS and is_indexed(field) and
+            field.get_internal_type() in TEXT_FIELDS):
+        return INDEXED
+    return SCAN
+
+
+def evaluate(filterset_class, params):
+    """Returns the QueryCost of the query parameters `params`.
+    `lookups` maps each filter parameter to its cost class and
+    `over_budget` lists the reasons for which the query is over budget.
+    Each value of a parameter counts as one lookup.
+    """
+    max_depth = get_setting('MAX_DEPTH', 3)
+    lookups = {}
+    occurrences = {}
+    over_budget = []
+    for param, values in params.lists():
+        values = [value for value in values if value]
+        if not values:
+            continue
+        resolved = resolve_param(filterset_class, param)
+        if resolved is None:
+            continue
+        depth, field, lookup = resolved
+        if field is None:
+            continue
+        lookups[param] = classify(field, lookup)
+        occurrences[param] = len(values)
+        if max_depth is not None and depth > max_depth:
+            over_budget.append(f"'{param}' follows more than {max_depth} relations")
+        if (lookup in REGEX_LOOKUPS and not get_setting('ALLOW_UNANCHORED_REGEX', False) and
+                any(value and not value.startswith('^') for value in values)):
+            over_budget.append(f"the regular expression of '{param}' must start with '^'")
+
+    for cost_class, default_limit in ((EXPENSIVE, 2), (SCAN, None)):
+        limit = get_setting(f"MAX_{cost_class.upper()}_LOOKUPS", default_limit)
+        matching = sorted(param for param, value in lookups.items() if value == cost_class
+                          for _ in range(occurrences[param]))
+        if limit is not None and len(matching) > limit:
+            over_budget.append(
+                f"at most {limit} {cost_class} lookups are allowed ({', '.join(matching)})")
+    return QueryCost(lookups, over_budget)
+
+
+class OverBudgetThrottle(SimpleRateThrottle):
+    """Limits the rate of the over budget queries of each client"""
+    scope = 'over_budget_filters'
+
+    def get_rate(self):
+        return get_setting('THROTTLE_RATE', '10/hour')
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+def check_request(request, view, filterset_class):
+    """Raises an exception if the filters of the request are over
+    budget and can't be run now
+    """
+    check_params(request.query_params, request, view, filterset_class)
+
+
+def check_params(params, request, view, filterset_class):
+    """Raises an exception if the filters in `params` are over budget
+    and can't be run now
+    """
+    cost = evaluate(filterset_class, params)
+    if not cost.over_budget:
+        return
+    reasons = '; '.join(cost.over_budget)
+    if get_setting('OVER_BUDGET', 'reject') == 'throttle':
+        throttle = OverBudgetThrottle()
+        if not throttle.allow_request(request, view):
+            raise Throttled(
+                wait=throttle.wait(),
+                detail=f"Too many expensive queries: {reasons}")
+    else:
+        raise QueryTooExpensive(f"The query is too expensive: {reasons}")
+
+
+def is_timeout(error):
+    """Returns True if the database error is caused by the statement
+    timeout
+    """
+    return (getattr(error.__cause__, 'pgcode', None) == '57014' or
+            'interrupted' in str(error))
+
+
+@contextlib.contextmanager
+def statement_timeout(using=DEFAULT_DB_ALIAS):
+    """Interrupts the queries which are run in this context and take
+    longer than the statement timeout
+    """
+    timeout = get_setting('STATEMENT_TIMEOUT', DEFAULT_STATEMENT_TIMEOUT)
+    connection = connections[using]
+    if not timeout or connection.vendor not in ('postgresql', 'sqlite'):
+        yield
+        return
+    try:
+        if connection.vendor == 'postgresql':
+            with transaction.atomic(using=using):
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL statement_timeout = %s', [int(timeout * 1000)])
+                yield
+        else:
+            deadline = time.monotonic() + timeout
+            connection.ensure_connection()
+            connection.connection.set_progress_handler(
+                lambda: time.monotonic() > deadline, SQLITE_PROGRESS_STEPS)
+            try:
+                yield
+            finally:
+                connection.connection.set_progress_handler(None, 0)
+    except OperationalError as error:
+        if is_timeout(error):
+            raise QueryTimeout() from error
+        raise
+
+
+class StatementTimeoutMixin:
+    """Runs the queries of the list endpoint with the statement
+    timeout
+    """
+
+    def list(self, request, *args, **kwargs):
+        with statement_timeout():
+            return super().list(request, *args, **kwargs)
@@ -0,0 +1,118 @@
+"""Faceted counts of the datasets matching a filter.
+
+A facet is a field of the datasets or of their related objects, given
+as an exact filter parameter of the DatasetFilter, for example
+`source__platform__short_name`. For each requested facet, the number of
+matching datasets is counted for each value of the field, using one
+grouped aggregate query.
+
+The facets are configured by the following Django settings:
+  - GEOSPAAS_REST_API_MAX_FACETS: maximum number of facets in a request
+    (default 10).
+  - GEOSPAAS_REST_API_FACETS_LIMIT: maximum number of values returned
+    for each facet, the most frequent first (default 100).
+  - GEOSPAAS_REST_API_FACETS_CACHE_TIMEOUT: number of seconds during
+    which the counts are cached, keyed by the normalized filter
+    (default 0, no caching).
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.contrib.gis.db.models import GeometryField
+from django.core.cache import cache
+from django.db.models import Count
+from rest_framework.exceptions import ValidationError
+
+import geospaas_rest_api.base_api.cost as cost
+
+
+CACHE_KEY_PREFIX = 'geospaas_rest_api:facets'
+FACETS_PARAM = 'facets'
+
+
+def get_max_facets():
+    """Returns the maximum number of facets in a request"""
+    return getattr(settings, 'GEOSPAAS_REST_API_MAX_FACETS', 10)
+
+
+def get_facets_limit():
+    """Returns the maximum number of values returned for each facet"""
+    return getattr(settings, 'GEOSPAAS_REST_API_FACETS_LIMIT', 100)
+
+
+def get_cache_timeout():
+    """Returns the number of seconds during which the counts are
+    cached
+    """
+    return getattr(settings, 'GEOSPAAS_REST_API_FACETS_CACHE_TIMEOUT', 0)
+
+
+def get_facets(filterset_class, params):
+    """Returns the sorted list of facets requested in the query
+    parameters
+    """
+    facets = sorted({
+        facet.strip() for facet in params.get(FACETS_PARAM, '').split(',') if facet.strip()})
+    if not facets:
+        raise ValidationError({FACETS_PARAM: 'At least one facet is required'})
+    if len(facets) > get_max_facets():
+        raise ValidationError(
+            {FACETS_PARAM: f"At most {get_max_facets()} facets can be requested"})
+    for facet in facets:
+        resolved = cost.resolve_param(filterset_class, facet)
+        field = resolved[1] if resolved else None
+        if (field is None or resolved[2] != 'exact' or field.is_relation or
+                isinstance(field, GeometryField)):
+            raise ValidationError({FACETS_PARAM: f"Unknown facet: '{facet}'"})
+    return facets
+
+
+def get_cache_key(filterset_class, facets, params):
+    """Returns the cache key of the facets for the filter parameters.
+    The parameters which are not filters and the empty ones are
+    ignored, and the others are sorted by name.
+    """
+    normalized_params = sorted(
+        (param, [value for value in values if value])
+        for param, values in params.lists()
+        if param != FACETS_PARAM and any(values) and
+        cost.resolve_param(filterset_class, param) is not None)
+    digest = hashlib.sha256(
+        json.dumps([facets, normalized_params]).encode('utf-8')).hexdigest()
+    return f"{CACHE_KEY_PREFIX}:{digest}"
+
+
+def count_facets(queryset, facets):
+    """Returns the number of datasets in `queryset` and the counts for
+    each value of the facets
+    """
+    # the filters on multi-valued relations may join the same tables
+    # as the facets, so the counts are computed on the matching
+    # primary keys
+    datasets = queryset.model.objects.filter(pk__in=queryset.order_by().values('pk'))
+    limit = get_facets_limit()
+    counts = {}
+    for facet in facets:
+        rows = (datasets
+                .order_by()
+                .values(facet)
+                .annotate(count=Count('pk', distinct=True))
+                .order_by('-count', facet))
+        counts[facet] = [{'value': row[facet], 'count': row['count']} for row in rows[:limit]]
+    return {'count': datasets.count(), 'facets': counts}
+
+
+def get_facet_counts(queryset, filterset_class, params):
+    """Returns the facet counts of the filtered `queryset` for the
+    facets requested in `params`, from the cache if they were computed
+    recently
+    """
+    facets = get_facets(filterset_class, params)
+    timeout = get_cache_timeout()
+    if not timeout:
+        return count_facets(queryset, facets)
+    return cache.get_or_set(
+        get_cache_key(filterset_class, facets, params),
+        lambda: count_facets(queryset, facets),
+        timeout)
@@ -0,0 +1,198 @@
+"""Compilation of JSON filter trees into query conditions.
+
+A filter tree is made of nodes which are either:
+  - {"and": [<node>, ...]}: all the nodes must match;
+  - {"or": [<node>, ...]}: at least one of the nodes must match;
+  - {"not": <node>}: the node must not match;
+  - a dictionary of lookups, which must all match. The lookups are the
+    query parameters accepted by the FilterSet, for example
+    {"source__platform__short_name": "N20"}. In addition:
+      - the values of geometry lookups can be GeoJSON geometries;
+      - lists are accepted for the `__in` and `__range` lookups;
+      - {"time_range": [<start>, <end>]} matches the datasets whose time
+        coverage intersects the time range. One of the bounds can be
+        null.
+
+The lookups are validated and applied by the FilterSet's filters, and the
+related filters are compiled into joins and EXISTS clauses like with
+the JoinFilterBackend. The whole tree is compiled into a single Q
+object.
+
+The size of the trees is limited by the
+GEOSPAAS_REST_API_FILTER_TREE_MAX_NODES Django setting (default 100).
+"""
+import json
+
+from django.conf import settings
+from django.contrib.gis.db.models import GeometryField
+from django.contrib.gis.gdal import GDALException
+from django.contrib.gis.geos import GEOSException, GEOSGeometry
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from django.http import QueryDict
+from django_filters.utils import get_model_field
+from rest_framework.exceptions import ValidationError
+
+import geospaas_rest_api.base_api.backends as backends
+import geospaas_rest_api.base_api.cost as cost
+
+
+OPERATORS = ('and', 'or', 'not')
+TIME_RANGE_KEY = 'time_range'
+TIME_RANGE_LOOKUPS = ('time_coverage_end__gte', 'time_coverage_start__lte')
+
+
+class ConditionRecorder:
+    """Stands for a queryset when the filters are applied, and
+    records the conditions in a Q object instead of filtering
+    """
+
+    def __init__(self, model, condition=None, multi_valued=False):
+        self.model = model
+        self.condition = condition if condition is not None else Q()
+        self.multi_valued = multi_valued
+
+    def is_multi_valued(self, lookup):
+        """Returns True if the lookup follows a multi-valued relation of
+        the model. Such conditions can return duplicate rows when they
+        are combined with `or`.
+        """
+        field = get_model_field(self.model, lookup.split(LOOKUP_SEP)[0])
+        return field is not None and (field.many_to_many or field.one_to_many)
+
+    def add(self, condition, kwargs):
+        """Returns a new recorder with an additional condition"""
+        return ConditionRecorder(
+            self.model, self.condition & condition,
+            self.multi_valued or any(self.is_multi_valued(lookup) for lookup in kwargs))
+
+    def filter(self, *args, **kwargs):
+        return self.add(Q(*args, **kwargs), kwargs)
+
+    def exclude(self, *args, **kwargs):
+        return self.add(~Q(*args, **kwargs), kwargs)
+
+    def distinct(self):
+        return self
+
+
+def get_max_nodes():
+    """Returns the maximum number of nodes of a filter tree"""
+    return getattr(settings, 'GEOSPAAS_REST_API_FILTER_TREE_MAX_NODES', 100)
+
+
+def convert_value(filterset_class, lookup, value):
+    """Converts a JSON value into a query parameter value"""
+    resolved = cost.resolve_param(filterset_class, lookup)
+    field = resolved[1] if resolved else None
+    if isinstance(value, dict) and isinstance(field, GeometryField):
+        try:
+            return GEOSGeometry(json.dumps(value), srid=4326).ewkt
+        except (GDALException, GEOSException, ValueError) as error:
+            raise ValidationError({lookup: f"Invalid GeoJSON geometry: {error}"}) from error
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, list):
+        return ','.join(str(item) for item in value)
+    if value is None or isinstance(value, (str, int, float)):
+        return '' if value is None else str(value)
+    raise ValidationError({lookup: 'Invalid value'})
+
+
+def get_lookups(filterset_class, node):
+    """Returns a QueryDict of query parameters from a dictionary of
+    lookups
+    """
+    params = QueryDict(mutable=True)
+    for lookup, value in node.items():
+        if lookup == TIME_RANGE_KEY:
+            if not isinstance(value, list) or len(value) != 2 or value == [None, None]:
+                raise ValidationError(
+                    {TIME_RANGE_KEY: 'Must be a list containing a start and an end time'})
+            for time_lookup, bound in zip(TIME_RANGE_LOOKUPS, value):
+                if bound is not None:
+                    params.appendlist(time_lookup, convert_value(filterset_class, lookup, bound))
+        elif cost.resolve_param(filterset_class, lookup) is None:
+            raise ValidationError({lookup: 'Unknown lookup'})
+        else:
+            params.appendlist(lookup, convert_value(filterset_class, lookup, value))
+    return params
+
+
+def compile_lookups(filterset_class, params, request):
+    """Returns the condition matching all the lookups in `params`"""
+    filterset = filterset_class(data=params, queryset=filterset_class._meta.model.objects.all(),
+                                request=request)
+    if not filterset.is_valid():
+        raise ValidationError(filterset.errors)
+
+    recorder = ConditionRecorder(filterset_class._meta.model)
+    for name, value in filterset.form.cleaned_data.items():
+        lookup_filter = filterset.filters[name]
+        if lookup_filter.method is None:
+            recorder = lookup_filter.filter(recorder, value)
+        elif value not in (None, ''):
+            # the filters with a custom method need a queryset
+            recorder = recorder.filter(pk__in=lookup_filter.filter(
+                filterset.queryset, value).values('pk'))
+    recorder = backends.filter_related(filterset, recorder)
+    return recorder.condition, recorder.multi_valued
+
+
+def compile_node(filterset_class, node, request, params, counter):
+    """Recursively compiles a node of the filter tree. The values of
+    the lookups of all the nodes are accumulated in `params` for the
+    cost evaluation, so a lookup repeated in several nodes is counted
+    each time.
+    Returns a (condition, multi_valued) tuple.
+    """
+    counter['nodes'] += 1
+    if counter['nodes'] > get_max_nodes():
+        raise ValidationError(f"The filter can't contain more than {get_max_nodes()} nodes")
+    if not isinstance(node, dict):
+        raise ValidationError('The filter nodes must be objects')
+    if not node:
+        raise ValidationError("The filter nodes can't be empty")
+    operators = set(node).intersection(OPERATORS)
+    if not operators:
+        node_params = get_lookups(filterset_class, node)
+        for lookup, values in node_params.lists():
+            params.setlistdefault(lookup, []).extend(values)
+        return compile_lookups(filterset_class, node_params, request)
+    if len(node) != 1:
+        raise ValidationError(
+            f"The '{operators.pop()}' operator can't be combined with other keys")
+
+    operator, operand = next(iter(node.items()))
+    if operator == 'not':
+        condition, multi_valued = compile_node(filterset_class, operand, request, params, counter)
+        return ~condition, multi_valued
+    if not isinstance(operand, list) or not operand:
+        raise ValidationError(f"The '{operator}' operator requires a non-empty list")
+    condition = None
+    multi_valued = False
+    for child in operand:
+        child_condition, child_multi_valued = compile_node(
+            filterset_class, child, request, params, counter)
+        multi_valued = multi_valued or child_multi_valued
+        if condition is None:
+            condition = child_condition
+        elif operator == 'and':
+            condition &= child_condition
+        else:
+            condition |= child_condition
+    return condition, multi_valued
+
+
+def filter_queryset(queryset, filterset_class, tree, request, view):
+    """Filters `queryset` with the filter tree `tree`, after checking
+    its cost
+    """
+    if tree is None:
+        return queryset
+    params = QueryDict(mutable=True)
+    condition, multi_valued = compile_node(
+        filterset_class, tree, request, params, {'nodes': 0})
+    cost.check_params(params, request, view, filterset_class)
+    queryset = queryset.filter(condition)
+    return queryset.distinct() if multi_valued else queryset
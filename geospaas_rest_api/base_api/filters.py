@@ -6,6 +6,8 @@ from django_filters.rest_framework.filters import CharFilter
 import geospaas.catalog.models
 import geospaas.vocabularies.models
 
+import geospaas_rest_api.base_api.search as search
+
 
 class ScienceKeywordFilter(rest_framework_filters.FilterSet):
     """Filter for ScienceKeyword"""
@@ -187,6 +189,11 @@ class DatasetFilter(rest_framework_filters.FilterSet):
         field_name='parameters',
         queryset=geospaas.vocabularies.models.Parameter.objects.all()
     )
+    q = CharFilter(method='full_text_search')
+
+    def full_text_search(self, queryset, name, value):
+        """Full-text search over the titles and summaries"""
+        return search.search_datasets(queryset, value)
 
     class Meta:
         model = geospaas.catalog.models.Dataset
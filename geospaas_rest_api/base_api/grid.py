@@ -0,0 +1,246 @@
+"""Counts of the datasets covering the cells of a regular lat/lon grid.
+
+The grid starts at the south-west corner of the requested bounding box
+and is made of square cells whose side is the requested resolution in
+degrees. The counts are computed by the database in one query: each
+footprint is matched with the cells which overlap its bounding box,
+then the exact intersection is checked and the datasets are counted per
+cell. Only the cells which intersect at least one footprint are
+returned.
+
+This is supported on PostGIS and SpatiaLite. The number of cells of a
+grid is limited by the GEOSPAAS_REST_API_GRID_MAX_CELLS Django setting
+(default 100000).
+"""
+import math
+
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+from django.db import connections
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+import geospaas.catalog.models
+
+
+RESOLUTION_PARAM = 'resolution'
+BBOX_PARAM = 'bbox'
+OUTPUT_PARAM = 'output'
+DEFAULT_RESOLUTION = 1.0
+DEFAULT_BBOX = (-180., -90., 180., 90.)
+OUTPUTS = ('array', 'geojson')
+SRID = 4326
+
+# names of the spatial functions for each database vendor
+SPATIAL_FUNCTIONS = {
+    'postgresql': {
+        'envelope': 'ST_MakeEnvelope',
+        'intersects': 'ST_Intersects',
+        'min_x': 'ST_XMin',
+        'max_x': 'ST_XMax',
+        'min_y': 'ST_YMin',
+        'max_y': 'ST_YMax',
+    },
+    'sqlite': {
+        'envelope': 'BuildMbr',
+        'intersects': 'ST_Intersects',
+        'min_x': 'MbrMinX',
+        'max_x': 'MbrMaxX',
+        'min_y': 'MbrMinY',
+        'max_y': 'MbrMaxY',
+    },
+}
+
+GRID_SQL = """
+WITH RECURSIVE
+grid_columns(i) AS (
+    SELECT 0 UNION ALL SELECT i + 1 FROM grid_columns WHERE i + 1 < %s
+),
+grid_rows(j) AS (
+    SELECT 0 UNION ALL SELECT j + 1 FROM grid_rows WHERE j + 1 < %s
+),
+filtered_datasets(dataset_id, location_id) AS (
+    {datasets_sql}
+),
+footprints(dataset_id, geometry, min_column, max_column, min_row, max_row) AS (
+    SELECT filtered_datasets.dataset_id, locations.{geometry},
+           {min_column}, {max_column}, {min_row}, {max_row}
+    FROM filtered_datasets
+    INNER JOIN {locations_table} locations
+        ON locations.{locations_pk} = filtered_datasets.location_id
+)
+SELECT grid_columns.i, grid_rows.j, COUNT(DISTINCT footprints.dataset_id)
+FROM footprints
+INNER JOIN grid_columns ON grid_columns.i BETWEEN footprints.min_column AND footprints.max_column
+INNER JOIN grid_rows ON grid_rows.j BETWEEN footprints.min_row AND footprints.max_row
+WHERE {intersects}(
+    {envelope}(
+        %s + grid_columns.i * %s,
+        %s + grid_rows.j * %s,
+        %s + (grid_columns.i + 1) * %s,
+        %s + (grid_rows.j + 1) * %s,
+        %s),
+    footprints.geometry)
+GROUP BY grid_columns.i, grid_rows.j
+ORDER BY grid_rows.j, grid_columns.i
+"""
+
+
+class GridNotSupported(APIException):
+    """Raised when the database does not support the grid
+    aggregation
+    """
+    status_code = status.HTTP_501_NOT_IMPLEMENTED
+    default_detail = 'The grid aggregation is not supported by the database'
+    default_code = 'grid_not_supported'
+
+
+def get_max_cells():
+    """Returns the maximum number of cells of a grid"""
+    return getattr(settings, 'GEOSPAAS_REST_API_GRID_MAX_CELLS', 100000)
+
+
+def get_resolution(params):
+    """Returns the resolution of the grid in degrees"""
+    try:
+        resolution = float(params.get(RESOLUTION_PARAM) or DEFAULT_RESOLUTION)
+    except ValueError as error:
+        raise ValidationError({RESOLUTION_PARAM: 'Must be a number'}) from error
+    if not math.isfinite(resolution) or resolution <= 0:
+        raise ValidationError({RESOLUTION_PARAM: 'Must be a positive number'})
+    return resolution
+
+
+def get_bbox(params):
+    """Returns the (west, south, east, north) bounding box of the grid
+    """
+    if not params.get(BBOX_PARAM):
+        return DEFAULT_BBOX
+    try:
+        bbox = tuple(float(value) for value in params[BBOX_PARAM].split(','))
+    except ValueError as error:
+        raise ValidationError({BBOX_PARAM: 'Must contain numbers'}) from error
+    if len(bbox) != 4:
+        raise ValidationError({BBOX_PARAM: 'Must contain west, south, east and north'})
+    west, south, east, north = bbox
+    if not (-180 <= west < east <= 180 and -90 <= south < north <= 90):
+        raise ValidationError(
+            {BBOX_PARAM: 'Must be within -180,-90,180,90 with west < east and south < north'})
+    return bbox
+
+
+def get_output(params):
+    """Returns the output format"""
+    output = params.get(OUTPUT_PARAM) or OUTPUTS[0]
+    if output not in OUTPUTS:
+        raise ValidationError({OUTPUT_PARAM: f"Must be one of: {', '.join(OUTPUTS)}"})
+    return output
+
+
+def get_grid_sql(connection, datasets_sql):
+    """Returns the SQL query of the grid counts for the database of
+    `connection`
+    """
+    functions = SPATIAL_FUNCTIONS.get(connection.vendor)
+    if functions is None:
+        raise GridNotSupported()
+
+    def cell_index(bound):
+        expression = f"({functions[bound]}(locations.{geometry}) - %s) / %s"
+        if connection.vendor == 'sqlite':
+            # truncates towards zero, which is enough to select the
+            # candidate cells because their indices are positive
+            return f"CAST({expression} AS INTEGER)"
+        return f"FLOOR({expression})"
+
+    locations_model = geospaas.catalog.models.GeographicLocation
+    quote_name = connection.ops.quote_name
+    geometry = quote_name(locations_model._meta.get_field('geometry').column)
+    return GRID_SQL.format(
+        datasets_sql=datasets_sql,
+        geometry=geometry,
+        min_column=cell_index('min_x'),
+        max_column=cell_index('max_x'),
+        min_row=cell_index('min_y'),
+        max_row=cell_index('max_y'),
+        locations_table=quote_name(locations_model._meta.db_table),
+        locations_pk=quote_name(locations_model._meta.pk.column),
+        intersects=functions['intersects'],
+        envelope=functions['envelope'])
+
+
+def count_cells(queryset, resolution, bbox, columns, rows):
+    """Returns a list of (column, row, count) tuples for the cells
+    which intersect the footprints of the datasets in `queryset`
+    """
+    connection = connections[queryset.db]
+    west, south, _, _ = bbox
+    datasets_sql, datasets_params = (
+        queryset
+        .order_by()
+        .filter(geographic_location__geometry__intersects=Polygon.from_bbox(bbox))
+        .values_list('pk', 'geographic_location')
+        .query.get_compiler(using=queryset.db).as_sql())
+    params = (
+        [columns, rows] +
+        list(datasets_params) +
+        [west, resolution, west, resolution, south, resolution, south, resolution] +
+        [west, resolution, south, resolution, west, resolution, south, resolution, SRID])
+    with connection.cursor() as cursor:
+        cursor.execute(get_grid_sql(connection, datasets_sql), params)
+        return cursor.fetchall()
+
+
+def get_cell_bounds(resolution, bbox, column, row):
+    """Returns the (west, south, east, north) bounds of a cell"""
+    west, south, _, _ = bbox
+    return (west + column * resolution, south + row * resolution,
+            west + (column + 1) * resolution, south + (row + 1) * resolution)
+
+
+def to_geojson(resolution, bbox, cells):
+    """Returns the cells as a GeoJSON FeatureCollection"""
+    features = []
+    for column, row, count in cells:
+        cell_west, cell_south, cell_east, cell_north = get_cell_bounds(
+            resolution, bbox, column, row)
+        features.append({
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Polygon',
+                'coordinates': [[
+                    [cell_west, cell_south], [cell_east, cell_south], [cell_east, cell_north],
+                    [cell_west, cell_north], [cell_west, cell_south],
+                ]],
+            },
+            'properties': {'column': column, 'row': row, 'count': count},
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def get_grid(queryset, params):
+    """Returns the number of datasets in `queryset` whose footprint
+    intersects each cell of the grid described by `params`
+    """
+    resolution = get_resolution(params)
+    bbox = get_bbox(params)
+    output = get_output(params)
+    west, south, east, north = bbox
+    columns = math.ceil((east - west) / resolution)
+    rows = math.ceil((north - south) / resolution)
+    if columns * rows > get_max_cells():
+        raise ValidationError(
+            {RESOLUTION_PARAM: f"The grid contains more than {get_max_cells()} cells, "
+                               "please use a coarser resolution or a smaller bounding box"})
+
+    cells = [(int(column), int(row), count)
+             for column, row, count in count_cells(queryset, resolution, bbox, columns, rows)]
+    if output == 'geojson':
+        return to_geojson(resolution, bbox, cells)
+    return {
+        RESOLUTION_PARAM: resolution,
+        BBOX_PARAM: list(bbox),
+        'columns': columns,
+        'rows': rows,
+        'cells': [list(cell) for cell in cells],
+    }
@@ -0,0 +1,76 @@
+"""Temporal histogram of the datasets matching a filter.
+
+The datasets are counted per time bucket by the database, by truncating
+the start of their time coverage to the requested interval and grouping
+on the result. Only the buckets which contain datasets are returned.
+
+The maximum number of buckets in a histogram is set by the
+GEOSPAAS_REST_API_HISTOGRAM_MAX_BUCKETS Django setting (default 10000).
+"""
+from django.conf import settings
+from django.db.models import Count
+from django.db.models.functions import TruncDay, TruncHour, TruncMonth
+from rest_framework.exceptions import ValidationError
+
+
+INTERVAL_PARAM = 'interval'
+SPLIT_PARAM = 'split_by'
+DEFAULT_INTERVAL = 'day'
+INTERVALS = {
+    'hour': TruncHour,
+    'day': TruncDay,
+    'month': TruncMonth,
+}
+SPLIT_FIELDS = ('source',)
+
+
+def get_max_buckets():
+    """Returns the maximum number of buckets in a histogram"""
+    return getattr(settings, 'GEOSPAAS_REST_API_HISTOGRAM_MAX_BUCKETS', 10000)
+
+
+def get_interval(params):
+    """Returns the interval requested in the query parameters"""
+    interval = params.get(INTERVAL_PARAM) or DEFAULT_INTERVAL
+    if interval not in INTERVALS:
+        raise ValidationError(
+            {INTERVAL_PARAM: f"Must be one of: {', '.join(INTERVALS)}"})
+    return interval
+
+
+def get_split_field(params):
+    """Returns the field by which the histogram is split, or None"""
+    split_field = params.get(SPLIT_PARAM) or None
+    if split_field is not None and split_field not in SPLIT_FIELDS:
+        raise ValidationError(
+            {SPLIT_PARAM: f"Must be one of: {', '.join(SPLIT_FIELDS)}"})
+    return split_field
+
+
+def get_histogram(queryset, params):
+    """Returns the number of datasets in `queryset` per time bucket,
+    optionally split by source
+    """
+    interval = get_interval(params)
+    split_field = get_split_field(params)
+    group_by = ('start', split_field) if split_field else ('start',)
+    rows = (queryset
+            .order_by()
+            .annotate(start=INTERVALS[interval]('time_coverage_start'))
+            .values(*group_by)
+            # the filters on multi-valued relations can return a
+            # dataset several times
+            .annotate(count=Count('pk', distinct=True))
+            .order_by(*group_by))
+
+    max_buckets = get_max_buckets()
+    buckets = list(rows[:max_buckets + 1])
+    if len(buckets) > max_buckets:
+        raise ValidationError(
+            {INTERVAL_PARAM: f"The histogram contains more than {max_buckets} buckets, "
+                             "please use a longer interval or more selective filters"})
+    return {
+        INTERVAL_PARAM: interval,
+        SPLIT_PARAM: split_field,
+        'buckets': buckets,
+    }
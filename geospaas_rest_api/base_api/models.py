@@ -0,0 +1,24 @@
+"""Models of the base geospaas API"""
+from django.db import models
+
+import geospaas.catalog.models
+from geospaas_rest_api.base_api.search import FTS_TABLE, FullTextDocumentField
+
+
+class DatasetSearchEntry(models.Model):
+    """Entry of the FTS5 full-text index of the datasets. This table
+    only exists on SQLite and is maintained by triggers on the dataset
+    table.
+    """
+    dataset = models.OneToOneField(geospaas.catalog.models.Dataset, primary_key=True,
+                                   db_column='rowid', db_constraint=False,
+                                   on_delete=models.DO_NOTHING, related_name='search_entry')
+    # hidden column which has the name of the table, used for
+    # searching in all the columns
+    document = FullTextDocumentField(db_column=FTS_TABLE)
+    # hidden column which contains the relevance of a match
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = FTS_TABLE
@@ -0,0 +1,97 @@
+"""Full-text search over the titles and summaries of the datasets.
+
+The search uses a full-text index which is created by the migrations of
+this app and kept up to date by the database itself:
+  - on SQLite (and SpatiaLite), an FTS5 table which indexes the
+    `catalog_dataset` table and is updated by triggers. It is mapped by
+    the unmanaged DatasetSearchEntry model;
+  - on PostgreSQL (and PostGIS), a GIN index on the tsvector of the
+    titles and summaries.
+On other databases, the search falls back on `icontains` lookups.
+
+The matching datasets are annotated with a `search_rank` relevance
+score, higher being better. The words of the titles weigh more than the
+words of the summaries.
+"""
+from django.db import connections
+from django.db.models import F, FloatField, Lookup, Q, TextField, Value
+
+
+FTS_TABLE = 'geospaas_rest_api_dataset_search'
+# used both by the index and the queries, they must stay identical
+SEARCH_CONFIG = 'english'
+TITLE_WEIGHT = 'A'
+SUMMARY_WEIGHT = 'B'
+
+
+class FullTextDocumentField(TextField):
+    """Hidden column of an FTS5 table which has the name of the table
+    and represents all the indexed columns
+    """
+
+
+@FullTextDocumentField.register_lookup
+class Match(Lookup):
+    """FTS5 full-text condition"""
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", lhs_params + rhs_params
+
+
+def get_sqlite_query(terms):
+    """Returns an FTS5 query matching the documents which contain all
+    the words of `terms`. The words are quoted so that the FTS5 syntax
+    characters are not interpreted.
+    """
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in terms.split())
+
+
+def get_search_vector():
+    """Returns the PostgreSQL expression of the indexed document"""
+    from django.contrib.postgres.search import SearchVector
+    return (SearchVector('entry_title', config=SEARCH_CONFIG, weight=TITLE_WEIGHT) +
+            SearchVector('summary', config=SEARCH_CONFIG, weight=SUMMARY_WEIGHT))
+
+
+def search_sqlite(queryset, terms):
+    """Full-text search using the FTS5 table"""
+    return (queryset
+            .filter(search_entry__document__match=get_sqlite_query(terms))
+            # the rank of FTS5 is a bm25 score, lower being better
+            .annotate(search_rank=-F('search_entry__rank')))
+
+
+def search_postgresql(queryset, terms):
+    """Full-text search using the GIN index"""
+    from django.contrib.postgres.search import SearchQuery, SearchRank
+    query = SearchQuery(terms, config=SEARCH_CONFIG, search_type='websearch')
+    return (queryset
+            .alias(search_vector=get_search_vector())
+            .filter(search_vector=query)
+            .annotate(search_rank=SearchRank(F('search_vector'), query, cover_density=True)))
+
+
+def search_fallback(queryset, terms):
+    """Search without index, used on databases which have no
+    supported full-text index
+    """
+    for word in terms.split():
+        queryset = queryset.filter(Q(entry_title__icontains=word) | Q(summary__icontains=word))
+    return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+def search_datasets(queryset, terms):
+    """Filters a Dataset queryset with a full-text search on `terms`
+    and annotates it with the relevance of each dataset
+    """
+    if not terms.split():
+        return queryset
+    vendor = connections[queryset.db].vendor
+    if vendor == 'sqlite':
+        return search_sqlite(queryset, terms)
+    if vendor == 'postgresql':
+        return search_postgresql(queryset, terms)
+    return search_fallback(queryset, terms)
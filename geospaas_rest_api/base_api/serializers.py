@@ -48,6 +48,9 @@ class RoleSerializer(rest_framework.serializers.ModelSerializer):
 
 class DatasetSerializer(rest_framework.serializers.ModelSerializer):
     """Serializer for Dataset objects"""
+    # relevance of the dataset, only present in full-text search results
+    search_rank = rest_framework.serializers.FloatField(read_only=True)
+
     class Meta:
         model = geospaas.catalog.models.Dataset
         fields = '__all__'
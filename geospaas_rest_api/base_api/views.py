@@ -1,104 +1,168 @@
 """Views for the base geospaas API"""
 import geospaas.catalog.models
 import geospaas.vocabularies.models
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
 from rest_framework.viewsets import ReadOnlyModelViewSet
 
+import geospaas_rest_api.base_api.backends as backends
+import geospaas_rest_api.base_api.cost as cost
+import geospaas_rest_api.base_api.facets as facets
+import geospaas_rest_api.base_api.filter_tree as filter_tree
 import geospaas_rest_api.base_api.filters as filters
+import geospaas_rest_api.base_api.grid as grid
+import geospaas_rest_api.base_api.histogram as histogram
 import geospaas_rest_api.base_api.serializers as serializers
+import geospaas_rest_api.pagination as pagination
 
 
-class GeographicLocationViewSet(ReadOnlyModelViewSet):
+class CostGuardedViewSet(backends.CostGuardMixin, cost.StatementTimeoutMixin,
+                         ReadOnlyModelViewSet):
+    """Read-only viewset whose filters are checked by the cost policy
+    and whose list queries are run with the statement timeout
+    """
+
+
+class GeographicLocationViewSet(CostGuardedViewSet):
     """API endpoint to view GeographicLocations"""
     queryset = geospaas.catalog.models.GeographicLocation.objects.all()
     serializer_class = serializers.GeographicLocationSerializer
     filterset_class = filters.GeographicLocationFilter
 
 
-class SourceViewSet(ReadOnlyModelViewSet):
+class SourceViewSet(CostGuardedViewSet):
     """API endpoint to view Sources"""
     queryset = geospaas.catalog.models.Source.objects.all()
     serializer_class = serializers.SourceSerializer
     filterset_class = filters.SourceFilter
 
 
-class InstrumentViewSet(ReadOnlyModelViewSet):
+class InstrumentViewSet(CostGuardedViewSet):
     """API endpoint to view Instruments"""
     queryset = geospaas.vocabularies.models.Instrument.objects.all()
     serializer_class = serializers.InstrumentSerializer
     filterset_class = filters.InstrumentFilter
 
 
-class PlatformViewSet(ReadOnlyModelViewSet):
+class PlatformViewSet(CostGuardedViewSet):
     """API endpoint to view Platforms"""
     queryset = geospaas.vocabularies.models.Platform.objects.all()
     serializer_class = serializers.PlatformSerializer
     filterset_class = filters.PlatformFilter
 
 
-class PersonnelViewSet(ReadOnlyModelViewSet):
+class PersonnelViewSet(CostGuardedViewSet):
     """API endpoint to view Personnel objects"""
     queryset = geospaas.catalog.models.Personnel.objects.all()
     serializer_class = serializers.PersonnelSerializer
     filterset_class = filters.PersonnelFilter
 
 
-class RoleViewSet(ReadOnlyModelViewSet):
+class RoleViewSet(CostGuardedViewSet):
     """API endpoint to view Roles"""
     queryset = geospaas.catalog.models.Role.objects.all()
     serializer_class = serializers.RoleSerializer
     filterset_class = filters.RoleFilter
 
 
-class DatasetViewSet(ReadOnlyModelViewSet):
+class DatasetViewSet(CostGuardedViewSet):
     """API endpoint to view Datasets"""
     queryset = geospaas.catalog.models.Dataset.objects.all().order_by('time_coverage_start')
     serializer_class = serializers.DatasetSerializer
     filterset_class = filters.DatasetFilter
 
-
-class ParameterViewSet(ReadOnlyModelViewSet):
+    @property
+    def paginator(self):
+        """Orders the results of full-text searches by relevance"""
+        if not hasattr(self, '_paginator') and self.request.query_params.get('q', '').strip():
+            self._paginator = pagination.RankOrderedCursorPagination()
+        return super().paginator
+
+    @action(detail=False, methods=['post'])
+    def search(self, request):
+        """Searches for datasets using the JSON filter tree given in the
+        "filter" property of the request body
+        """
+        if not isinstance(request.data, dict):
+            raise ValidationError('The request body must be an object')
+        queryset = filter_tree.filter_queryset(
+            self.get_queryset(), self.filterset_class, request.data.get('filter'), request, self)
+        with cost.statement_timeout():
+            page = self.paginate_queryset(queryset)
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+    @action(detail=False)
+    def facets(self, request):
+        """Counts the datasets matching the filters for each value of
+        the facets given in the "facets" query parameter
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        with cost.statement_timeout():
+            return Response(facets.get_facet_counts(
+                queryset, self.filterset_class, request.query_params))
+
+    @action(detail=False)
+    def histogram(self, request):
+        """Counts the datasets matching the filters per time bucket"""
+        queryset = self.filter_queryset(self.get_queryset())
+        with cost.statement_timeout():
+            return Response(histogram.get_histogram(queryset, request.query_params))
+
+    @action(detail=False)
+    def grid(self, request):
+        """Counts the datasets whose footprint intersects each cell of a
+        regular lat/lon grid
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        with cost.statement_timeout():
+            return Response(grid.get_grid(queryset, request.query_params))
+
+
+class ParameterViewSet(CostGuardedViewSet):
     """API endpoint to view Parameters"""
     queryset = geospaas.vocabularies.models.Parameter.objects.all()
     serializer_class = serializers.ParameterSerializer
     filterset_class = filters.ParameterFilter
 
 
-class DatasetURIViewSet(ReadOnlyModelViewSet):
+class DatasetURIViewSet(CostGuardedViewSet):
     """API endpoint to view DatasetURIs"""
     queryset = geospaas.catalog.models.DatasetURI.objects.all()
     serializer_class = serializers.DatasetURISerializer
     filterset_class = filters.DatasetURIFilter
 
 
-class DatasetRelationshipViewSet(ReadOnlyModelViewSet):
+class DatasetRelationshipViewSet(CostGuardedViewSet):
     """API endpoint to view DatasetRelationships"""
     queryset = geospaas.catalog.models.DatasetRelationship.objects.all()
     serializer_class = serializers.DatasetRelationshipSerializer
     filterset_class = filters.DatasetRelationshipFilter
 
 
-class DataCenterViewSet(ReadOnlyModelViewSet):
+class DataCenterViewSet(CostGuardedViewSet):
     """API endpoint to view DataCenters"""
     queryset = geospaas.vocabularies.models.DataCenter.objects.all()
     serializer_class = serializers.DataCenterSerializer
     filterset_class = filters.DataCenterFilter
 
 
-class ISOTopicCategoryViewSet(ReadOnlyModelViewSet):
+class ISOTopicCategoryViewSet(CostGuardedViewSet):
     """API endpoint to view ISOTopicCategories"""
     queryset = geospaas.vocabularies.models.ISOTopicCategory.objects.all()
     serializer_class = serializers.ISOTopicCategorySerializer
     filterset_class = filters.ISOTopicCategoryFilter
 
 
-class ScienceKeywordViewSet(ReadOnlyModelViewSet):
+class ScienceKeywordViewSet(CostGuardedViewSet):
     """API endpoint to view ScienceKeywords"""
     queryset = geospaas.vocabularies.models.ScienceKeyword.objects.all()
     serializer_class = serializers.ScienceKeywordSerializer
     filterset_class = filters.ScienceKeywordFilter
 
 
-class LocationViewSet(ReadOnlyModelViewSet):
+class LocationViewSet(CostGuardedViewSet):
     """API endpoint to view Locations"""
     queryset = geospaas.vocabularies.models.Location.objects.all()
     serializer_class = serializers.LocationSerializer
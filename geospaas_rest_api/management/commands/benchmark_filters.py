@@ -0,0 +1,164 @@
+"""Compares the query plans and latencies of the dataset filter backends
+on a generated catalog
+"""
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.gis.geos import Polygon
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+import geospaas.catalog.models as catalog_models
+import geospaas.vocabularies.models as vocabularies_models
+from geospaas_rest_api.base_api.backends import CostGuardFilterBackend, JoinFilterBackend
+from geospaas_rest_api.base_api.views import DatasetViewSet
+
+
+BACKENDS = (
+    ('subquery', CostGuardFilterBackend),
+    ('join', JoinFilterBackend),
+)
+
+# words used in the titles and summaries of the generated datasets
+TOPIC_WORDS = (
+    'sea', 'ice', 'wind', 'wave', 'temperature', 'salinity', 'chlorophyll', 'current',
+    'arctic', 'ocean', 'surface', 'height', 'radar', 'altimeter', 'forecast', 'reanalysis',
+    'drift', 'concentration', 'thickness', 'precipitation')
+FILLER_WORDS = tuple(f"word{i}" for i in range(2000))
+
+DEFAULT_QUERIES = (
+    'source__platform__short_name=PLATFORM_1',
+    'source__platform__short_name=PLATFORM_1&source__instrument__short_name__startswith=INSTR',
+    'parameters__short_name=param_3',
+    'parameters__gcmd_science_keyword__topic=TOPIC_2&data_center__short_name=CENTER_1',
+    'source__instrument__short_name=INSTRUMENT_2&parameters__units=K'
+    '&time_coverage_start__gte=2020-06-01T00:00:00Z',
+)
+
+
+def generate_catalog(datasets_count, seed=0):
+    """Creates a catalog of `datasets_count` datasets with their
+    vocabulary objects
+    """
+    rand = random.Random(seed)
+    platforms = vocabularies_models.Platform.objects.bulk_create(
+        vocabularies_models.Platform(category='Earth Observation Satellites',
+                                     short_name=f"PLATFORM_{i}", long_name=f"Platform {i}")
+        for i in range(20))
+    instruments = vocabularies_models.Instrument.objects.bulk_create(
+        vocabularies_models.Instrument(category='Earth Remote Sensing Instruments',
+                                       short_name=f"INSTRUMENT_{i}", long_name=f"Instrument {i}")
+        for i in range(20))
+    sources = catalog_models.Source.objects.bulk_create(
+        catalog_models.Source(platform=platform, instrument=instrument,
+                              specs=f"benchmark {i}")
+        for i, (platform, instrument) in enumerate(
+            (rand.choice(platforms), rand.choice(instruments)) for _ in range(50)))
+    data_centers = vocabularies_models.DataCenter.objects.bulk_create(
+        vocabularies_models.DataCenter(bucket_level0='ACADEMIC', short_name=f"CENTER_{i}")
+        for i in range(10))
+    iso_topic_category = vocabularies_models.ISOTopicCategory.objects.create(
+        name='Benchmark')
+    location = vocabularies_models.Location.objects.create(
+        category='VERTICAL LOCATION', type='Benchmark')
+    keywords = vocabularies_models.ScienceKeyword.objects.bulk_create(
+        vocabularies_models.ScienceKeyword(category='EARTH SCIENCE', topic=f"TOPIC_{i}",
+                                           term=f"TERM_{i}")
+        for i in range(10))
+    parameters = vocabularies_models.Parameter.objects.bulk_create(
+        vocabularies_models.Parameter(standard_name=f"parameter_{i}", short_name=f"param_{i}",
+                                      units=rand.choice(('K', 'm', 'm/s', '1')),
+                                      gcmd_science_keyword=rand.choice(keywords))
+        for i in range(100))
+
+    locations = []
+    for _ in range(datasets_count):
+        lon, lat = rand.uniform(-180, 170), rand.uniform(-90, 80)
+        locations.append(catalog_models.GeographicLocation(
+            geometry=Polygon.from_bbox((lon, lat, lon + 10, lat + 10))))
+    locations = catalog_models.GeographicLocation.objects.bulk_create(locations)
+
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    datasets = catalog_models.Dataset.objects.bulk_create(
+        catalog_models.Dataset(
+            entry_id=f"benchmark_{i}",
+            entry_title=' '.join(rand.sample(TOPIC_WORDS, 3)) + f" {i}",
+            summary=' '.join(rand.choices(TOPIC_WORDS + FILLER_WORDS, k=40)),
+            time_coverage_start=start + timedelta(hours=i),
+            time_coverage_end=start + timedelta(hours=i + 1),
+            source=rand.choice(sources), geographic_location=location_object,
+            data_center=rand.choice(data_centers), gcmd_location=location,
+            ISO_topic_category=iso_topic_category)
+        for i, location_object in enumerate(locations))
+
+    through_model = catalog_models.Dataset.parameters.through
+    through_model.objects.bulk_create(
+        through_model(dataset_id=dataset.id, parameter_id=parameter.id)
+        for dataset in datasets
+        for parameter in rand.sample(parameters, rand.randint(1, 5)))
+
+
+def filter_datasets(backend_class, query_string):
+    """Returns the dataset queryset filtered by a backend"""
+    view = DatasetViewSet()
+    request = Request(APIRequestFactory().get(f"/api/datasets/?{query_string}"))
+    view.request = request
+    return backend_class().filter_queryset(request, view.get_queryset(), view)
+
+
+def measure(backend_class, query_string, repeat, page_size):
+    """Returns the median time in milliseconds taken to count the
+    matching datasets and fetch the first page, and the number of
+    matching datasets
+    """
+    durations = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        queryset = filter_datasets(backend_class, query_string)
+        count = queryset.count()
+        list(queryset[:page_size])
+        durations.append((time.perf_counter() - begin) * 1000)
+    return statistics.median(durations), count
+
+
+class Command(BaseCommand):
+    help = ("Generates a dataset catalog in a transaction which is rolled back, and compares "
+            "the query plans and latencies of the filter backends on nested filters.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--datasets', type=int, default=10000,
+            help='Number of generated datasets.')
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Number of times each query is run.')
+        parser.add_argument(
+            '--page-size', type=int, default=100,
+            help='Number of datasets fetched after counting.')
+        parser.add_argument(
+            '--query', action='append',
+            help='Query string to benchmark. Can be given several times.')
+        parser.add_argument(
+            '--explain', action='store_true',
+            help='Display the query plans.')
+
+    def handle(self, *args, **options):
+        if options['datasets'] < 1 or options['repeat'] < 1:
+            raise CommandError('The number of datasets and repetitions must be positive')
+
+        with transaction.atomic():
+            generate_catalog(options['datasets'])
+            for query_string in options['query'] or DEFAULT_QUERIES:
+                self.stdout.write(query_string)
+                for name, backend_class in BACKENDS:
+                    duration, count = measure(
+                        backend_class, query_string, options['repeat'], options['page_size'])
+                    self.stdout.write(f"  {name}: {duration:.1f} ms ({count} datasets)")
+                    if options['explain']:
+                        plan = filter_datasets(backend_class, query_string).explain()
+                        self.stdout.write('    ' + plan.replace('\n', '\n    '))
+            transaction.set_rollback(True)
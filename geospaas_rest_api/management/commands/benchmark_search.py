@@ -0,0 +1,80 @@
+"""Compares the full-text search of the datasets with the `icontains`
+lookups on a generated catalog
+"""
+import statistics
+import time
+from urllib.parse import quote
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from geospaas_rest_api.base_api.backends import CostGuardFilterBackend
+from geospaas_rest_api.management.commands.benchmark_filters import (filter_datasets,
+                                                                     generate_catalog)
+
+
+DEFAULT_TERMS = ('ice', 'wind', 'salinity', 'word42')
+
+# query strings compared for each term, and the ordering of the results
+SEARCH_METHODS = (
+    ('full-text', 'q={}', ('-search_rank', 'pk')),
+    ('title icontains', 'entry_title__icontains={}', ('pk',)),
+    ('summary icontains', 'summary__icontains={}', ('pk',)),
+)
+
+
+def measure(query_string, ordering, repeat, page_size):
+    """Returns the median time in milliseconds taken to count the
+    matching datasets and fetch the first page, and the number of
+    matching datasets
+    """
+    durations = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        queryset = filter_datasets(CostGuardFilterBackend, query_string).order_by(*ordering)
+        count = queryset.count()
+        list(queryset[:page_size])
+        durations.append((time.perf_counter() - begin) * 1000)
+    return statistics.median(durations), count
+
+
+class Command(BaseCommand):
+    help = ("Generates a dataset catalog in a transaction which is rolled back, and compares "
+            "the full-text search with the icontains lookups on the titles and summaries.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--datasets', type=int, default=10000,
+            help='Number of generated datasets.')
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Number of times each query is run.')
+        parser.add_argument(
+            '--page-size', type=int, default=100,
+            help='Number of datasets fetched after counting.')
+        parser.add_argument(
+            '--term', action='append',
+            help='Searched word. Can be given several times.')
+        parser.add_argument(
+            '--explain', action='store_true',
+            help='Display the query plans.')
+
+    def handle(self, *args, **options):
+        if options['datasets'] < 1 or options['repeat'] < 1:
+            raise CommandError('The number of datasets and repetitions must be positive')
+
+        with transaction.atomic():
+            generate_catalog(options['datasets'])
+            for term in options['term'] or DEFAULT_TERMS:
+                self.stdout.write(term)
+                for name, query_string, ordering in SEARCH_METHODS:
+                    query_string = query_string.format(quote(term))
+                    duration, count = measure(
+                        query_string, ordering, options['repeat'], options['page_size'])
+                    self.stdout.write(f"  {name}: {duration:.1f} ms ({count} datasets)")
+                    if options['explain']:
+                        plan = (filter_datasets(CostGuardFilterBackend, query_string)
+                                .order_by(*ordering)
+                                .explain())
+                        self.stdout.write('    ' + plan.replace('\n', '\n    '))
+            transaction.set_rollback(True)
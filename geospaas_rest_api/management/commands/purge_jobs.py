@@ -0,0 +1,47 @@
+"""Removes old jobs and task results"""
+from django.core.management.base import BaseCommand, CommandError
+
+try:
+    import geospaas_rest_api.processing_api.retention as retention
+except ImportError:  # pragma: no cover
+    retention = None
+
+
+class Command(BaseCommand):
+    help = ("Removes the jobs and task results which finished more than a given number of days "
+            "ago, optionally archiving them in a compressed file first.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            help=('Retention period in days. Defaults to the '
+                  'GEOSPAAS_REST_API_RETENTION_DAYS setting.'))
+        parser.add_argument(
+            '--batch-size', type=int,
+            help='Number of rows deleted in each transaction.')
+        parser.add_argument(
+            '--archive-dir',
+            help='Directory in which the removed rows are archived before being deleted.')
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='Number of seconds to wait between two batches.')
+
+    def handle(self, *args, **options):
+        if retention is None:
+            raise CommandError('The processing API is not available')
+        days = options['days']
+        if days is None:
+            days = retention.get_setting('DAYS', None)
+        if days is None:
+            raise CommandError('The retention period must be given with --days or the '
+                               'GEOSPAAS_REST_API_RETENTION_DAYS setting')
+        if days < 0:
+            raise CommandError('The retention period must be positive')
+
+        removed = retention.purge(
+            days,
+            batch_size=options['batch_size'],
+            archive_dir=options['archive_dir'] or retention.get_setting('ARCHIVE_DIR', None),
+            pause=options['pause'])
+        self.stdout.write(
+            f"Removed {removed['jobs']} jobs and {removed['task_results']} task results")
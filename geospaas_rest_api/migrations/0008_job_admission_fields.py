@@ -0,0 +1,38 @@
+# Generated by Django 3.2 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geospaas_rest_api', '0007_workdircleanupjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='action',
+            field=models.CharField(blank=True, default='', help_text='Action performed by the job', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='date_done',
+            field=models.DateTimeField(blank=True, help_text='Datetime: date at which the job was seen finished', null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='parameters',
+            field=models.JSONField(blank=True, default=dict, help_text='Parameters given when the job was submitted'),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='status',
+            field=models.CharField(default='PENDING', help_text='Last known status of the job', max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='job',
+            name='task_id',
+            field=models.CharField(blank=True, help_text='ID of the last task in the job', max_length=255, null=True, unique=True),
+        ),
+    ]
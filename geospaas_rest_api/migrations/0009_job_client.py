@@ -0,0 +1,26 @@
+# Generated by Django 3.2 on 2026-10-19 10:05
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('geospaas_rest_api', '0008_job_admission_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='client',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='Identifier of the client which submitted the job', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='user',
+            field=models.ForeignKey(blank=True, help_text='User who submitted the job', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
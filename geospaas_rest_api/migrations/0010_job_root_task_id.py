@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-19 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geospaas_rest_api', '0009_job_client'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='root_task_id',
+            field=models.CharField(blank=True, db_index=True, help_text='ID of the first task in the job, shared by all its tasks', max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2 on 2026-10-19 12:41
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geospaas_rest_api', '0010_job_root_task_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='callback_url',
+            field=models.URLField(blank=True, default='', help_text='URL to which the job status is sent when the job is finished', max_length=2000),
+        ),
+        migrations.CreateModel(
+            name='JobCallback',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=2000)),
+                ('payload', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('status', models.CharField(choices=[('PENDING', 'PENDING'), ('DELIVERED', 'DELIVERED'), ('FAILED', 'FAILED')], default='PENDING', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_delivered', models.DateTimeField(blank=True, null=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='callbacks', to='geospaas_rest_api.job')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='jobcallback',
+            index=models.Index(fields=['status', 'next_attempt'], name='jobcallback_due_idx'),
+        ),
+    ]
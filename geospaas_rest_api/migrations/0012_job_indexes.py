@@ -0,0 +1,30 @@
+# Generated by Django 3.2 on 2026-10-19 13:05
+
+from django.db import migrations, models
+import django.db.models.fields.json
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geospaas_rest_api', '0011_job_callbacks'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['action', 'status'], name='job_action_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status'], name='job_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['date_done'], name='job_date_done_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(django.db.models.fields.json.KeyTransform('dataset_id', 'parameters'), name='job_dataset_id_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2 on 2026-10-19 13:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geospaas_rest_api', '0012_job_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='date_dispatched',
+            field=models.DateTimeField(blank=True, help_text='Datetime: date at which the tasks were sent to the broker', null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='steps',
+            field=models.JSONField(blank=True, default=list, help_text='IDs and names of the tasks of the job, in execution order'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2 on 2026-10-19 15:02
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geospaas_rest_api', '0014_jobsubmission'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HarvestSchedule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('search_config_dict', models.JSONField(default=dict, help_text='Search configuration, without time range')),
+                ('shard_days', models.PositiveIntegerField(blank=True, help_text='Length in days of the time windows harvested in parallel', null=True)),
+                ('interval', models.DurationField(help_text='Time between two runs')),
+                ('overlap', models.DurationField(default=datetime.timedelta(0), help_text='Time before the high-water mark which is harvested again at each run, to catch data published late')),
+                ('high_water_mark', models.DateTimeField(help_text='End of the time range harvested by the last successful run')),
+                ('pending_mark', models.DateTimeField(blank=True, help_text='End of the time range harvested by the running job', null=True)),
+                ('next_run', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('enabled', models.BooleanField(default=True)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('last_job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='geospaas_rest_api.job')),
+            ],
+        ),
+    ]
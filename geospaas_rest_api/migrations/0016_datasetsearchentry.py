@@ -0,0 +1,93 @@
+# Generated by Django 3.2 on 2026-10-19 16:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+import geospaas_rest_api.base_api.search
+
+
+FTS_TABLE = 'geospaas_rest_api_dataset_search'
+POSTGRESQL_INDEX = 'geospaas_rest_api_dataset_search_idx'
+
+SQLITE_CREATE = (
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+    "entry_title, summary, content='catalog_dataset', content_rowid='id', "
+    "tokenize='porter unicode61')",
+    # the words of the titles weigh more than the words of the summaries
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES('rank', 'bm25(10.0, 1.0)')",
+    f"CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON catalog_dataset BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, entry_title, summary) "
+    "VALUES (new.id, new.entry_title, new.summary); END",
+    f"CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON catalog_dataset BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, entry_title, summary) "
+    "VALUES ('delete', old.id, old.entry_title, old.summary); END",
+    f"CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE OF entry_title, summary "
+    "ON catalog_dataset BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, entry_title, summary) "
+    "VALUES ('delete', old.id, old.entry_title, old.summary); "
+    f"INSERT INTO {FTS_TABLE}(rowid, entry_title, summary) "
+    "VALUES (new.id, new.entry_title, new.summary); END",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('rebuild')",
+)
+
+SQLITE_DROP = (
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_insert",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_delete",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_update",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+)
+
+
+def get_postgresql_index():
+    """Returns the GIN index on the search vector of the datasets. The
+    expression must stay identical to the one used by the queries.
+    """
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+    return GinIndex(
+        SearchVector('entry_title', config='english', weight='A') +
+        SearchVector('summary', config='english', weight='B'),
+        name=POSTGRESQL_INDEX)
+
+
+def create_search_index(apps, schema_editor):
+    """Creates the full-text index of the datasets"""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for statement in SQLITE_CREATE:
+            schema_editor.execute(statement)
+    elif vendor == 'postgresql':
+        schema_editor.add_index(apps.get_model('catalog', 'Dataset'), get_postgresql_index())
+
+
+def drop_search_index(apps, schema_editor):
+    """Removes the full-text index of the datasets"""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for statement in SQLITE_DROP:
+            schema_editor.execute(statement)
+    elif vendor == 'postgresql':
+        schema_editor.remove_index(apps.get_model('catalog', 'Dataset'), get_postgresql_index())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '__first__'),
+        ('geospaas_rest_api', '0015_harvestschedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetSearchEntry',
+            fields=[
+                ('dataset', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='catalog.dataset')),
+                ('document', geospaas_rest_api.base_api.search.FullTextDocumentField(db_column='geospaas_rest_api_dataset_search')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'geospaas_rest_api_dataset_search',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
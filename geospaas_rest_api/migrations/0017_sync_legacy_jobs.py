@@ -0,0 +1,47 @@
+# Generated by Django 3.2 on 2026-10-19 18:40
+
+from django.db import migrations
+from django.utils import timezone
+
+
+READY_STATES = ('SUCCESS', 'FAILURE', 'REVOKED')
+FINISHED_STATES = (*READY_STATES, 'CANCELLED', 'EXPIRED')
+
+
+def sync_legacy_jobs(apps, schema_editor):
+    """Sets the status of the jobs created before it was stored in the
+    database, from the states of their first and last tasks known by the
+    result backend. The jobs whose tasks have no result yet are left
+    pending: they may still be queued, and are expired by the stale jobs
+    sync if they never start.
+    """
+    Job = apps.get_model('geospaas_rest_api', 'Job')
+    TaskResult = apps.get_model('django_celery_results', 'TaskResult')
+    now = timezone.now()
+    for job in Job.objects.filter(action='').exclude(status__in=FINISHED_STATES).iterator():
+        task_results = dict(
+            (task_id, (status, date_done))
+            for task_id, status, date_done in (
+                TaskResult.objects
+                .filter(task_id__in=[job.task_id, job.root_task_id])
+                .values_list('task_id', 'status', 'date_done')))
+        status, date_done = task_results.get(job.task_id, (None, None))
+        if status in READY_STATES:
+            job.status, job.date_done = status, date_done or now
+        elif task_results:
+            job.status = 'STARTED'
+        else:
+            job.status = 'PENDING'
+        job.save(update_fields=['status', 'date_done'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_celery_results', '0001_initial'),
+        ('geospaas_rest_api', '0016_datasetsearchentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(sync_legacy_jobs, migrations.RunPython.noop),
+    ]
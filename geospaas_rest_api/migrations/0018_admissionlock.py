@@ -0,0 +1,25 @@
+# Generated by Django 3.2 on 2026-10-19 19:05
+
+from django.db import migrations, models
+
+
+def create_lock(apps, schema_editor):
+    """Creates the row locked during the admission of jobs"""
+    apps.get_model('geospaas_rest_api', 'AdmissionLock').objects.get_or_create(id=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geospaas_rest_api', '0017_sync_legacy_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdmissionLock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+        migrations.RunPython(create_lock, migrations.RunPython.noop),
+    ]
@@ -4,8 +4,15 @@ try:
 except ImportError:  # pragma: no cover
     geospaas_processing = None
 
+from geospaas_rest_api.base_api.models import DatasetSearchEntry
+
 if geospaas_processing:
-    from geospaas_rest_api.processing_api.models import (Job,
+    from geospaas_rest_api.processing_api.models import (JOB_CLASSES,
+                                                         Job,
+                                                         JobCallback,
+                                                         JobSubmission,
+                                                         AdmissionLock,
+                                                         HarvestSchedule,
                                                          DownloadJob,
                                                          ConvertJob,
                                                          SyntoolCleanupJob,
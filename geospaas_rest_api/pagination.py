@@ -11,6 +11,13 @@ class PKOrderedCursorPagination(CursorPagination):
     page_size_query_param = 'page_size'
 
 
+class RankOrderedCursorPagination(PKOrderedCursorPagination):
+    """Pagination class ordering the results of a full-text search by
+    decreasing relevance
+    """
+    ordering = ('-search_rank', 'pk')
+
+
 class DateOrderedCursorPagination(CursorPagination):
     """Pagination class ordering by decreasing date_created"""
     ordering = '-date_created'
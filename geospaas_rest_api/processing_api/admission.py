@@ -0,0 +1,368 @@
+"""Admission control and scheduling for jobs: limits the number of
+jobs which are running at the same time, globally, for each action and
+for each client, and shares the available slots fairly between clients.
+
+The limits are read from the following Django settings:
+  - GEOSPAAS_REST_API_MAX_RUNNING_JOBS: maximum number of running
+    jobs. No limit if None (default).
+  - GEOSPAAS_REST_API_MAX_RUNNING_JOBS_PER_ACTION: dictionary
+    associating an action name to the maximum number of running jobs
+    performing this action.
+  - GEOSPAAS_REST_API_MAX_RUNNING_JOBS_PER_CLIENT: maximum number of
+    running jobs for each client. No limit if None (default).
+  - GEOSPAAS_REST_API_CLIENT_QUOTAS: dictionary associating a client
+    identifier to its maximum number of running jobs. Overrides
+    GEOSPAAS_REST_API_MAX_RUNNING_JOBS_PER_CLIENT.
+  - GEOSPAAS_REST_API_CLIENT_WEIGHTS: dictionary associating a client
+    identifier to its share of the running jobs when several clients
+    have queued jobs (default 1).
+  - GEOSPAAS_REST_API_QUEUE_EXCESS_JOBS: if True, jobs which exceed
+    the limits are stored in the database and sent to the broker later
+    by `release_queued_jobs()`, when running jobs end or periodically.
+    If False (default), they are rejected and the slots are not shared
+    between clients.
+  - GEOSPAAS_REST_API_THROUGHPUT_WINDOW: duration in seconds of the
+    window used to compute the recent job throughput (default 600).
+  - GEOSPAAS_REST_API_MAX_RETRY_AFTER: maximum number of seconds
+    advertised to clients whose jobs are rejected (default 3600).
+  - GEOSPAAS_REST_API_STALE_JOB_TIMEOUT: number of seconds after which
+    the status of a running job is checked in the result backend by
+    `sync_stale_jobs()` (default 86400).
+"""
+import collections
+import hashlib
+import math
+from datetime import timedelta
+
+import celery.states
+import django_celery_results.models
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+from rest_framework.exceptions import Throttled
+
+import geospaas_rest_api.models as models
+import geospaas_rest_api.processing_api.outbox as outbox
+
+
+# Number of queued jobs of a client among which release_queued_jobs()
+# looks for a job which is not blocked by a limit
+QUEUE_LOOKAHEAD = 10
+
+
+class JobLimitExceeded(Throttled):
+    """Error returned when a job is rejected because too many jobs are
+    already running. The response has a 429 status code and a
+    Retry-After header.
+    """
+    default_detail = 'Too many jobs are running.'
+    default_code = 'job_limit_exceeded'
+
+
+class RunningJobsCounter(collections.Counter):
+    """Number of running jobs for each (action, client) couple"""
+
+    def total(self):
+        """Total number of running jobs"""
+        return sum(self.values())
+
+    def for_action(self, action):
+        """Number of running jobs performing `action`"""
+        return sum(count for (job_action, _), count in self.items() if job_action == action)
+
+    def for_client(self, client):
+        """Number of running jobs submitted by `client`"""
+        return sum(count for (_, job_client), count in self.items() if job_client == client)
+
+
+def get_global_limit():
+    """Returns the maximum number of running jobs"""
+    return getattr(settings, 'GEOSPAAS_REST_API_MAX_RUNNING_JOBS', None)
+
+
+def get_action_limits():
+    """Returns the dictionary of limits per action"""
+    return getattr(settings, 'GEOSPAAS_REST_API_MAX_RUNNING_JOBS_PER_ACTION', {})
+
+
+def get_client_limit(client):
+    """Returns the maximum number of running jobs for `client`"""
+    return getattr(settings, 'GEOSPAAS_REST_API_CLIENT_QUOTAS', {}).get(
+        client, getattr(settings, 'GEOSPAAS_REST_API_MAX_RUNNING_JOBS_PER_CLIENT', None))
+
+
+def get_client_weight(client):
+    """Returns the weight of `client` in the sharing of running jobs"""
+    return getattr(settings, 'GEOSPAAS_REST_API_CLIENT_WEIGHTS', {}).get(client, 1)
+
+
+def queue_excess_jobs():
+    """Returns True if jobs exceeding the limits should be queued
+    instead of rejected
+    """
+    return getattr(settings, 'GEOSPAAS_REST_API_QUEUE_EXCESS_JOBS', False)
+
+
+def get_client_id(request):
+    """Returns the identifier of the client which sent `request`: the
+    user name if the user is authenticated, a digest of the
+    authentication token if there is one, or the client's address
+    """
+    if request is None:
+        return ''
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.get_username()}"
+    auth = getattr(request, 'auth', None)
+    if auth is not None:
+        token = str(getattr(auth, 'key', auth)).encode()
+        return f"token:{hashlib.sha256(token).hexdigest()[:16]}"
+    return f"address:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def running_jobs():
+    """Returns a queryset of the jobs which have been sent to the
+    broker and are not known to be finished
+    """
+    return (models.Job.objects
+            .filter(task_id__isnull=False)
+            .exclude(status__in=models.Job.FINISHED_STATES))
+
+
+def queued_jobs():
+    """Returns a queryset of the jobs waiting in the database, in
+    submission order
+    """
+    return models.Job.objects.filter(status=models.Job.QUEUED).order_by('id')
+
+
+def sync_stale_jobs(now=None, batch_size=500):
+    """Updates the status of the running jobs which were dispatched
+    more than GEOSPAAS_REST_API_STALE_JOB_TIMEOUT seconds ago, using
+    the result backend. This catches the jobs whose end was missed by
+    the signal handlers, for example because a worker was killed. The
+    jobs none of whose tasks has a result anymore are marked as
+    expired, so they do not hold a slot forever.
+    Returns the number of updated jobs.
+    """
+    timeout = getattr(settings, 'GEOSPAAS_REST_API_STALE_JOB_TIMEOUT', 86400)
+    cutoff = (now or timezone.now()) - timedelta(seconds=timeout)
+    stale_jobs = running_jobs().filter(
+        Q(date_dispatched__lt=cutoff) |
+        Q(date_dispatched__isnull=True, date_created__lt=cutoff)).order_by('id')
+
+    updated = 0
+    last_id = 0
+    while True:
+        jobs = list(stale_jobs.filter(id__gt=last_id)[:batch_size])
+        if not jobs:
+            return updated
+        last_id = jobs[-1].id
+        task_ids = {task_id for job in jobs for task_id in job.get_task_ids()}
+        states = dict(django_celery_results.models.TaskResult.objects
+                      .filter(task_id__in=task_ids)
+                      .values_list('task_id', 'status'))
+        for job in jobs:
+            status = job.get_status_from_states(states)
+            if status == celery.states.PENDING:
+                status = models.Job.EXPIRED
+            if status != job.status and job.set_status(status):
+                updated += 1
+
+
+def count_running_jobs():
+    """Returns a RunningJobsCounter for the currently running jobs"""
+    return RunningJobsCounter({
+        (action, client): count
+        for action, client, count in (running_jobs()
+                                      .order_by()
+                                      .values_list('action', 'client')
+                                      .annotate(count=Count('id')))
+    })
+
+
+def limits_apply(job):
+    """Returns True if any of the limits applies to `job`"""
+    return (get_global_limit() is not None or
+            get_action_limits().get(job.action) is not None or
+            get_client_limit(job.client) is not None)
+
+
+def get_excess(job, running=None):
+    """Returns the number of running jobs which need to finish before
+    `job` can be run. `running` is a RunningJobsCounter; it is
+    retrieved from the database if not provided.
+    """
+    if not limits_apply(job):
+        return 0
+    if running is None:
+        running = count_running_jobs()
+
+    excess = 0
+    global_limit = get_global_limit()
+    if global_limit is not None:
+        excess = max(excess, running.total() - global_limit + 1)
+    action_limit = get_action_limits().get(job.action)
+    if action_limit is not None:
+        excess = max(excess, running.for_action(job.action) - action_limit + 1)
+    client_limit = get_client_limit(job.client)
+    if client_limit is not None:
+        excess = max(excess, running.for_client(job.client) - client_limit + 1)
+    return excess
+
+
+def estimate_wait(excess):
+    """Estimates the number of seconds before `excess` running jobs
+    finish, based on the number of jobs which finished recently
+    """
+    window = getattr(settings, 'GEOSPAAS_REST_API_THROUGHPUT_WINDOW', 600)
+    max_wait = getattr(settings, 'GEOSPAAS_REST_API_MAX_RETRY_AFTER', 3600)
+    finished_count = models.Job.objects.filter(
+        date_done__gte=timezone.now() - timedelta(seconds=window)).count()
+    if finished_count == 0:
+        return max_wait
+    return min(max_wait, max(1, math.ceil(excess * window / finished_count)))
+
+
+def admit(job):
+    """Checks whether `job` can be sent to the broker right away.
+    Returns True if it can. Otherwise, either marks the job as queued
+    and returns False, or raises a JobLimitExceeded exception,
+    depending on the settings.
+    """
+    queue = queue_excess_jobs()
+    if queue and limits_apply(job) and queued_jobs().exists():
+        # The slots are shared between clients by release_queued_jobs()
+        job.status = models.Job.QUEUED
+        return False
+
+    excess = get_excess(job)
+    if excess <= 0:
+        return True
+
+    if queue:
+        job.status = models.Job.QUEUED
+        return False
+    raise JobLimitExceeded(wait=estimate_wait(excess))
+
+
+def lock():
+    """Takes the admission lock until the end of the current
+    transaction, so the running jobs can be counted and a new one
+    dispatched without other jobs being admitted in the meantime
+    """
+    models.AdmissionLock.objects.select_for_update().get_or_create(id=1)
+
+
+def submit(job):
+    """Admits `job` and saves it. Its tasks are sent to the broker if
+    it is admitted, once the admission lock is released. Raises a
+    JobLimitExceeded exception if the job is rejected.
+    """
+    with transaction.atomic():
+        if limits_apply(job):
+            lock()
+        if admit(job):
+            outbox.dispatch(job)
+        else:
+            job.save()
+
+
+def dispatch_queued_job(job):
+    """Sends a queued job to the broker. Returns False if the job was
+    dispatched by someone else in the meantime.
+    """
+    with transaction.atomic():
+        if not queued_jobs().select_for_update().filter(pk=job.pk).exists():
+            return False
+        outbox.dispatch(job)
+    return True
+
+
+class ClientQueue:
+    """First jobs of the queue of a client. At most QUEUE_LOOKAHEAD jobs
+    are loaded at a time, when they are needed.
+    """
+
+    def __init__(self, client, first_id):
+        self.client = client
+        self.first_id = first_id
+        self.last_id = first_id - 1
+        self.jobs = None
+        self.exhausted = False
+
+    def fill(self):
+        """Loads the next jobs of the queue, up to QUEUE_LOOKAHEAD"""
+        self.jobs = self.jobs or []
+        missing = QUEUE_LOOKAHEAD - len(self.jobs)
+        if self.exhausted or missing <= 0:
+            return
+        jobs = list(queued_jobs().filter(client=self.client, id__gt=self.last_id)[:missing])
+        self.exhausted = len(jobs) < missing
+        if jobs:
+            self.last_id = jobs[-1].id
+        self.jobs.extend(jobs)
+
+    def pop(self, running):
+        """Removes and returns the first loaded job which is not blocked
+        by a limit, or None if there is none
+        """
+        self.fill()
+        for i, job in enumerate(self.jobs):
+            if get_excess(job, running) <= 0:
+                del self.jobs[i]
+                self.first_id = self.jobs[0].id if self.jobs else self.last_id + 1
+                return job
+        return None
+
+    def is_empty(self):
+        """Returns True if all the jobs of the queue have been taken"""
+        return self.jobs is not None and not self.jobs and self.exhausted
+
+
+def release_queued_jobs(batch_size=100):
+    """Sends queued jobs to the broker as long as the limits allow it,
+    and at most `batch_size` jobs. The other jobs are released by the
+    next call.
+
+    Each client has its own queue, in which the jobs are processed in
+    submission order. The available slots are shared between clients
+    in a weighted round robin fashion: the next job is taken from the
+    queue of the client which has the lowest number of running jobs
+    relatively to its weight. Only the first QUEUE_LOOKAHEAD jobs of a
+    queue are considered, so the cost of a call does not depend on the
+    length of the queues.
+
+    Returns the number of released jobs.
+    """
+    with transaction.atomic():
+        lock()
+        running = count_running_jobs()
+        slots = batch_size
+        global_limit = get_global_limit()
+        if global_limit is not None:
+            slots = min(slots, global_limit - running.total())
+
+        client_queues = {
+            client: ClientQueue(client, first_id)
+            for client, first_id in (queued_jobs()
+                                     .order_by()
+                                     .values_list('client')
+                                     .annotate(first_id=Min('id')))
+        } if slots > 0 else {}
+
+        released = 0
+        while client_queues and released < slots:
+            client = min(
+                client_queues,
+                key=lambda c: (running.for_client(c) / get_client_weight(c),
+                               client_queues[c].first_id))
+            client_queue = client_queues[client]
+            job = client_queue.pop(running)
+            if job is None or client_queue.is_empty():
+                del client_queues[client]
+            if job is not None and dispatch_queued_job(job):
+                running[(job.action, job.client)] += 1
+                released += 1
+    return released
@@ -0,0 +1,52 @@
+"""Bundles gathering the files produced for several datasets in one
+archive, used by the download jobs in bundle mode.
+
+The files are read from the working directory of geospaas_processing,
+which is defined by the GEOSPAAS_PROCESSING_WORK_DIR environment
+variable. The bundles are written in its `bundles` sub-directory.
+"""
+import os
+import os.path
+import tarfile
+
+from django.conf import settings
+
+
+BUNDLES_DIRECTORY = 'bundles'
+
+
+def get_working_directory():
+    """Returns the directory in which the processing tasks write their
+    files
+    """
+    return getattr(settings, 'GEOSPAAS_REST_API_BUNDLE_WORKING_DIRECTORY',
+                   os.getenv('GEOSPAAS_PROCESSING_WORK_DIR', '/tmp/test_data'))
+
+
+def get_max_size():
+    """Returns the maximum number of datasets in a bundle"""
+    return getattr(settings, 'GEOSPAAS_REST_API_MAX_BUNDLE_SIZE', 500)
+
+
+def create_bundle(results, name, working_directory=None):
+    """Writes the files listed in `results` into a tar.gz archive.
+    `results` is a list of (dataset_id, paths) couples as returned by
+    the processing tasks, the paths being relative to the working
+    directory. The files of each dataset are placed in a directory
+    named after its ID. The files are copied one by one, so they are
+    never entirely loaded in memory.
+    Returns a (name, [archive_path]) couple, which can be given to the
+    publish task.
+    """
+    working_directory = working_directory or get_working_directory()
+    bundle_path = os.path.join(BUNDLES_DIRECTORY, f"{name}.tar.gz")
+    os.makedirs(os.path.join(working_directory, BUNDLES_DIRECTORY), exist_ok=True)
+    with tarfile.open(os.path.join(working_directory, bundle_path), 'w:gz') as archive:
+        for dataset_id, paths in results:
+            if isinstance(paths, str):
+                paths = [paths]
+            for path in paths:
+                full_path = os.path.join(working_directory, path)
+                archive.add(full_path, arcname=os.path.join(
+                    str(dataset_id), os.path.basename(os.path.normpath(full_path))))
+    return name, [bundle_path]
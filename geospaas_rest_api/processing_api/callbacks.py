@@ -0,0 +1,244 @@
+"""Delivery of the job callbacks.
+
+When a job with a callback URL is finished, a JobCallback is stored in
+the database. The pending callbacks are sent by
+`deliver_pending_callbacks()`, which is run periodically by a Celery
+task, so the jobs never wait for the receivers.
+
+The callbacks going to the same URL are sent together in a POST request
+with the following JSON body: `{"events": [<job status>, ...]}`.
+
+The delivery is configured by the following Django settings:
+  - GEOSPAAS_REST_API_CALLBACK_SECRET: if set, the requests are signed
+    using HMAC-SHA256. The signature of `<timestamp>.<body>` is given
+    in the `X-Geospaas-Signature` header, and the timestamp in the
+    `X-Geospaas-Timestamp` header.
+  - GEOSPAAS_REST_API_CALLBACK_TIMEOUT: timeout of the requests in
+    seconds (default 10).
+  - GEOSPAAS_REST_API_CALLBACK_BATCH_SIZE: maximum number of events
+    sent in one request (default 50).
+  - GEOSPAAS_REST_API_CALLBACK_MAX_ATTEMPTS: number of attempts after
+    which a callback is abandoned (default 8).
+  - GEOSPAAS_REST_API_CALLBACK_RETRY_DELAY: delay in seconds before the
+    first retry. It is doubled after each failed attempt (default 30).
+  - GEOSPAAS_REST_API_CALLBACK_WORKERS: number of URLs to which
+    callbacks are sent in parallel (default 4).
+  - GEOSPAAS_REST_API_CALLBACK_ALLOWED_HOSTS: host names, addresses or
+    networks (for example '10.1.0.0/16') which can receive callbacks
+    although they are not public. By default, the callbacks are only
+    sent to public addresses.
+
+Redirections are not followed, and the requests do not go through the
+proxies defined in the environment, so the address which receives a
+callback is always the one which was checked.
+"""
+import collections
+import concurrent.futures
+import hashlib
+import hmac
+import http.client
+import ipaddress
+import json
+import time
+import urllib.error
+import urllib.request
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+import geospaas_rest_api.models as models
+
+
+# Maximum delay between two attempts
+MAX_RETRY_DELAY = timedelta(days=1)
+
+
+def get_setting(name, default):
+    """Returns the value of a callback setting"""
+    return getattr(settings, f"GEOSPAAS_REST_API_CALLBACK_{name}", default)
+
+
+def sign(secret, timestamp, body):
+    """Returns the HMAC-SHA256 hexadecimal signature of a request body"""
+    return hmac.new(
+        secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+
+
+class ForbiddenAddress(OSError):
+    """Raised when a callback URL points to an address which is not
+    allowed to receive callbacks
+    """
+
+
+def is_allowed_address(host, address):
+    """Returns True if callbacks can be sent to `address`, which `host`
+    resolved to
+    """
+    ip_address = ipaddress.ip_address(address.split('%')[0])
+    if ip_address.is_global:
+        return True
+    for allowed in get_setting('ALLOWED_HOSTS', ()):
+        if allowed == host:
+            return True
+        try:
+            if ip_address in ipaddress.ip_network(allowed, strict=False):
+                return True
+        except ValueError:
+            # host name
+            continue
+    return False
+
+
+class AddressCheckMixin:
+    """Checks the address to which an HTTP connection is opened before
+    any data is sent
+    """
+
+    def connect(self):
+        """Connects and closes the connection if the peer address is
+        not allowed
+        """
+        super().connect()
+        address = self.sock.getpeername()[0]
+        if not is_allowed_address(self.host, address):
+            self.close()
+            raise ForbiddenAddress(f"Callbacks can't be sent to {address}")
+
+
+class CheckedHTTPConnection(AddressCheckMixin, http.client.HTTPConnection):
+    """HTTP connection to allowed addresses only"""
+
+
+class CheckedHTTPSConnection(AddressCheckMixin, http.client.HTTPSConnection):
+    """HTTPS connection to allowed addresses only"""
+
+
+class CheckedHTTPHandler(urllib.request.HTTPHandler):
+    """Opens HTTP URLs using CheckedHTTPConnection"""
+
+    def http_open(self, req):
+        return self.do_open(CheckedHTTPConnection, req)
+
+
+class CheckedHTTPSHandler(urllib.request.HTTPSHandler):
+    """Opens HTTPS URLs using CheckedHTTPSConnection"""
+
+    def https_open(self, req):
+        return self.do_open(CheckedHTTPSConnection, req, context=self._context)
+
+
+class NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Makes redirection responses fail instead of following them"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def build_opener():
+    """Returns the opener used to send the callbacks"""
+    return urllib.request.build_opener(
+        urllib.request.ProxyHandler({}), NoRedirectHandler,
+        CheckedHTTPHandler, CheckedHTTPSHandler)
+
+
+def send(url, payloads):
+    """Sends the payloads to `url` in one request.
+    Returns None if the request succeeded, an error message otherwise.
+    """
+    body = json.dumps({'events': payloads}, cls=DjangoJSONEncoder).encode()
+    headers = {'Content-Type': 'application/json', 'User-Agent': 'geospaas-rest-api'}
+    secret = get_setting('SECRET', None)
+    if secret:
+        timestamp = str(int(time.time()))
+        headers['X-Geospaas-Timestamp'] = timestamp
+        headers['X-Geospaas-Signature'] = f"sha256={sign(secret, timestamp, body)}"
+
+    request = urllib.request.Request(url, data=body, headers=headers, method='POST')
+    try:
+        with build_opener().open(request, timeout=get_setting('TIMEOUT', 10)) as response:
+            response.read()
+    except (urllib.error.URLError, OSError, ValueError) as error:
+        return str(error)
+    return None
+
+
+def acquire_due_callbacks(limit):
+    """Returns at most `limit` callbacks which are due for delivery,
+    and postpones their next attempt so they are not picked by another
+    deliverer while they are being sent
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        due_callbacks = list(
+            models.JobCallback.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=models.JobCallback.PENDING, next_attempt__lte=now)
+            .order_by('id')[:limit])
+        lease = timedelta(seconds=2 * get_setting('TIMEOUT', 10) + 60)
+        (models.JobCallback.objects
+         .filter(id__in=[c.id for c in due_callbacks])
+         .update(next_attempt=now + lease))
+    return due_callbacks
+
+
+def make_batches(callbacks):
+    """Groups the callbacks by URL, in batches of limited size"""
+    batch_size = get_setting('BATCH_SIZE', 50)
+    by_url = collections.OrderedDict()
+    for callback in callbacks:
+        by_url.setdefault(callback.url, []).append(callback)
+    return [
+        (url, url_callbacks[i:i + batch_size])
+        for url, url_callbacks in by_url.items()
+        for i in range(0, len(url_callbacks), batch_size)
+    ]
+
+
+def record_attempt(callbacks, error):
+    """Updates the callbacks after a delivery attempt"""
+    now = timezone.now()
+    max_attempts = get_setting('MAX_ATTEMPTS', 8)
+    retry_delay = timedelta(seconds=get_setting('RETRY_DELAY', 30))
+    for callback in callbacks:
+        callback.attempts += 1
+        if error is None:
+            callback.status = models.JobCallback.DELIVERED
+            callback.date_delivered = now
+            callback.last_error = ''
+        else:
+            callback.last_error = error
+            if callback.attempts >= max_attempts:
+                callback.status = models.JobCallback.FAILED
+            else:
+                callback.next_attempt = now + min(
+                    retry_delay * 2 ** (callback.attempts - 1), MAX_RETRY_DELAY)
+    models.JobCallback.objects.bulk_update(
+        callbacks, ['attempts', 'status', 'date_delivered', 'last_error', 'next_attempt'])
+
+
+def deliver_pending_callbacks():
+    """Sends the callbacks which are due, a limited number at a time.
+    Returns the number of callbacks which were delivered.
+    """
+    workers = get_setting('WORKERS', 4)
+    limit = get_setting('BATCH_SIZE', 50) * workers
+    delivered = 0
+    while True:
+        due_callbacks = acquire_due_callbacks(limit)
+        batches = make_batches(due_callbacks)
+        if not batches:
+            return delivered
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            errors = list(executor.map(
+                lambda batch: send(batch[0], [c.payload for c in batch[1]]),
+                batches))
+
+        for (_, callbacks), error in zip(batches, errors):
+            record_attempt(callbacks, error)
+            if error is None:
+                delivered += len(callbacks)
+        if len(due_callbacks) < limit:
+            return delivered
@@ -0,0 +1,125 @@
+"""Selection of the Argo profiles which are co-located with a model
+dataset, used by the compare_profiles jobs.
+
+A profile is co-located with the model if its time coverage overlaps
+the model's, extended by a time tolerance, and its location intersects
+the model's footprint, extended by a buffer. The profiles are searched
+among the datasets which have been ingested in Syntool, and their
+ingested paths are taken from the ProcessingResults.
+
+The time tolerance is limited by the
+GEOSPAAS_REST_API_COLOCATION_MAX_TIME_TOLERANCE Django setting, in
+seconds (default 366 days).
+"""
+import math
+from datetime import timedelta
+
+from django.conf import settings
+import geospaas.catalog.models
+import geospaas_processing.models
+from rest_framework.exceptions import ValidationError
+
+
+# Type of the ProcessingResults which contain the profiles paths
+PROFILE_RESULT_TYPE = 'syntool'
+
+# Keys of the source criteria and the corresponding lookups
+SOURCE_LOOKUPS = {
+    'platform': 'dataset__source__platform__short_name__iexact',
+    'instrument': 'dataset__source__instrument__short_name__iexact',
+}
+
+
+def get_max_time_tolerance():
+    """Returns the maximum time tolerance of a profiles selection"""
+    return timedelta(seconds=getattr(
+        settings, 'GEOSPAAS_REST_API_COLOCATION_MAX_TIME_TOLERANCE', 366 * 86400))
+
+
+def check_selection(selection):
+    """Checks the profiles selection criteria of a compare job and
+    raises a ValidationError if they are invalid
+    """
+    if not isinstance(selection, dict):
+        raise ValidationError("'profiles_selection' must be a dictionary")
+
+    accepted_keys = ('source', 'time_tolerance', 'buffer')
+    if not set(selection).issubset(accepted_keys):
+        raise ValidationError(
+            f"'profiles_selection' accepts only these keys: {', '.join(accepted_keys)}")
+
+    source = selection.get('source', {})
+    if (not isinstance(source, dict) or
+            not set(source).issubset(SOURCE_LOOKUPS) or
+            any(not isinstance(value, str) for value in source.values())):
+        raise ValidationError(
+            "'source' must be a dictionary with string values for the keys: " +
+            ', '.join(SOURCE_LOOKUPS))
+
+    time_tolerance = selection.get('time_tolerance', {})
+    if not isinstance(time_tolerance, dict):
+        raise ValidationError("'time_tolerance' must be a dictionary")
+    try:
+        tolerance = timedelta(**time_tolerance)
+    except (TypeError, ValueError, OverflowError) as error:
+        raise ValidationError(f"Invalid 'time_tolerance': {error}") from error
+    if not timedelta(0) <= tolerance <= get_max_time_tolerance():
+        raise ValidationError(
+            f"'time_tolerance' must be positive and at most {get_max_time_tolerance()}")
+
+    buffer = selection.get('buffer', 0)
+    if (isinstance(buffer, bool) or not isinstance(buffer, (int, float)) or
+            not math.isfinite(buffer) or buffer < 0):
+        raise ValidationError("'buffer' must be a positive number")
+
+
+def select_profiles(model_id, source=None, time_tolerance=None, buffer=0):
+    """Returns a list of (profile_id, profile_paths) tuples for the
+    profiles which are co-located with the model dataset.
+    `time_tolerance` is a dictionary of timedelta arguments and `buffer`
+    is a distance in degrees around the model's footprint.
+    """
+    try:
+        model = (geospaas.catalog.models.Dataset.objects
+                 .select_related('geographic_location')
+                 .get(id=model_id))
+    except geospaas.catalog.models.Dataset.DoesNotExist as error:
+        raise ValidationError(f"Dataset {model_id} does not exist") from error
+
+    if (model.geographic_location is None or
+            model.time_coverage_start is None or model.time_coverage_end is None):
+        raise ValidationError(
+            f"Dataset {model_id} has no time coverage or location to select profiles")
+
+    tolerance = timedelta(**(time_tolerance or {}))
+    footprint = model.geographic_location.geometry
+    if buffer:
+        footprint = footprint.buffer(buffer)
+
+    time_filters = {}
+    # the time range is left open on the side where the tolerance goes
+    # beyond the dates which can be represented
+    try:
+        time_filters['dataset__time_coverage_start__lte'] = model.time_coverage_end + tolerance
+    except OverflowError:
+        pass
+    try:
+        time_filters['dataset__time_coverage_end__gte'] = model.time_coverage_start - tolerance
+    except OverflowError:
+        pass
+
+    results = (
+        geospaas_processing.models.ProcessingResult.objects
+        .filter(
+            type=PROFILE_RESULT_TYPE,
+            dataset__geographic_location__geometry__intersects=footprint,
+            **time_filters,
+            **{SOURCE_LOOKUPS[key]: value for key, value in (source or {}).items()})
+        .exclude(dataset_id=model_id)
+        .order_by('dataset_id', 'path')
+        .values_list('dataset_id', 'path'))
+
+    profiles = {}
+    for dataset_id, path in results:
+        profiles.setdefault(dataset_id, []).append(path)
+    return list(profiles.items())
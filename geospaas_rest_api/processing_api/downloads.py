@@ -0,0 +1,141 @@
+"""Serving of the files of the processing results.
+
+The paths of the processing results are relative to the directory
+defined by the GEOSPAAS_REST_API_RESULTS_ROOT Django setting. The
+transfer can be delegated to the front-end web server using the
+GEOSPAAS_REST_API_RESULTS_SENDFILE setting:
+  - 'x-accel-redirect': nginx's X-Accel-Redirect header is used. The
+    internal location which serves the results directory is given by
+    the GEOSPAAS_REST_API_RESULTS_ACCEL_PREFIX setting (default
+    '/protected-results/').
+  - 'x-sendfile': Apache's and lighttpd's X-Sendfile header is used.
+  - None (default): the file is sent by Django, using the sendfile
+    system call when the WSGI server supports it. Byte ranges are
+    streamed in blocks.
+In every case, the file is never entirely loaded in memory and the
+front-end server or Django handles the Range header.
+"""
+import mimetypes
+import os
+import os.path
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from rest_framework.exceptions import NotFound
+
+
+BLOCK_SIZE = 65536
+RANGE_REGEX = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when the requested byte range is outside of the file"""
+
+
+def get_setting(name, default):
+    """Returns the value of a results serving setting"""
+    return getattr(settings, f"GEOSPAAS_REST_API_RESULTS_{name}", default)
+
+
+def resolve_path(relative_path):
+    """Returns the absolute path of a result file, making sure it is
+    inside the results directory
+    """
+    root = get_setting('ROOT', None)
+    if not root:
+        raise NotFound('The results files are not available from this server')
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, relative_path))
+    if os.path.commonpath((root, path)) != root or not os.path.isfile(path):
+        raise NotFound('The result file does not exist')
+    return root, path
+
+
+def parse_range(header, size):
+    """Returns the (start, end) couple of inclusive byte positions
+    requested by a Range header, or None if the whole file must be
+    sent. Only single ranges are supported; the header is ignored
+    otherwise, as allowed by RFC 9110.
+    """
+    match = RANGE_REGEX.match(header.strip()) if header else None
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # suffix range: the last bytes of the file
+        length = int(end)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - length), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def iter_range(file, start, end):
+    """Yields the bytes of `file` from `start` to `end` in blocks"""
+    try:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            block = file.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+    finally:
+        file.close()
+
+
+def set_file_headers(response, path):
+    """Sets the headers which describe the served file"""
+    response['Content-Disposition'] = (
+        f"attachment; filename*=utf-8''{quote(os.path.basename(path))}")
+    response['Accept-Ranges'] = 'bytes'
+
+
+def serve_file(request, relative_path):
+    """Returns a response which sends a result file, honoring the
+    Range header of the request
+    """
+    root, path = resolve_path(relative_path)
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    backend = get_setting('SENDFILE', None)
+    if backend in ('x-accel-redirect', 'x-sendfile'):
+        # the front-end server sends the file and handles the ranges
+        response = HttpResponse(content_type=content_type)
+        if backend == 'x-accel-redirect':
+            prefix = get_setting('ACCEL_PREFIX', '/protected-results/')
+            response['X-Accel-Redirect'] = quote(
+                prefix.rstrip('/') + '/' + os.path.relpath(path, root).replace(os.sep, '/'))
+        else:
+            response['X-Sendfile'] = path
+        set_file_headers(response, path)
+        return response
+
+    size = os.path.getsize(path)
+    try:
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+    except RangeNotSatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{size}"
+        return response
+
+    if byte_range is None:
+        # FileResponse lets the WSGI server use sendfile()
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            iter_range(open(path, 'rb'), start, end), status=206, content_type=content_type)
+        response['Content-Range'] = f"bytes {start}-{end}/{size}"
+        response['Content-Length'] = str(end - start + 1)
+    set_file_headers(response, path)
+    return response
@@ -0,0 +1,104 @@
+"""Server-Sent Events streams of the jobs status.
+
+The status of the jobs is kept up to date in the database by the
+Celery signal handlers defined in the `signals` module, so the streams
+only need to look at the jobs table: no result backend query is
+made while a connection is idle.
+
+The streams are configured by the following Django settings:
+  - GEOSPAAS_REST_API_EVENTS_POLL_INTERVAL: number of seconds between
+    two checks of the jobs status (default 1).
+  - GEOSPAAS_REST_API_EVENTS_HEARTBEAT_INTERVAL: number of seconds
+    after which a comment is sent to keep an idle connection open
+    (default 15).
+  - GEOSPAAS_REST_API_EVENTS_TIMEOUT: maximum duration of a stream in
+    seconds (default 3600). Clients can reconnect afterwards.
+"""
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+import geospaas_rest_api.models as models
+
+
+# Maximum number of jobs which can be watched by one stream
+MAX_JOBS = 100
+
+
+class JobEventStream:
+    """Produces an event each time the status of one of the watched
+    jobs changes. The stream ends when all the jobs are finished.
+    """
+
+    def __init__(self, job_ids):
+        self.job_ids = list(job_ids)
+        self.statuses = {}
+        self.poll_interval = getattr(settings, 'GEOSPAAS_REST_API_EVENTS_POLL_INTERVAL', 1)
+        self.heartbeat_interval = getattr(
+            settings, 'GEOSPAAS_REST_API_EVENTS_HEARTBEAT_INTERVAL', 15)
+        self.timeout = getattr(settings, 'GEOSPAAS_REST_API_EVENTS_TIMEOUT', 3600)
+
+    @staticmethod
+    def format_event(data):
+        """Returns a status event in the SSE format"""
+        return f"event: status\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+    def poll(self):
+        """Returns the list of events for the jobs whose status
+        changed since the last call
+        """
+        events = []
+        for job in (models.Job.objects
+                    .filter(id__in=self.job_ids)
+                    .values('id', 'status', 'date_done')
+                    .order_by('id')):
+            if self.statuses.get(job['id']) != job['status']:
+                self.statuses[job['id']] = job['status']
+                events.append(self.format_event(job))
+        return events
+
+    @property
+    def finished(self):
+        """True if all the watched jobs are finished"""
+        return all(status in models.Job.FINISHED_STATES for status in self.statuses.values())
+
+    def events(self):
+        """Generator which yields the events"""
+        yield f"retry: {int(self.poll_interval * 1000)}\n\n"
+        start = last_sent = time.monotonic()
+        while True:
+            events = self.poll()
+            now = time.monotonic()
+            if events:
+                yield ''.join(events)
+                last_sent = now
+            elif now - last_sent >= self.heartbeat_interval:
+                yield ": heartbeat\n\n"
+                last_sent = now
+            if self.finished or now - start >= self.timeout:
+                break
+            time.sleep(self.poll_interval)
+
+    async def async_events(self):
+        """Asynchronous generator which yields the events, for use
+        under ASGI
+        """
+        poll = sync_to_async(self.poll)
+        yield f"retry: {int(self.poll_interval * 1000)}\n\n"
+        start = last_sent = time.monotonic()
+        while True:
+            events = await poll()
+            now = time.monotonic()
+            if events:
+                yield ''.join(events)
+                last_sent = now
+            elif now - last_sent >= self.heartbeat_interval:
+                yield ": heartbeat\n\n"
+                last_sent = now
+            if self.finished or now - start >= self.timeout:
+                break
+            await asyncio.sleep(self.poll_interval)
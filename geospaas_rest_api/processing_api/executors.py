@@ -0,0 +1,261 @@
+"""Backends which execute the tasks of the jobs.
+
+The executor is chosen using the GEOSPAAS_REST_API_JOB_EXECUTOR Django
+setting, which contains the dotted path of an executor class. By
+default, the tasks are sent to Celery workers by `CeleryExecutor`.
+
+`LocalExecutor` runs the tasks on a pool of threads or processes inside
+the API process, without broker, and stores their state in the
+database through the django-celery-results backend. It is meant for
+small deployments and for testing. It is configured by the following
+settings:
+  - GEOSPAAS_REST_API_LOCAL_EXECUTOR_POOL: 'thread' (default) or
+    'process'.
+  - GEOSPAAS_REST_API_LOCAL_EXECUTOR_WORKERS: maximum number of jobs
+    running at the same time (default 4).
+The jobs whose tasks receive other signatures to run, like the syntool
+conversions which check the ingestion first, are rejected because these
+signatures would be sent to the broker.
+"""
+import concurrent.futures
+import logging
+import multiprocessing
+import threading
+
+import celery
+import celery.canvas
+import celery.states
+import django
+import django.apps
+import django.db
+from celery.result import AsyncResult
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXECUTOR = 'geospaas_rest_api.processing_api.executors.CeleryExecutor'
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+class CeleryExecutor:
+    """Sends the tasks to the Celery workers through the broker"""
+
+    def submit(self, signature, args=(), kwargs=None):
+        """Sends a signature to be executed and returns its result"""
+        return signature.delay(*args, **(kwargs or {}))
+
+    def check(self, signature):
+        """Raises a ValueError if `signature` can't be run by this
+        executor
+        """
+
+    def get_result(self, task_id):
+        """Returns the result of a task"""
+        return AsyncResult(task_id)
+
+    def get_current_task_result(self, job):
+        """Returns the result of the task of `job` which is currently
+        executing, or of the last one if the job is finished, and
+        whether the job is finished
+        """
+        current_result = self.get_result(job.task_id)
+        finished = False
+        while current_result.ready():
+            try:
+                current_result = current_result.children[0]
+            except IndexError:
+                finished = True
+                break
+        return current_result, finished
+
+    def revoke(self, job):
+        """Revokes the tasks of `job` and terminates the running one"""
+        celery.current_app.control.revoke(job.get_task_ids(), terminate=True)
+
+
+class LocalExecutor(CeleryExecutor):
+    """Runs the tasks in a pool of threads or processes of the current
+    process. A task which is running can't be terminated, but the
+    following ones are not run once the job is revoked.
+    """
+
+    def __init__(self):
+        self.pool_type = getattr(settings, 'GEOSPAAS_REST_API_LOCAL_EXECUTOR_POOL', 'thread')
+        workers = getattr(settings, 'GEOSPAAS_REST_API_LOCAL_EXECUTOR_WORKERS', 4)
+        if self.pool_type == 'process':
+            # forked processes would share the database connections
+            self.pool = concurrent.futures.ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context('spawn'))
+        elif self.pool_type == 'thread':
+            self.pool = concurrent.futures.ThreadPoolExecutor(
+                workers, thread_name_prefix='geospaas-local-executor')
+        else:
+            raise ValueError(f"Unknown pool type {self.pool_type}")
+
+    def submit(self, signature, args=(), kwargs=None):
+        """Queues a signature for execution in the pool and returns its
+        result
+        """
+        result = signature.freeze()
+        self.pool.submit(run_in_worker, dict(signature), tuple(args), kwargs or {})
+        return result
+
+    def check(self, signature):
+        """Raises a ValueError if a task of `signature` receives other
+        signatures, which it would send to the broker
+        """
+        for task in iter_tasks(signature):
+            if any(is_signature(value)
+                   for value in list(task.args) + list(task.kwargs.values())):
+                raise ValueError(
+                    f"The task {task.task} starts other tasks, which can't be run locally")
+
+    def get_result(self, task_id):
+        """Returns the result of a task, read from the database"""
+        return AsyncResult(task_id, backend=get_database_backend())
+
+    def get_current_task_result(self, job):
+        """Returns the result of the first step of `job` which is not
+        finished. The job is finished when all the steps are, or when
+        one of them did not succeed.
+        """
+        result = None
+        for step in job.steps:
+            result = self.get_result(step['task_id'])
+            if not result.ready():
+                return result, False
+            if result.state != celery.states.SUCCESS:
+                break
+        if result is None:
+            return self.get_result(job.task_id), False
+        return result, True
+
+    def revoke(self, job):
+        """Marks the steps of `job` which have not started as revoked.
+        The running step goes on until it is finished, and its state is
+        stored as usual.
+        """
+        backend = get_database_backend()
+        for step in job.steps:
+            if self.get_result(step['task_id']).state == celery.states.PENDING:
+                backend.store_result(step['task_id'], None, celery.states.REVOKED)
+
+
+class StepFailed(Exception):
+    """Raised when a step of a signature run locally did not succeed"""
+
+
+def get_database_backend():
+    """Returns the django-celery-results backend, which stores the
+    task states in the database
+    """
+    # imported here because it needs the Django apps to be loaded
+    from django_celery_results.backends.database import DatabaseBackend
+    return DatabaseBackend(app=celery.current_app)
+
+
+def is_signature(value):
+    """Returns True if `value` is a signature or its dictionary form"""
+    return isinstance(value, dict) and 'task' in value and 'subtask_type' in value
+
+
+def iter_tasks(signature):
+    """Yields the tasks of a signature, in the canvases it contains"""
+    signature = celery.signature(signature, app=celery.current_app)
+    subtask_type = signature.get('subtask_type')
+    if subtask_type in ('chain', 'group'):
+        for task in signature.tasks:
+            yield from iter_tasks(task)
+    elif subtask_type == 'chord':
+        header = signature.tasks
+        if not isinstance(header, celery.canvas.Signature):
+            header = celery.group(header)
+        yield from iter_tasks(header)
+        yield from iter_tasks(signature.body)
+    else:
+        yield signature
+
+
+def refresh_jobs(task_id, root_id):
+    """Updates the status of the jobs to which a task belongs"""
+    # imported here to avoid a circular import with the models
+    import geospaas_rest_api.processing_api.signals as signals
+    signals.refresh_jobs(task_id, root_id)
+
+
+def run_step(backend, signature, args, kwargs):
+    """Runs one task in the current thread and stores its state.
+    Returns the value returned by the task.
+    """
+    task_id = signature.id
+    if backend.get_state(task_id) == celery.states.REVOKED:
+        raise StepFailed(task_id)
+    backend.store_result(task_id, None, celery.states.STARTED)
+    eager_result = signature.apply(args, kwargs)
+    backend.store_result(
+        task_id, eager_result.result, eager_result.state, traceback=eager_result.traceback)
+    # the task_postrun signal is sent before the state is stored
+    refresh_jobs(task_id, signature.options.get('root_id'))
+    if eager_result.state != celery.states.SUCCESS:
+        raise StepFailed(task_id)
+    return eager_result.result
+
+
+def run_canvas(backend, signature, args, kwargs):
+    """Runs the tasks of a signature sequentially, passing the result
+    of each step to the next one like Celery does. Returns the result
+    of the last step.
+    """
+    subtask_type = signature.get('subtask_type')
+    if subtask_type == 'chain':
+        result = None
+        for i, task in enumerate(signature.tasks):
+            if i == 0:
+                result = run_canvas(backend, task, args, kwargs)
+            else:
+                result = run_canvas(backend, task, (result,), {})
+        return result
+    if subtask_type == 'group':
+        return [run_canvas(backend, task, args, kwargs) for task in signature.tasks]
+    if subtask_type == 'chord':
+        header = signature.tasks
+        if not isinstance(header, celery.canvas.Signature):
+            header = celery.group(header)
+        header_result = run_canvas(backend, header, args, kwargs)
+        return run_canvas(backend, signature.body, (header_result,), {})
+    return run_step(backend, signature, args, kwargs)
+
+
+def run_signature(signature, args, kwargs):
+    """Runs a frozen signature given as a dictionary"""
+    try:
+        run_canvas(get_database_backend(),
+                   celery.signature(signature, app=celery.current_app), args, kwargs)
+    except StepFailed:
+        pass
+
+
+def run_in_worker(signature, args, kwargs):
+    """Runs a frozen signature in a pool worker"""
+    if not django.apps.apps.ready:
+        # process started with the "spawn" method
+        django.setup()
+    try:
+        run_signature(signature, args, kwargs)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Error while running a job locally")
+    finally:
+        django.db.connections.close_all()
+
+
+def get_executor():
+    """Returns the executor defined in the settings"""
+    path = getattr(settings, 'GEOSPAAS_REST_API_JOB_EXECUTOR', DEFAULT_EXECUTOR)
+    with _executors_lock:
+        if path not in _executors:
+            _executors[path] = import_string(path)()
+        return _executors[path]
@@ -2,17 +2,72 @@
 import geospaas.catalog.models
 import geospaas_processing.models
 import rest_framework_filters
+from django.contrib.gis.geos import Polygon
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django_filters.rest_framework.filters import CharFilter, NumberFilter
+from rest_framework.exceptions import ValidationError
 
+import geospaas_rest_api.models as models
 from ..base_api.filters import DatasetFilter
 
 
+class JobFilter(rest_framework_filters.FilterSet):
+    """Filter for Jobs. The `dataset_id` filter looks at the
+    `dataset_id` parameter of the jobs and at the `dataset_ids`
+    parameter of the bundles.
+    """
+    dataset_id = NumberFilter(method='filter_dataset_id')
+
+    class Meta:
+        model = models.Job
+        fields = {
+            'action': ['exact', 'in'],
+            'status': ['exact', 'in'],
+            'client': ['exact'],
+            'date_created': ['exact', 'lt', 'lte', 'gt', 'gte'],
+            'date_done': ['exact', 'lt', 'lte', 'gt', 'gte', 'isnull'],
+        }
+
+    @staticmethod
+    def filter_dataset_id(queryset, name, value):
+        """The parameters are stored as JSON, so the value is converted
+        to an integer to match the stored dataset IDs
+        """
+        return models.Job.filter_dataset_ids(queryset, [value])
+
+
+def parse_time(value, name):
+    """Parses a datetime given as filter value. Naive datetimes are
+    considered to be in UTC.
+    """
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: f"Invalid date: {value}"})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.utc)
+    return parsed
+
+
 class ProcessingResultFilter(rest_framework_filters.FilterSet):
-    """Filter for ProcessingResults"""
+    """Filter for ProcessingResults. The `time_overlaps` and `bbox`
+    filters are applied directly on the datasets of the results, so
+    they only add one join to the query.
+    """
     dataset = rest_framework_filters.RelatedFilter(
         DatasetFilter,
         field_name='dataset',
         queryset=geospaas.catalog.models.Dataset.objects.all()
     )
+    time_overlaps = CharFilter(
+        method='filter_time_overlaps',
+        help_text='Comma-separated time range, "start,end". One of the bounds can be empty')
+    bbox = CharFilter(
+        method='filter_bbox',
+        help_text='Comma-separated bounding box, "west,south,east,north"')
     class Meta:
         model = geospaas_processing.models.ProcessingResult
         fields = {
@@ -20,3 +75,38 @@ class ProcessingResultFilter(rest_framework_filters.FilterSet):
             'type': '__all__',
             'created': '__all__',
         }
+
+    @staticmethod
+    def filter_time_overlaps(queryset, name, value):
+        """Keeps the results whose dataset's time coverage intersects
+        the time range
+        """
+        bounds = value.split(',')
+        if len(bounds) != 2 or not any(bound.strip() for bound in bounds):
+            raise ValidationError({name: 'The time range must have the format "start,end"'})
+        start, end = (parse_time(bound.strip(), name) if bound.strip() else None
+                      for bound in bounds)
+        if start and end and start > end:
+            raise ValidationError({name: 'The start of the time range must be before its end'})
+        if start:
+            queryset = queryset.filter(dataset__time_coverage_end__gte=start)
+        if end:
+            queryset = queryset.filter(dataset__time_coverage_start__lte=end)
+        return queryset
+
+    @staticmethod
+    def filter_bbox(queryset, name, value):
+        """Keeps the results whose dataset's footprint intersects the
+        bounding box
+        """
+        try:
+            west, south, east, north = (float(coordinate) for coordinate in value.split(','))
+        except ValueError as error:
+            raise ValidationError(
+                {name: 'The bounding box must have the format "west,south,east,north"'}
+            ) from error
+        if west > east or south > north:
+            raise ValidationError({name: 'Invalid bounding box'})
+        bbox = Polygon.from_bbox((west, south, east, north))
+        bbox.srid = 4326
+        return queryset.filter(dataset__geographic_location__geometry__intersects=bbox)
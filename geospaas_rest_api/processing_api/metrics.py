@@ -0,0 +1,158 @@
+"""Aggregate metrics about the jobs, used to size the worker pools.
+
+The metrics are computed over sliding windows ending at the time of
+the request, using aggregate queries on the jobs table and the result
+backend's TaskResult table. They are cached for a short time, so
+frequent polling does not load the database.
+
+The metrics are configured by the following Django settings:
+  - GEOSPAAS_REST_API_METRICS_WINDOWS: durations of the windows in
+    seconds (default: 5 minutes, 1 hour and 1 day).
+  - GEOSPAAS_REST_API_METRICS_CACHE_TIMEOUT: number of seconds during
+    which the metrics are cached (default 30).
+"""
+from datetime import timedelta
+
+import celery.states
+import django_celery_results.models
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import (Aggregate, Avg, Count, DurationField, ExpressionWrapper, F,
+                              OuterRef, Subquery)
+from django.utils import timezone
+
+import geospaas_rest_api.models as models
+
+
+CACHE_KEY = 'geospaas_rest_api:job_metrics'
+PERCENTILES = (50, 95, 99)
+
+
+class PercentileCont(Aggregate):
+    """PostgreSQL's continuous percentile ordered-set aggregate"""
+    function = 'PERCENTILE_CONT'
+    name = 'PercentileCont'
+    template = '%(function)s(%(percentile)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+
+    def __init__(self, expression, percentile, **extra):
+        super().__init__(expression, percentile=float(percentile), **extra)
+
+
+def get_windows():
+    """Returns the durations of the windows in seconds"""
+    return getattr(settings, 'GEOSPAAS_REST_API_METRICS_WINDOWS', (300, 3600, 86400))
+
+
+def to_seconds(duration):
+    """Converts a timedelta to a number of seconds"""
+    return None if duration is None else round(duration.total_seconds(), 3)
+
+
+def first_task_start():
+    """Subquery returning the date at which the first task of a job
+    was stored in the result backend
+    """
+    return Subquery(
+        django_celery_results.models.TaskResult.objects
+        .filter(task_id=OuterRef('root_task_id'))
+        .values('date_created')[:1])
+
+
+def get_distributions(queryset, expression):
+    """Returns a dictionary associating each action to the number of
+    values, mean and percentiles of a duration `expression` computed
+    over `queryset`, in seconds.
+    """
+    values = (queryset
+              .annotate(value=ExpressionWrapper(expression, output_field=DurationField()))
+              .filter(value__isnull=False))
+    aggregates = {'count': Count('id'), 'mean': Avg('value')}
+    use_percentile_cont = connection.vendor == 'postgresql'
+    if use_percentile_cont:
+        aggregates.update({
+            f"p{percentile}": PercentileCont('value', percentile / 100,
+                                             output_field=DurationField())
+            for percentile in PERCENTILES
+        })
+
+    distributions = {}
+    for row in values.order_by().values('action').annotate(**aggregates):
+        distribution = {'count': row['count'], 'mean': to_seconds(row['mean'])}
+        ordered_values = (values
+                          .filter(action=row['action'])
+                          .order_by('value')
+                          .values_list('value', flat=True))
+        for percentile in PERCENTILES:
+            key = f"p{percentile}"
+            if use_percentile_cont:
+                distribution[key] = to_seconds(row[key])
+            else:
+                # nearest-rank percentile, fetched by the database
+                rank = max(0, -(-row['count'] * percentile // 100) - 1)
+                distribution[key] = to_seconds(ordered_values[rank])
+        distributions[row['action']] = distribution
+    return distributions
+
+
+def compute_window_metrics(now, window):
+    """Returns the metrics for the jobs of the last `window` seconds"""
+    since = now - timedelta(seconds=window)
+    jobs = models.Job.objects.exclude(action='')
+
+    actions = {}
+
+    def action_metrics(action):
+        return actions.setdefault(action, {
+            'status': {},
+            'finished': 0,
+            'throughput': 0.,
+            'queue_wait': None,
+            'duration': None,
+        })
+
+    for row in (jobs.filter(date_created__gte=since)
+                .order_by()
+                .values('action', 'status')
+                .annotate(count=Count('id'))):
+        action_metrics(row['action'])['status'][row['status']] = row['count']
+
+    finished_jobs = jobs.filter(
+        date_done__gte=since, status__in=celery.states.READY_STATES)
+    for row in finished_jobs.order_by().values('action').annotate(count=Count('id')):
+        metrics = action_metrics(row['action'])
+        metrics['finished'] = row['count']
+        # finished jobs per hour
+        metrics['throughput'] = round(row['count'] * 3600 / window, 3)
+
+    started_jobs = jobs.filter(date_created__gte=since, root_task_id__isnull=False)
+    for action, distribution in get_distributions(
+            started_jobs, first_task_start() - F('date_created')).items():
+        action_metrics(action)['queue_wait'] = distribution
+    for action, distribution in get_distributions(
+            finished_jobs, F('date_done') - first_task_start()).items():
+        action_metrics(action)['duration'] = distribution
+
+    return {
+        'window': window,
+        'start': since,
+        'actions': actions,
+    }
+
+
+def compute_job_metrics(now=None):
+    """Returns the metrics for all the configured windows"""
+    now = now or timezone.now()
+    return {
+        'date': now,
+        'windows': [compute_window_metrics(now, window) for window in get_windows()],
+    }
+
+
+def get_job_metrics():
+    """Returns the job metrics, from the cache if they were computed
+    recently
+    """
+    return cache.get_or_set(
+        CACHE_KEY, compute_job_metrics,
+        getattr(settings, 'GEOSPAAS_REST_API_METRICS_CACHE_TIMEOUT', 30))
@@ -1,13 +1,32 @@
 """Processing API model classes"""
+import copy
+import time
+import uuid
+from datetime import timedelta
+
 from rest_framework.exceptions import ValidationError
 import geospaas_processing.tasks.syntool as tasks_syntool
 import geospaas_processing.tasks.harvesting as tasks_harvesting
 import geospaas_processing.tasks.idf as tasks_idf
 import geospaas_processing.tasks.core as tasks_core
 import celery
+import celery.canvas
+import celery.states
+import django_celery_results.models
 from collections.abc import Sequence
 from celery.result import AsyncResult
-from django.db import models
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.db.models.fields.json import KeyTransform
+from django.utils import timezone
+
+import geospaas_rest_api.processing_api.bundles as bundles
+import geospaas_rest_api.processing_api.colocation as colocation
+import geospaas_rest_api.processing_api.executors as executors
+import geospaas_rest_api.processing_api.sharding as sharding
 
 
 class Job(models.Model):
@@ -16,15 +35,63 @@ class Job(models.Model):
     """
     class Meta:
         app_label = 'geospaas_rest_api'
+        indexes = [
+            models.Index(fields=['action', 'status'], name='job_action_status_idx'),
+            models.Index(fields=['status'], name='job_status_idx'),
+            models.Index(fields=['date_done'], name='job_date_done_idx'),
+            models.Index(KeyTransform('dataset_id', 'parameters'), name='job_dataset_id_idx'),
+        ]
+
+    # Status of a job which is waiting in the database for free
+    # capacity before its tasks are sent to the broker
+    QUEUED = 'QUEUED'
+    # Status of a job which was cancelled by a client
+    CANCELLED = 'CANCELLED'
+    # Status of a job whose outcome can't be known anymore, because
+    # the results of its tasks were removed from the result backend
+    EXPIRED = 'EXPIRED'
+    # Statuses of jobs whose tasks will not run anymore
+    FINISHED_STATES = frozenset((*celery.states.READY_STATES, CANCELLED, EXPIRED))
 
     # Database fields
     task_id = models.CharField(
-        unique=True, max_length=255,
+        unique=True, null=True, blank=True, max_length=255,
         help_text='ID of the last task in the job')
+    root_task_id = models.CharField(
+        null=True, blank=True, max_length=255, db_index=True,
+        help_text='ID of the first task in the job, shared by all its tasks')
     date_created = models.DateTimeField(
         auto_now_add=True, db_index=True,
         verbose_name='Creation DateTime',
         help_text='Datetime: creation date of the job')
+    action = models.CharField(
+        max_length=50, blank=True, default='',
+        help_text='Action performed by the job')
+    parameters = models.JSONField(
+        default=dict, blank=True,
+        help_text='Parameters given when the job was submitted')
+    status = models.CharField(
+        max_length=50, default=celery.states.PENDING,
+        help_text='Last known status of the job')
+    date_done = models.DateTimeField(
+        null=True, blank=True,
+        help_text='Datetime: date at which the job was seen finished')
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True,
+        on_delete=models.SET_NULL, related_name='+',
+        help_text='User who submitted the job')
+    client = models.CharField(
+        max_length=255, blank=True, default='', db_index=True,
+        help_text='Identifier of the client which submitted the job')
+    callback_url = models.URLField(
+        max_length=2000, blank=True, default='',
+        help_text='URL to which the job status is sent when the job is finished')
+    date_dispatched = models.DateTimeField(
+        null=True, blank=True,
+        help_text='Datetime: date at which the tasks were sent to the broker')
+    steps = models.JSONField(
+        default=list, blank=True,
+        help_text='IDs and names of the tasks of the job, in execution order')
 
     @classmethod
     def get_signature(cls, parameters):
@@ -45,26 +112,418 @@ class Job(models.Model):
         """Returns the right task parameters from the request data"""
         raise NotImplementedError
 
+    @staticmethod
+    def get_dataset_ids(parameters):
+        """Returns the IDs of the datasets which the job needs to fetch"""
+        return ()
+
     @classmethod
-    def run(cls, parameters):
-        """This method should be used to create jobs.
-        Should return a Job instance.
+    def build(cls, parameters):
+        """Returns the signature of a job with its task IDs assigned,
+        the result it will produce and the arguments it must be called
+        with
         """
         args, kwargs = cls.make_task_parameters(parameters)
-        result = cls.get_signature(parameters).delay(*args, **kwargs)
-        return cls(task_id=result.task_id)
+        signature = cls.get_signature(parameters)
+        # assign the task IDs beforehand so they are known for every step
+        result = signature.freeze()
+        return signature, result, args, kwargs
+
+    @classmethod
+    def get_steps(cls, signature, stage=0):
+        """Returns the list of tasks contained in a frozen signature, in
+        execution order, and the stage following the last task.
+        Each task is represented by its ID, its name and its stage:
+        tasks which run in parallel share the same stage.
+        """
+        if not isinstance(signature, celery.canvas.Signature):
+            return [], stage
+        subtask_type = signature.get('subtask_type')
+        if subtask_type == 'chain':
+            steps = []
+            for task in signature.tasks:
+                task_steps, stage = cls.get_steps(task, stage)
+                steps.extend(task_steps)
+            return steps, stage
+        if subtask_type == 'group':
+            steps = []
+            next_stage = stage + 1
+            for task in signature.tasks:
+                task_steps, task_next_stage = cls.get_steps(task, stage)
+                steps.extend(task_steps)
+                next_stage = max(next_stage, task_next_stage)
+            return steps, next_stage
+        if subtask_type == 'chord':
+            header = signature.tasks
+            if not isinstance(header, celery.canvas.Signature):
+                header = celery.group(header)
+            header_steps, stage = cls.get_steps(header, stage)
+            body_steps, stage = cls.get_steps(signature.body, stage)
+            return header_steps + body_steps, stage
+        return [{'task_id': signature.id, 'name': signature.task, 'stage': stage}], stage + 1
+
+    @staticmethod
+    def get_root_task_id(result):
+        """Returns the ID of the first task of the workflow which
+        produced `result`. Celery uses it as root ID for all the tasks
+        of the workflow, including the ones they launch.
+        """
+        while isinstance(result.parent, AsyncResult):
+            result = result.parent
+        return result.task_id
+
+    @classmethod
+    def compute_progress(cls, steps):
+        """Returns the progress of a job from its steps, or None if the
+        Job subclass does not report progress
+        """
+        return None
+
+    def get_progress(self):
+        """Returns the progress of the job's tasks if its action is able
+        to report it, None otherwise
+        """
+        return JOB_CLASSES.get(self.action, Job).compute_progress(self.steps)
 
     def get_current_task_result(self):
         """Get the AsyncResult of the currently running task"""
-        current_result = AsyncResult(self.task_id)
-        finished = False
-        while current_result.ready():
-            try:
-                current_result = current_result.children[0]
-            except IndexError:
-                finished = True
-                break
-        return current_result, finished
+        return executors.get_executor().get_current_task_result(self)
+
+    @classmethod
+    def get_job_class(cls, action):
+        """Returns the Job subclass which implements an action"""
+        return JOB_CLASSES[action]
+
+    def dispatch(self):
+        """Assigns the task IDs of a job which was created without being
+        run (for example a queued job), and sends its tasks to the
+        broker once the current transaction is committed. The job must
+        be saved in the same transaction, so the workers can't start
+        the tasks before the job exists.
+        """
+        signature, args, kwargs = self.prepare_dispatch()
+        transaction.on_commit(lambda: self.publish(signature, args, kwargs))
+
+    def publish(self, signature, args=(), kwargs=None):
+        """Sends the tasks prepared by prepare_dispatch() to the broker.
+        The job is marked as failed if they can't be sent.
+        """
+        try:
+            executors.get_executor().submit(signature, args, kwargs)
+        except Exception:
+            self.set_status(celery.states.FAILURE)
+            raise
+        self.date_dispatched = timezone.now()
+        Job.objects.filter(pk=self.pk).update(date_dispatched=self.date_dispatched)
+
+    def prepare_dispatch(self):
+        """Assigns the task IDs of a job without sending its tasks to
+        the broker. Returns the signature and the arguments which must
+        be used to send them later.
+        """
+        job_class = self.get_job_class(self.action)
+        signature, result, args, kwargs = job_class.build(copy.deepcopy(self.parameters))
+        self.task_id = result.task_id
+        self.root_task_id = self.get_root_task_id(result)
+        self.steps, _ = self.get_steps(signature)
+        self.status = celery.states.PENDING
+        return signature, args, kwargs
+
+    def get_status_from_states(self, states):
+        """Returns the status of the job given the states of its tasks,
+        a dictionary associating task IDs to Celery states. The tasks
+        which are missing from the dictionary are considered pending.
+        """
+        task_ids = ([step['task_id'] for step in self.steps] or
+                    [task_id for task_id in (self.root_task_id, self.task_id) if task_id])
+        if states.get(self.task_id) in celery.states.READY_STATES:
+            return states[self.task_id]
+        # a failed or revoked task stops the following ones
+        for task_id in task_ids:
+            if states.get(task_id) in celery.states.PROPAGATE_STATES:
+                return states[task_id]
+        known_states = [states[task_id] for task_id in task_ids
+                        if states.get(task_id, celery.states.PENDING) != celery.states.PENDING]
+        if not known_states:
+            return celery.states.PENDING
+        if known_states[-1] in celery.states.READY_STATES:
+            # the next step has not started yet
+            return celery.states.STARTED
+        return known_states[-1]
+
+    def get_task_states(self):
+        """Returns a dictionary associating the IDs of the job's tasks
+        which are known by the result backend to their state, retrieved
+        in one query
+        """
+        return dict(django_celery_results.models.TaskResult.objects
+                    .filter(task_id__in=self.get_task_ids())
+                    .values_list('task_id', 'status'))
+
+    def update_status(self):
+        """Updates the status stored in the database from the states of
+        the job's steps: the job is started until its last step is
+        ready, unless one of its steps failed or was revoked.
+        Returns True if the status changed.
+        """
+        if not self.task_id or self.status in self.FINISHED_STATES:
+            return False
+        status = self.get_status_from_states(self.get_task_states())
+        # a started job does not go back to pending while the state of
+        # its next step is not stored yet
+        if status == self.status or status == celery.states.PENDING:
+            return False
+        self.set_status(status)
+        return True
+
+    def set_status(self, status):
+        """Sets the status of the job and saves it, unless the job was
+        already marked as finished in the database.
+        Returns True if the status was saved.
+        """
+        self.status = status
+        if status in self.FINISHED_STATES:
+            self.date_done = timezone.now()
+        if self.pk is None:
+            return False
+        updated = (Job.objects
+                   .filter(pk=self.pk)
+                   .exclude(status__in=self.FINISHED_STATES)
+                   .update(status=self.status, date_done=self.date_done))
+        if updated and self.callback_url and status in self.FINISHED_STATES:
+            JobCallback.objects.create(
+                job=self, url=self.callback_url, payload=self.get_callback_payload())
+        return bool(updated)
+
+    def get_task_ids(self):
+        """Returns the IDs of the job's tasks, from its frozen steps.
+        For the jobs created before the steps were recorded, only the
+        first and last tasks are known.
+        """
+        if self.steps:
+            return [step['task_id'] for step in self.steps]
+        return [task_id for task_id in (self.root_task_id, self.task_id) if task_id]
+
+    def wait_for_tasks(self, timeout=600, poll_interval=2):
+        """Waits until none of the job's tasks is running, for example
+        after they were revoked. Raises a TimeoutError if some are still
+        running after `timeout` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while any(state not in celery.states.READY_STATES and state != celery.states.PENDING
+                  for state in self.get_task_states().values()):
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"The tasks of job {self.pk} are still running")
+            time.sleep(poll_interval)
+
+    @classmethod
+    def get_cleanup_signature(cls, parameters):
+        """Returns a Celery signature which removes the files left
+        behind by a cancelled job, or None if there is nothing to clean
+        """
+        return None
+
+    def cancel(self):
+        """Revokes the pending and running tasks of the job, removes
+        its partially downloaded files and marks it as cancelled.
+        Returns False if the job was already finished.
+        """
+        with transaction.atomic():
+            # lock the job so it is not dispatched in the meantime
+            job = Job.objects.select_for_update().get(pk=self.pk)
+            self.task_id, self.root_task_id = job.task_id, job.root_task_id
+            if job.status in self.FINISHED_STATES or not self.set_status(self.CANCELLED):
+                self.status = job.status
+                return False
+            # the tasks of a job still in the outbox were never sent
+            unpublished, _ = JobSubmission.objects.filter(job_id=self.pk).delete()
+
+        if self.task_id and not unpublished:
+            executor = executors.get_executor()
+            # Revoking the current task of a chain prevents the
+            # following ones from being run
+            executor.revoke(self)
+            cleanup_signature = JOB_CLASSES.get(self.action, Job).get_cleanup_signature(
+                self.parameters)
+            if cleanup_signature is not None and not self.dataset_in_use():
+                # the files are removed once the revoked tasks are
+                # stopped, so they can't be written again afterwards
+                executor.submit(celery.chain(
+                    celery.signature('geospaas_rest_api.wait_for_job_tasks',
+                                     args=(self.pk,), immutable=True),
+                    cleanup_signature))
+        return True
+
+    @staticmethod
+    def filter_dataset_ids(queryset, dataset_ids):
+        """Keeps the jobs of `queryset` which work on one of the
+        datasets, given in their `dataset_id` parameter or in the
+        `dataset_ids` parameter of bundles
+        """
+        dataset_ids = [int(dataset_id) for dataset_id in dataset_ids]
+        connection = connections[queryset.db]
+        if connection.features.supports_json_field_contains:
+            in_bundle = Q()
+            for dataset_id in dataset_ids:
+                in_bundle |= Q(parameters__dataset_ids__contains=[dataset_id])
+        else:
+            # SQLite can't look into JSON arrays with the ORM
+            table = connection.ops.quote_name(Job._meta.db_table)
+            column = connection.ops.quote_name(Job._meta.get_field('parameters').column)
+            placeholders = ', '.join(['%s'] * len(dataset_ids))
+            in_bundle = Q(id__in=RawSQL(
+                f"SELECT {table}.id FROM {table}, json_each({table}.{column}, '$.dataset_ids') "
+                f"WHERE json_each.value IN ({placeholders})", dataset_ids))
+        return queryset.filter(Q(parameters__dataset_id__in=dataset_ids) | in_bundle)
+
+    def dataset_in_use(self):
+        """Returns True if another unfinished job works on one of the
+        datasets of this job
+        """
+        dataset_ids = JOB_CLASSES.get(self.action, Job).get_dataset_ids(self.parameters)
+        return (bool(dataset_ids) and
+                self.filter_dataset_ids(Job.objects.all(), dataset_ids)
+                .exclude(pk=self.pk)
+                .exclude(status__in=self.FINISHED_STATES)
+                .exists())
+
+    def get_callback_payload(self):
+        """Returns the data sent to the callback URL of the job"""
+        return {
+            'id': self.pk,
+            'action': self.action,
+            'task_id': self.task_id,
+            'status': self.status,
+            'date_done': self.date_done,
+        }
+
+    def get_timeline(self):
+        """Returns the timing of each step of the job, retrieved from
+        the result backend in one query. The start date of a task is
+        the date at which its first state was stored, so it is only
+        accurate if Celery's `task_track_started` setting is enabled.
+        """
+        task_results = {
+            task_result.task_id: task_result
+            for task_result in (django_celery_results.models.TaskResult.objects
+                                .filter(task_id__in=[step['task_id'] for step in self.steps])
+                                .only('task_id', 'status', 'worker', 'date_created', 'date_done'))
+        }
+
+        timeline = []
+        for step in self.steps:
+            task_result = task_results.get(step['task_id'])
+            status = task_result.status if task_result else celery.states.PENDING
+            finished = status in celery.states.READY_STATES
+            timeline.append({
+                'task_id': step['task_id'],
+                'name': step['name'],
+                'stage': step['stage'],
+                'status': status,
+                'worker': task_result.worker if task_result else None,
+                'date_queued': None,
+                'date_started': task_result.date_created if task_result else None,
+                'date_done': task_result.date_done if finished else None,
+            })
+
+        # the tasks of a stage are queued when all the tasks of the
+        # previous stage are finished
+        stages_end = {-1: self.date_dispatched or self.date_created}
+        for task in timeline:
+            stage_end = stages_end.get(task['stage'], task['date_done'])
+            stages_end[task['stage']] = (
+                max(stage_end, task['date_done']) if stage_end and task['date_done'] else None)
+        for task in timeline:
+            task['date_queued'] = stages_end.get(task['stage'] - 1)
+            task['queued'] = (
+                (task['date_started'] - task['date_queued']).total_seconds()
+                if task['date_started'] and task['date_queued'] else None)
+            task['duration'] = (
+                (task['date_done'] - task['date_started']).total_seconds()
+                if task['date_done'] and task['date_started'] else None)
+        return timeline
+
+
+class JobCallback(models.Model):
+    """Notification of the end of a job, waiting to be delivered to
+    the callback URL provided by the client
+    """
+    class Meta:
+        app_label = 'geospaas_rest_api'
+        indexes = [models.Index(fields=['status', 'next_attempt'], name='jobcallback_due_idx')]
+
+    PENDING = 'PENDING'
+    DELIVERED = 'DELIVERED'
+    FAILED = 'FAILED'
+
+    job = models.ForeignKey(Job, on_delete=models.CASCADE, related_name='callbacks')
+    url = models.URLField(max_length=2000)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    status = models.CharField(
+        max_length=20, default=PENDING,
+        choices=[(PENDING, PENDING), (DELIVERED, DELIVERED), (FAILED, FAILED)])
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_delivered = models.DateTimeField(null=True, blank=True)
+
+
+class JobSubmission(models.Model):
+    """Tasks of a job waiting to be sent to the broker. It is saved in
+    the same transaction as the job, and removed once the tasks are
+    published.
+    """
+    class Meta:
+        app_label = 'geospaas_rest_api'
+
+    job = models.OneToOneField(Job, on_delete=models.CASCADE, related_name='submission')
+    signature = models.JSONField(encoder=DjangoJSONEncoder)
+    args = models.JSONField(encoder=DjangoJSONEncoder, default=list)
+    kwargs = models.JSONField(encoder=DjangoJSONEncoder, default=dict)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now, db_index=True)
+    last_error = models.TextField(blank=True, default='')
+    date_created = models.DateTimeField(auto_now_add=True)
+
+
+class AdmissionLock(models.Model):
+    """Row locked while jobs are admitted, so that concurrent
+    submissions can't exceed the running jobs limits
+    """
+    class Meta:
+        app_label = 'geospaas_rest_api'
+
+
+class HarvestSchedule(models.Model):
+    """Periodic harvest of a search configuration. Each run harvests
+    the time interval between the high-water mark left by the last
+    successful run and the time of the run.
+    """
+    class Meta:
+        app_label = 'geospaas_rest_api'
+
+    name = models.CharField(max_length=255, unique=True)
+    search_config_dict = models.JSONField(
+        default=dict, help_text='Search configuration, without time range')
+    shard_days = models.PositiveIntegerField(
+        null=True, blank=True,
+        help_text='Length in days of the time windows harvested in parallel')
+    interval = models.DurationField(help_text='Time between two runs')
+    overlap = models.DurationField(
+        default=timedelta(0),
+        help_text='Time before the high-water mark which is harvested again at each run, '
+                  'to catch data published late')
+    high_water_mark = models.DateTimeField(
+        help_text='End of the time range harvested by the last successful run')
+    pending_mark = models.DateTimeField(
+        null=True, blank=True,
+        help_text='End of the time range harvested by the running job')
+    next_run = models.DateTimeField(default=timezone.now, db_index=True)
+    enabled = models.BooleanField(default=True)
+    last_job = models.ForeignKey(
+        Job, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    date_created = models.DateTimeField(auto_now_add=True)
 
 
 class DownloadJob(Job):
@@ -73,15 +532,19 @@ class DownloadJob(Job):
       - downloads a dataset
       - archives the result if necessary
       - publishes the result to an FTP server
+    In bundle mode, several datasets are downloaded (and cropped) in
+    parallel, then gathered in one archive which is published once.
     """
     class Meta:
         proxy = True
         app_label = 'geospaas_rest_api'
 
-    @classmethod
-    def get_signature(cls, parameters):
+    @staticmethod
+    def get_processing_signatures(parameters, args=None):
+        """Returns the signatures which download and crop a dataset"""
+        download_kwargs = {} if args is None else {'args': args}
         tasks = [
-            tasks_core.download.signature(),
+            tasks_core.download.signature(**download_kwargs),
             tasks_core.copy.signature(kwargs={'copy_to': parameters.get('copy_to', None)}),
         ]
 
@@ -93,6 +556,13 @@ class DownloadJob(Job):
                 tasks_core.crop.signature(
                     kwargs={'bounding_box': parameters.get('bounding_box', None)}),
             ])
+        return tasks
+
+    @classmethod
+    def get_signature(cls, parameters):
+        if 'dataset_ids' in parameters:
+            return cls.get_bundle_signature(parameters)
+        tasks = cls.get_processing_signatures(parameters)
         if parameters.get('publish', False):
             tasks.extend([
                 tasks_core.archive.signature(),
@@ -100,19 +570,48 @@ class DownloadJob(Job):
             ])
         return celery.chain(tasks)
 
+    @classmethod
+    def get_bundle_signature(cls, parameters):
+        """Returns the signature of a bundle: the datasets are processed
+        in parallel, then their files are gathered in one archive
+        """
+        tasks = [
+            celery.chord(
+                celery.group(
+                    celery.chain(cls.get_processing_signatures(parameters, ((dataset_id,),)))
+                    for dataset_id in parameters['dataset_ids']),
+                celery.signature('geospaas_rest_api.create_bundle',
+                                 kwargs={'name': f"bundle_{uuid.uuid4().hex}"}))
+        ]
+        if parameters.get('publish', False):
+            tasks.append(tasks_core.publish.signature())
+        return celery.chain(tasks)
+
     @staticmethod
     def check_parameters(parameters):
         """
         Checks that the following parameters are present with correct values:
-            - dataset_id: integer
+            - dataset_id: integer, or dataset_ids: list of integers
             - bounding_box: 4-elements list
         """
-        allowed_parameters = ('dataset_id', 'bounding_box', 'publish', 'copy_to')
+        allowed_parameters = ('dataset_id', 'bounding_box', 'publish', 'copy_to', 'dataset_ids')
         if not set(parameters).issubset(set(allowed_parameters)):
             raise ValidationError(
                 f"The download action accepts only the following parameters: {allowed_parameters}")
-        if not isinstance(parameters['dataset_id'], int):
+        if ('dataset_id' in parameters) == ('dataset_ids' in parameters):
+            raise ValidationError("Either 'dataset_id' or 'dataset_ids' must be given")
+        if 'dataset_id' in parameters and not isinstance(parameters['dataset_id'], int):
             raise ValidationError("'dataset_id' must be an integer")
+        if 'dataset_ids' in parameters:
+            dataset_ids = parameters['dataset_ids']
+            if (not isinstance(dataset_ids, list) or not dataset_ids or
+                    any(not isinstance(i, int) for i in dataset_ids)):
+                raise ValidationError("'dataset_ids' must be a non-empty list of integers")
+            if len(set(dataset_ids)) != len(dataset_ids):
+                raise ValidationError("'dataset_ids' must not contain duplicates")
+            if len(dataset_ids) > bundles.get_max_size():
+                raise ValidationError(
+                    f"A bundle can contain at most {bundles.get_max_size()} datasets")
         if ('bounding_box' in parameters and
                 not (isinstance(parameters['bounding_box'], Sequence) and
                      len(parameters['bounding_box']) == 4)):
@@ -126,8 +625,26 @@ class DownloadJob(Job):
 
     @staticmethod
     def make_task_parameters(parameters):
+        if 'dataset_ids' in parameters:
+            # the datasets are given to each branch of the bundle
+            return ((), {})
         return (((parameters['dataset_id'],),), {})
 
+    @staticmethod
+    def get_dataset_ids(parameters):
+        if 'dataset_ids' in parameters:
+            return tuple(parameters['dataset_ids'])
+        return (parameters['dataset_id'],)
+
+    @classmethod
+    def get_cleanup_signature(cls, parameters):
+        if 'dataset_ids' in parameters:
+            return celery.group(
+                tasks_core.remove_downloaded.signature(args=((dataset_id,),), immutable=True)
+                for dataset_id in parameters['dataset_ids'])
+        return tasks_core.remove_downloaded.signature(
+            args=((parameters['dataset_id'],),), immutable=True)
+
 
 class ConvertJob(Job):  # pylint: disable=abstract-method
     """Parameters management methods for all conversion jobs
@@ -227,6 +744,15 @@ class ConvertJob(Job):  # pylint: disable=abstract-method
     def make_task_parameters(parameters):
         return (((parameters['dataset_id'],),), {})
 
+    @staticmethod
+    def get_dataset_ids(parameters):
+        return (parameters['dataset_id'],)
+
+    @classmethod
+    def get_cleanup_signature(cls, parameters):
+        return tasks_core.remove_downloaded.signature(
+            args=((parameters['dataset_id'],),), immutable=True)
+
 
 class SyntoolCleanupJob(Job):
     """Job which cleans up ingested files older than a date"""
@@ -279,15 +805,24 @@ class SyntoolCompareJob(Job):
 
     @staticmethod
     def check_parameters(parameters):
+        """If `profiles_selection` is given instead of `profiles`, the
+        profiles which are co-located with the model are selected and
+        added to the parameters
+        """
         required_keys = ('model', 'profiles')
-        accepted_keys = (*required_keys, 'ttl')
+        accepted_keys = (*required_keys, 'profiles_selection', 'ttl')
         if not set(parameters).issubset(accepted_keys):
             raise ValidationError(
                 f"The compare action accepts only these parameters: {', '.join(accepted_keys)}")
 
-        if not set(required_keys).issubset(parameters):
+        if 'profiles' in parameters and 'profiles_selection' in parameters:
+            raise ValidationError("'profiles' and 'profiles_selection' are mutually exclusive")
+
+        if 'model' not in parameters or not (
+                'profiles' in parameters or 'profiles_selection' in parameters):
             raise ValidationError(
-                f"The following parameters are required for the compare action: {required_keys}")
+                f"The following parameters are required for the compare action: {required_keys} "
+                "('profiles' can be replaced with 'profiles_selection')")
 
         if ((not isinstance(parameters['model'], Sequence)) or
                 len(parameters['model']) != 2 or
@@ -296,6 +831,14 @@ class SyntoolCompareJob(Job):
                 any((not isinstance(p, str) for p in parameters['model'][1]))):
             raise ValidationError("'model' must be a tuple (model_id, model_path)")
 
+        if 'profiles_selection' in parameters:
+            colocation.check_selection(parameters['profiles_selection'])
+            profiles = colocation.select_profiles(
+                parameters['model'][0], **parameters['profiles_selection'])
+            if not profiles:
+                raise ValidationError("No profile matches the selection criteria")
+            parameters = {**parameters, 'profiles': profiles}
+
         valid_profiles = True
         if not isinstance(parameters['profiles'], Sequence):
             valid_profiles = False
@@ -323,27 +866,88 @@ class SyntoolCompareJob(Job):
 
 
 class HarvestJob(Job):
-    """Job which harvests metadata into the database"""
+    """Job which harvests metadata into the database. Search
+    configurations containing several searches or a long time range
+    are split into shards which are harvested in parallel.
+    """
     class Meta:
         proxy = True
         app_label = 'geospaas_rest_api'
 
+    @staticmethod
+    def get_shards(parameters):
+        """Returns the list of (provider_name, search_config) shards of
+        the job
+        """
+        return sharding.split_search_config(
+            parameters.get('search_config_dict', {}),
+            parameters.get('shard_days', sharding.get_setting('SHARD_DAYS', None)))
+
     @classmethod
     def get_signature(cls, parameters):
-        return tasks_harvesting.start_harvest.signature()
+        shards = cls.get_shards(parameters)
+        if len(shards) <= 1:
+            return tasks_harvesting.start_harvest.signature()
+        # the shards of each lane are harvested sequentially, and the
+        # lanes in parallel
+        lanes = [
+            celery.chain(
+                tasks_harvesting.start_harvest.signature(args=(shard,), immutable=True)
+                for shard in lane)
+            for lane in sharding.distribute_shards(shards)
+        ]
+        return celery.chord(
+            celery.group(lanes),
+            celery.signature('geospaas_rest_api.merge_harvest_results',
+                             kwargs={'shards': len(shards)}))
 
-    @staticmethod
-    def check_parameters(parameters):
-        if tuple(parameters.keys()) != ('search_config_dict',):
-            raise ValidationError('Only parameter accepted: "search_config_dict"')
+    @classmethod
+    def check_parameters(cls, parameters):
+        accepted_keys = ('search_config_dict', 'shard_days')
+        if 'search_config_dict' not in parameters or not set(parameters).issubset(accepted_keys):
+            raise ValidationError(
+                'Parameters accepted: "search_config_dict" (mandatory), "shard_days"')
         if not isinstance(parameters['search_config_dict'], dict):
             raise ValidationError('search_config_dict should be a dict')
+        if 'shard_days' in parameters and not (
+                parameters['shard_days'] is None or (
+                    isinstance(parameters['shard_days'], int) and
+                    not isinstance(parameters['shard_days'], bool) and
+                    parameters['shard_days'] > 0)):
+            raise ValidationError('shard_days should be a positive integer or None')
+        if not isinstance(parameters['search_config_dict'].get('searches', []), list):
+            raise ValidationError('The searches should be a list')
+        # checks that the time ranges can be split
+        cls.get_shards(parameters)
         return parameters
 
-    @staticmethod
-    def make_task_parameters(parameters):
+    @classmethod
+    def make_task_parameters(cls, parameters):
+        if len(cls.get_shards(parameters)) > 1:
+            # each shard task has its own configuration
+            return ((), {})
         return ((parameters['search_config_dict'],), {})
 
+    @classmethod
+    def compute_progress(cls, steps):
+        """Returns the number of shards of the job in each state, or
+        None if the job is not sharded
+        """
+        shard_ids = [step['task_id'] for step in steps
+                     if step['name'] == tasks_harvesting.start_harvest.name]
+        if len(shard_ids) <= 1:
+            return None
+        states = dict.fromkeys(shard_ids, celery.states.PENDING)
+        states.update(django_celery_results.models.TaskResult.objects
+                      .filter(task_id__in=shard_ids)
+                      .values_list('task_id', 'status'))
+        progress = {'shards': len(shard_ids), 'finished': 0, 'states': {}}
+        for state in states.values():
+            progress['states'][state] = progress['states'].get(state, 0) + 1
+            if state in celery.states.READY_STATES:
+                progress['finished'] += 1
+        return progress
+
 
 class WorkdirCleanupJob(Job):
     """Remove everything in the working directory"""
@@ -362,3 +966,13 @@ class WorkdirCleanupJob(Job):
     @staticmethod
     def make_task_parameters(parameters):
         return (tuple(), {})
+
+
+JOB_CLASSES = {
+    'download': DownloadJob,
+    'convert': ConvertJob,
+    'harvest': HarvestJob,
+    'syntool_cleanup': SyntoolCleanupJob,
+    'compare_profiles': SyntoolCompareJob,
+    'workdir_cleanup': WorkdirCleanupJob,
+}
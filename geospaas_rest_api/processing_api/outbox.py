@@ -0,0 +1,186 @@
+"""Transactional outbox for the submission of jobs.
+
+When the outbox is enabled, the tasks of a job are not sent to the
+broker while the job is being created. Their IDs are assigned and the
+signature is saved in a JobSubmission, in the same transaction as the
+job. The submissions are then published in batches by a background
+thread, which is woken up when the transaction is committed, so the API
+does not wait for the broker. The `publish_job_submissions` periodic
+task publishes the submissions which were left behind, for example if
+the broker was unavailable or the process stopped.
+
+The submissions of a batch are claimed in a short transaction which
+postpones their next attempt, then published once it is committed so
+that no lock is held while waiting for the broker. A job cancelled while
+it is being published is revoked afterwards.
+
+A job is published at least once: if the process stops after
+publishing a job but before removing its submission, the tasks are
+sent again with the same IDs.
+
+The outbox is configured by the following Django settings:
+  - GEOSPAAS_REST_API_JOB_OUTBOX: enables the outbox (default False).
+  - GEOSPAAS_REST_API_OUTBOX_BATCH_SIZE: maximum number of jobs
+    published in one batch (default 100).
+  - GEOSPAAS_REST_API_OUTBOX_RETRY_DELAY: delay in seconds before a
+    failed publication is retried. It is doubled after each failed
+    attempt (default 10).
+"""
+import logging
+import threading
+from datetime import timedelta
+
+import celery
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+import geospaas_rest_api.models as models
+import geospaas_rest_api.processing_api.executors as executors
+
+
+logger = logging.getLogger(__name__)
+
+# Maximum delay between two attempts
+MAX_RETRY_DELAY = timedelta(minutes=10)
+# Time after which a submission claimed by a publisher which stopped
+# can be published by another one
+CLAIM_DURATION = timedelta(minutes=5)
+
+
+def get_setting(name, default):
+    """Returns the value of an outbox setting"""
+    return getattr(settings, f"GEOSPAAS_REST_API_OUTBOX_{name}", default)
+
+
+def enabled():
+    """Returns True if the jobs are submitted through the outbox"""
+    return getattr(settings, 'GEOSPAAS_REST_API_JOB_OUTBOX', False)
+
+
+def dispatch(job):
+    """Saves `job` and sends its tasks to the broker once the
+    transaction is committed, either directly or through the outbox
+    """
+    if not enabled():
+        with transaction.atomic():
+            job.dispatch()
+            job.save()
+        return
+    signature, args, kwargs = job.prepare_dispatch()
+    with transaction.atomic():
+        job.save()
+        models.JobSubmission.objects.update_or_create(
+            job=job,
+            defaults={'signature': signature, 'args': list(args), 'kwargs': kwargs})
+        transaction.on_commit(dispatcher.wake)
+
+
+def record_failure(submission, error):
+    """Postpones the next publication attempt of a submission"""
+    submission.attempts += 1
+    submission.last_error = str(error)
+    submission.next_attempt = timezone.now() + min(
+        timedelta(seconds=get_setting('RETRY_DELAY', 10)) * 2 ** (submission.attempts - 1),
+        MAX_RETRY_DELAY)
+
+
+def claim_batch():
+    """Returns a batch of due submissions, and postpones their next
+    attempt so they are not picked by another publisher while they are
+    being published
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        submissions = list(
+            models.JobSubmission.objects
+            .select_for_update(skip_locked=True)
+            .filter(next_attempt__lte=now)
+            .order_by('id')[:get_setting('BATCH_SIZE', 100)])
+        (models.JobSubmission.objects
+         .filter(id__in=[s.id for s in submissions])
+         .update(next_attempt=now + CLAIM_DURATION))
+    return submissions
+
+
+def publish_batch():
+    """Publishes one batch of due submissions. The submissions are
+    claimed in a short transaction, and published once it is committed
+    so that no lock is held while waiting for the broker.
+    Returns the numbers of published and failed submissions.
+    """
+    submissions = claim_batch()
+    if not submissions:
+        return 0, 0
+
+    app = celery.current_app
+    executor = executors.get_executor()
+    published, failed = [], []
+    for submission in submissions:
+        try:
+            executor.submit(celery.signature(submission.signature, app=app),
+                            submission.args, submission.kwargs)
+        except Exception as error:  # pylint: disable=broad-except
+            record_failure(submission, error)
+            failed.append(submission)
+        else:
+            published.append(submission)
+
+    with transaction.atomic():
+        (models.Job.objects
+         .filter(id__in=[s.job_id for s in published])
+         .update(date_dispatched=timezone.now()))
+        models.JobSubmission.objects.filter(id__in=[s.id for s in published]).delete()
+        models.JobSubmission.objects.bulk_update(
+            failed, ['attempts', 'last_error', 'next_attempt'])
+    # jobs cancelled while they were being published
+    for job in models.Job.objects.filter(id__in=[s.job_id for s in published],
+                                         status=models.Job.CANCELLED):
+        executor.revoke(job)
+    return len(published), len(failed)
+
+
+def publish_pending_submissions():
+    """Publishes the due submissions until there are none left or the
+    broker fails. Returns the number of published submissions.
+    """
+    total = 0
+    while True:
+        published, failed = publish_batch()
+        total += published
+        if failed or not published:
+            return total
+
+
+class Dispatcher:
+    """Background thread which publishes the outbox when it is woken
+    up
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.thread = None
+
+    def wake(self):
+        """Wakes the dispatcher up, starting its thread if necessary"""
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name='geospaas-job-outbox', daemon=True)
+                self.thread.start()
+        self.event.set()
+
+    def run(self):
+        """Publishes the outbox each time the dispatcher is woken up"""
+        while True:
+            self.event.wait()
+            self.event.clear()
+            close_old_connections()
+            try:
+                publish_pending_submissions()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Failed to publish the job submissions")
+
+
+dispatcher = Dispatcher()
@@ -0,0 +1,32 @@
+"""Renderers for the processing API"""
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Renderer for Server-Sent Events responses. The events are
+    streamed by the view, so this renderer is only used for content
+    negotiation and error messages.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, str):
+            return data.encode(self.charset)
+        return f"event: error\ndata: {json.dumps(data)}\n\n".encode(self.charset)
+
+
+class FileRenderer(BaseRenderer):
+    """Renderer for file downloads. The files are sent by the view, so
+    this renderer is only used for content negotiation and error
+    messages.
+    """
+    media_type = '*/*'
+    format = 'file'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data).encode(self.charset)
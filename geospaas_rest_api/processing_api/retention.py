@@ -0,0 +1,152 @@
+"""Retention policy for the jobs and the task results.
+
+Finished jobs and task results older than the retention period are
+deleted in small batches, each in its own short transaction, so the
+tables are never locked for long. Before being deleted, the rows can be
+appended to a gzip-compressed JSON lines archive.
+
+The policy applied by the periodic task is configured by the following
+Django settings:
+  - GEOSPAAS_REST_API_RETENTION_DAYS: number of days after which
+    finished jobs and task results are removed. Nothing is removed if
+    None (default).
+  - GEOSPAAS_REST_API_RETENTION_BATCH_SIZE: number of rows deleted in
+    each transaction (default 500).
+  - GEOSPAAS_REST_API_RETENTION_ARCHIVE_DIR: if set, the removed rows
+    are archived in a file in this directory.
+"""
+import gzip
+import json
+import os.path
+import time
+from datetime import timedelta
+
+import celery.states
+import django_celery_results.models
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+import geospaas_rest_api.models as models
+import geospaas_rest_api.processing_api.admission as admission
+
+
+def get_setting(name, default):
+    """Returns the value of a retention setting"""
+    return getattr(settings, f"GEOSPAAS_REST_API_RETENTION_{name}", default)
+
+
+def expired_jobs(cutoff):
+    """Returns a queryset of the jobs finished before `cutoff` which
+    have no callback waiting to be delivered. The finish date of the
+    jobs which do not have one is their creation date.
+    """
+    return (models.Job.objects
+            .filter(Q(date_done__lt=cutoff) | Q(date_done__isnull=True, date_created__lt=cutoff),
+                    status__in=models.Job.FINISHED_STATES)
+            .exclude(callbacks__status=models.JobCallback.PENDING))
+
+
+def unfinished_task_ids(cutoff):
+    """Returns the IDs of all the tasks of the unfinished jobs created
+    before `cutoff`. The tasks of the jobs created later can't have
+    finished before `cutoff`.
+    """
+    task_ids = set()
+    for job in (models.Job.objects
+                .exclude(status__in=models.Job.FINISHED_STATES)
+                .filter(date_created__lt=cutoff)
+                .only('task_id', 'root_task_id', 'steps')
+                .iterator()):
+        task_ids.update(job.get_task_ids())
+    return task_ids
+
+
+def expired_task_results(cutoff):
+    """Returns a queryset of the task results finished before `cutoff`
+    which do not belong to an unfinished job. The results of all the
+    steps of the unfinished jobs are kept, because their status is
+    computed from them.
+    """
+    return (django_celery_results.models.TaskResult.objects
+            .filter(status__in=celery.states.READY_STATES, date_done__lt=cutoff)
+            .exclude(task_id__in=unfinished_task_ids(cutoff)))
+
+
+def archive_rows(archive, model_label, rows):
+    """Writes rows as JSON lines to an open archive file"""
+    for row in rows:
+        archive.write(json.dumps({'model': model_label, 'fields': row}, cls=DjangoJSONEncoder))
+        archive.write('\n')
+    archive.flush()
+
+
+def delete_in_batches(queryset, batch_size, archive=None, pause=0):
+    """Deletes the rows of `queryset` in batches of `batch_size` rows,
+    each batch in its own transaction. If `archive` is an open file,
+    the rows are written to it before being deleted.
+    Returns the number of deleted rows.
+    """
+    model = queryset.model
+    model_label = model._meta.label_lower
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            batch_ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not batch_ids:
+                break
+            batch = model.objects.filter(pk__in=batch_ids)
+            if archive is not None:
+                archive_rows(archive, model_label, batch.values())
+            # delete() returns the number of rows including the
+            # cascaded ones, so count the batch itself
+            batch.delete()
+        deleted += len(batch_ids)
+        if len(batch_ids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return deleted
+
+
+def purge(days, batch_size=None, archive_dir=None, pause=0, now=None):
+    """Removes the jobs and task results which finished more than
+    `days` days ago. If `archive_dir` is provided, the removed rows are
+    archived in a `geospaas_jobs_<date>.jsonl.gz` file in this
+    directory.
+    Returns a dictionary containing the number of removed rows for
+    each table.
+    """
+    batch_size = batch_size or get_setting('BATCH_SIZE', 500)
+    now = now or timezone.now()
+    cutoff = now - timedelta(days=days)
+    # the status of the old jobs is read from their task results
+    # before the results are removed
+    admission.sync_stale_jobs(now)
+
+    archive = None
+    if archive_dir:
+        archive_path = os.path.join(
+            archive_dir, f"geospaas_jobs_{now.strftime('%Y%m%dT%H%M%S')}.jsonl.gz")
+        archive = gzip.open(archive_path, 'at', encoding='utf-8')
+    try:
+        return {
+            'jobs': delete_in_batches(expired_jobs(cutoff), batch_size, archive, pause),
+            'task_results': delete_in_batches(
+                expired_task_results(cutoff), batch_size, archive, pause),
+        }
+    finally:
+        if archive is not None:
+            archive.close()
+
+
+def apply_retention_policy():
+    """Applies the retention policy defined in the settings.
+    Returns None if no policy is defined.
+    """
+    days = get_setting('DAYS', None)
+    if days is None:
+        return None
+    return purge(days, archive_dir=get_setting('ARCHIVE_DIR', None))
@@ -0,0 +1,102 @@
+"""Incremental harvests run periodically from the HarvestSchedules.
+
+At each run, a schedule launches a harvest job covering the time range
+between its high-water mark (minus the overlap) and the time of the
+run. The high-water mark is moved to the end of this range once the
+job has succeeded; if the job fails, the same range is harvested again
+by the next run, extended up to the time of that run.
+
+`run_due_schedules()` is meant to be called periodically by the
+`run_harvest_schedules` task. A schedule whose job is rejected because
+too many jobs are running is retried after the delay estimated by the
+admission control.
+"""
+import copy
+import logging
+from datetime import timedelta
+
+import celery.states
+from django.db import transaction
+from django.utils import timezone
+
+import geospaas_rest_api.models as models
+import geospaas_rest_api.processing_api.admission as admission
+
+
+logger = logging.getLogger(__name__)
+
+def due_schedules(now):
+    """Returns a queryset of the enabled schedules which should run"""
+    return models.HarvestSchedule.objects.filter(enabled=True, next_run__lte=now).order_by('id')
+
+
+def get_parameters(schedule, end):
+    """Returns the parameters of the harvest job which covers the time
+    range from the high-water mark of `schedule` to `end`
+    """
+    search_config = copy.deepcopy(schedule.search_config_dict)
+    search_config['common'] = {
+        **(search_config.get('common') or {}),
+        'start_time': (schedule.high_water_mark - schedule.overlap).isoformat(),
+        'end_time': end.isoformat(),
+    }
+    parameters = {'search_config_dict': search_config}
+    if schedule.shard_days is not None:
+        parameters['shard_days'] = schedule.shard_days
+    return parameters
+
+
+def check_last_job(schedule):
+    """Moves the high-water mark of a schedule forward if its last job
+    succeeded. Returns True if the last job is still running.
+    """
+    job = schedule.last_job
+    if job is None or schedule.pending_mark is None:
+        return False
+    if job.status not in models.Job.FINISHED_STATES:
+        job.update_status()
+        if job.status not in models.Job.FINISHED_STATES:
+            return True
+    if job.status == celery.states.SUCCESS:
+        schedule.high_water_mark = max(schedule.high_water_mark, schedule.pending_mark)
+    schedule.pending_mark = None
+    return False
+
+
+def launch_job(schedule, now):
+    """Creates and submits the harvest job of a schedule"""
+    parameters = models.HarvestJob.check_parameters(get_parameters(schedule, now))
+    job = models.HarvestJob(action='harvest', parameters=parameters,
+                            client=f"schedule:{schedule.name}")
+    admission.submit(job)
+    schedule.last_job = job
+    schedule.pending_mark = now
+
+
+def run_due_schedules(now=None):
+    """Launches the harvest jobs of the schedules which are due.
+    Returns the number of launched jobs.
+    """
+    now = now or timezone.now()
+    launched = 0
+    with transaction.atomic():
+        for schedule in (due_schedules(now)
+                         .select_for_update(skip_locked=True, of=('self',))
+                         .select_related('last_job')):
+            if check_last_job(schedule):
+                # the next run can only start once the previous one is
+                # finished
+                continue
+            if schedule.high_water_mark < now:
+                try:
+                    launch_job(schedule, now)
+                except admission.JobLimitExceeded as error:
+                    logger.warning("The job of schedule %s was rejected: %s",
+                                   schedule.name, error.detail)
+                    schedule.next_run = now + timedelta(seconds=error.wait or 0)
+                    schedule.save()
+                    continue
+                launched += 1
+            schedule.next_run = now + schedule.interval
+            schedule.save()
+    return launched
@@ -1,22 +1,65 @@
 """Serializers for the processing API"""
+import copy
+
 import rest_framework.serializers
 import celery.result
+from django.conf import settings
+from django.core.validators import URLValidator
 import django_celery_results.models
 import geospaas_processing.models
 
+import geospaas_rest_api.base_api.serializers as base_serializers
 import geospaas_rest_api.models as models
+import geospaas_rest_api.processing_api.admission as admission
+import geospaas_rest_api.processing_api.executors as executors
+import geospaas_rest_api.processing_api.validation as validation
+
+
+def check_datasets(jobs_data):
+    """Checks that the datasets needed by the jobs exist and can be
+    fetched, using one query for all the jobs.
+    Returns the list of error messages.
+    """
+    job_datasets = [
+        models.JOB_CLASSES[data['action']].get_dataset_ids(data['parameters'])
+        for data in jobs_data
+    ]
+    dataset_errors = validation.find_unusable_datasets(
+        dataset_id for dataset_ids in job_datasets for dataset_id in dataset_ids)
+    return [
+        [dataset_errors[dataset_id] for dataset_id in dataset_ids if dataset_id in dataset_errors]
+        for dataset_ids in job_datasets
+    ]
+
+
+class JobListSerializer(rest_framework.serializers.ListSerializer):
+    """Serializer used to create several jobs in one request"""
+
+    def validate(self, attrs):
+        """Checks the datasets of all the jobs at once"""
+        max_jobs = getattr(settings, 'GEOSPAAS_REST_API_MAX_JOBS_PER_REQUEST', 100)
+        if not attrs:
+            raise rest_framework.serializers.ValidationError("At least one job is required")
+        if len(attrs) > max_jobs:
+            raise rest_framework.serializers.ValidationError(
+                f"At most {max_jobs} jobs can be created in one request")
+        errors = [
+            f"Job {i}: {error}"
+            for i, job_errors in enumerate(check_datasets(attrs))
+            for error in job_errors
+        ]
+        if errors:
+            raise rest_framework.serializers.ValidationError(errors)
+        return attrs
+
 
 class JobSerializer(rest_framework.serializers.Serializer):
     """Serializer for Job objects"""
 
-    jobs = {
-        'download': models.DownloadJob,
-        'convert': models.ConvertJob,
-        'harvest': models.HarvestJob,
-        'syntool_cleanup': models.SyntoolCleanupJob,
-        'compare_profiles': models.SyntoolCompareJob,
-        'workdir_cleanup': models.WorkdirCleanupJob,
-    }
+    class Meta:
+        list_serializer_class = JobListSerializer
+
+    jobs = models.JOB_CLASSES
 
     # Actual Job fields
     id = rest_framework.serializers.IntegerField(read_only=True)
@@ -37,11 +80,31 @@ class JobSerializer(rest_framework.serializers.Serializer):
         help_text="Action to perform")
     parameters = rest_framework.serializers.DictField(write_only=True,
                                                       help_text="Parameters for the action")
+    callback_url = rest_framework.serializers.URLField(
+        required=False, write_only=True, max_length=2000,
+        validators=[URLValidator(schemes=['http', 'https'])],
+        help_text="URL to which the job status is POSTed when the job is finished")
 
     def to_representation(self, instance):
         """Generate a representation of the job"""
         representation = super().to_representation(instance)
-
+        if self.context.get('timeline'):
+            representation['timeline'] = instance.get_timeline()
+        progress = instance.get_progress()
+        if progress is not None:
+            representation['progress'] = progress
+
+        if not instance.task_id:
+            # the job has not been sent to the broker yet
+            representation['status'] = instance.status
+            return representation
+        if instance.status == models.Job.CANCELLED:
+            representation['status'] = instance.status
+            representation['date_done'] = instance.date_done
+            return representation
+
+        # the stored status is maintained by the signal handlers, so
+        # reading a job does not write to the database
         current_result, finished = instance.get_current_task_result()
         if isinstance(current_result, celery.result.AsyncResult):
             representation['status'] = current_result.state
@@ -71,16 +134,34 @@ class JobSerializer(rest_framework.serializers.Serializer):
 
     def create(self, validated_data):
         """Launches a long-running task, and returns the corresponding AsyncResult"""
+        request = self.context.get('request')
+        user = getattr(request, 'user', None)
         # choose the right Job class
-        job = self.choose_job_class(validated_data).run(validated_data['parameters'])
-        job.save()
+        job = self.choose_job_class(validated_data)(
+            action=validated_data['action'],
+            parameters=copy.deepcopy(validated_data['parameters']),
+            user=user if user is not None and user.is_authenticated else None,
+            client=admission.get_client_id(request),
+            callback_url=validated_data.get('callback_url', ''))
+        admission.submit(job)
         return job
 
     def validate(self, attrs):
         """Validates the request data"""
         # No need to check for the presence of 'action' and 'parameters',
         # because fields are checked before this method comes into play
-        attrs['parameters'] = self.choose_job_class(attrs).check_parameters(attrs['parameters'])
+        job_class = self.choose_job_class(attrs)
+        attrs['parameters'] = job_class.check_parameters(attrs['parameters'])
+        try:
+            executors.get_executor().check(
+                job_class.get_signature(copy.deepcopy(attrs['parameters'])))
+        except ValueError as error:
+            raise rest_framework.serializers.ValidationError(str(error)) from error
+        # the datasets of several jobs are checked together by the list serializer
+        if not isinstance(self.parent, JobListSerializer):
+            errors = check_datasets([attrs])[0]
+            if errors:
+                raise rest_framework.serializers.ValidationError(errors)
         return attrs
 
 
@@ -92,7 +173,40 @@ class TaskResultSerializer(rest_framework.serializers.ModelSerializer):
 
 
 class ProcessingResultSerializer(rest_framework.serializers.ModelSerializer):
-    """Serializer for ProcessingResult objects"""
+    """Serializer for ProcessingResult objects. The dataset is
+    included in the representation if `expand_dataset` is set in the
+    context.
+    """
     class Meta:
         model = geospaas_processing.models.ProcessingResult
         fields = '__all__'
+
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        if self.context.get('expand_dataset'):
+            representation['dataset'] = base_serializers.DatasetSerializer(
+                instance.dataset, context=self.context).data
+        return representation
+
+
+class HarvestScheduleSerializer(rest_framework.serializers.ModelSerializer):
+    """Serializer for HarvestSchedule objects"""
+    class Meta:
+        model = models.HarvestSchedule
+        fields = '__all__'
+        read_only_fields = ('pending_mark', 'last_job', 'date_created')
+
+    def validate(self, attrs):
+        """Checks that the search configuration can be harvested"""
+        search_config = attrs.get(
+            'search_config_dict', getattr(self.instance, 'search_config_dict', {}))
+        common = search_config.get('common') if isinstance(search_config, dict) else None
+        if isinstance(common, dict) and set(common).intersection(('start_time', 'end_time')):
+            raise rest_framework.serializers.ValidationError(
+                "The time range is managed by the schedule and can't be part of the search "
+                "configuration")
+        parameters = {'search_config_dict': search_config}
+        if attrs.get('shard_days') is not None:
+            parameters['shard_days'] = attrs['shard_days']
+        models.HarvestJob.check_parameters(parameters)
+        return attrs
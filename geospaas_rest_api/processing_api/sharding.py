@@ -0,0 +1,142 @@
+"""Splitting of harvest jobs into shards which can run in parallel.
+
+A search configuration contains common parameters and a list of
+searches, each using one provider. It is split into one shard per
+search and, if a window length is given, per time window. The shards
+of a provider are distributed among a limited number of chains, so that
+at most this number of shards harvest from the same provider at the
+same time.
+
+The sharding is configured by the following Django settings:
+  - GEOSPAAS_REST_API_HARVEST_SHARD_DAYS: default length in days of the
+    time windows. The time range is not split if None (default).
+  - GEOSPAAS_REST_API_HARVEST_PROVIDER_CONCURRENCY: dictionary
+    associating provider names to the maximum number of shards which
+    can run at the same time for this provider.
+  - GEOSPAAS_REST_API_HARVEST_DEFAULT_CONCURRENCY: concurrency limit of
+    the providers which are not in the previous setting (default 2).
+  - GEOSPAAS_REST_API_HARVEST_MAX_SHARDS: maximum number of shards of a
+    job (default 500). The time windows are widened so that the shards
+    of all the searches fit within this limit.
+"""
+import copy
+import math
+from datetime import datetime, time, timedelta, timezone
+
+from django.conf import settings
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+
+TIME_KEYS = ('start_time', 'end_time')
+
+
+def get_setting(name, default):
+    """Returns the value of a harvest setting"""
+    return getattr(settings, f"GEOSPAAS_REST_API_HARVEST_{name}", default)
+
+
+def get_concurrency(provider_name):
+    """Returns the maximum number of shards which can harvest from a
+    provider at the same time
+    """
+    limits = get_setting('PROVIDER_CONCURRENCY', {})
+    return max(1, limits.get(provider_name, get_setting('DEFAULT_CONCURRENCY', 2)))
+
+
+def parse_time(value):
+    """Parses a date or datetime in ISO format. Naive values are
+    considered to be in UTC.
+    """
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        try:
+            parsed = parse_datetime(value)
+            if parsed is None:
+                date = parse_date(value)
+                parsed = datetime.combine(date, time()) if date else None
+        except (TypeError, ValueError):
+            parsed = None
+    if parsed is None:
+        raise ValidationError(f"Invalid time: {value}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def get_max_shards():
+    """Returns the maximum number of shards of a job"""
+    return get_setting('MAX_SHARDS', 500)
+
+
+def split_time_range(start_time, end_time, window_days, max_windows=None):
+    """Returns a list of (start, end) tuples covering the time range
+    with windows of `window_days` days. The windows are widened if
+    there would be more than `max_windows` of them.
+    """
+    start, end = parse_time(start_time), parse_time(end_time)
+    if start >= end:
+        raise ValidationError(f"The start time must be before the end time ({start_time})")
+    span = end - start
+    try:
+        window = min(timedelta(days=window_days), span)
+    except OverflowError:
+        window = span
+    if max_windows and math.ceil(span / window) > max_windows:
+        # rounded up so that the range is covered by max_windows windows
+        window = -(-span // max_windows)
+    windows = []
+    while start < end:
+        windows.append((start, min(start + window, end)))
+        start += window
+    return windows
+
+
+def split_search_config(search_config, window_days=None):
+    """Returns a list of (provider_name, shard_config) tuples, where
+    each shard configuration contains one search over one time window
+    """
+    common = search_config.get('common') or {}
+    searches = search_config.get('searches') or []
+    if len(searches) > get_max_shards():
+        raise ValidationError(
+            f"A harvest can contain at most {get_max_shards()} searches")
+    shards = []
+    for search in searches:
+        if not isinstance(search, dict):
+            raise ValidationError("The searches must be dictionaries")
+        times = {key: search.get(key, common.get(key)) for key in TIME_KEYS}
+        shard_common = {key: value for key, value in common.items() if key not in TIME_KEYS}
+        shard_search = {key: value for key, value in search.items() if key not in TIME_KEYS}
+        if window_days and all(times.values()):
+            windows = [
+                {'start_time': start.isoformat(), 'end_time': end.isoformat()}
+                for start, end in split_time_range(
+                    times['start_time'], times['end_time'], window_days,
+                    get_max_shards() // len(searches))
+            ]
+        else:
+            windows = [{key: value for key, value in times.items() if value is not None}]
+        for window in windows:
+            shards.append((search.get('provider_name'), {
+                **copy.deepcopy(search_config),
+                'common': {**shard_common, **window},
+                'searches': [shard_search],
+            }))
+    return shards
+
+
+def distribute_shards(shards):
+    """Distributes the shards of each provider among as many lists as
+    the provider's concurrency limit allows. Returns the list of shard
+    lists, each of which is meant to be run sequentially.
+    """
+    lanes = []
+    by_provider = {}
+    for provider_name, shard_config in shards:
+        by_provider.setdefault(provider_name, []).append(shard_config)
+    for provider_name, provider_shards in by_provider.items():
+        concurrency = min(get_concurrency(provider_name), len(provider_shards))
+        lanes.extend(provider_shards[i::concurrency] for i in range(concurrency))
+    return lanes
@@ -0,0 +1,55 @@
+"""Celery signal handlers which keep the status of the jobs up to date
+in the database while their tasks are executed by the workers, and
+release the queued jobs when running jobs end
+"""
+import celery.signals
+import celery.states
+from django.db.models import Q
+
+import geospaas_rest_api.models as models
+import geospaas_rest_api.processing_api.admission as admission
+
+
+def get_task_jobs(task_id, root_id):
+    """Returns a queryset of the unfinished jobs to which a task
+    belongs
+    """
+    return (models.Job.objects
+            .filter(Q(root_task_id=root_id or task_id) | Q(task_id=task_id))
+            .exclude(status__in=models.Job.FINISHED_STATES))
+
+
+def refresh_jobs(task_id, root_id):
+    """Updates the status of the unfinished jobs to which a task
+    belongs, then releases queued jobs if one of them ended
+    """
+    ended = False
+    for job in get_task_jobs(task_id, root_id):
+        job.update_status()
+        ended = ended or job.status in models.Job.FINISHED_STATES
+    if ended and admission.queue_excess_jobs() and admission.queued_jobs().exists():
+        admission.release_queued_jobs()
+
+
+@celery.signals.task_prerun.connect
+def mark_job_started(task_id=None, task=None, **kwargs):
+    """Sets the status of a pending job to STARTED when one of its
+    tasks starts
+    """
+    (get_task_jobs(task_id, task.request.root_id)
+     .filter(status=celery.states.PENDING)
+     .update(status=celery.states.STARTED))
+
+
+@celery.signals.task_postrun.connect
+def refresh_job_status(task_id=None, task=None, **kwargs):
+    """Updates the status of a job from the result backend when one of
+    its tasks is finished
+    """
+    refresh_jobs(task_id, task.request.root_id)
+
+
+@celery.signals.task_revoked.connect
+def refresh_revoked_job_status(request=None, **kwargs):
+    """Updates the status of a job when one of its tasks is revoked"""
+    refresh_jobs(request.id, request.root_id)
@@ -0,0 +1,79 @@
+"""Celery tasks used to manage jobs. Most of them are meant to be run
+periodically using Celery beat; the others are steps of some jobs.
+Importing this module also connects the signal handlers which keep the
+jobs status up to date.
+"""
+import celery
+
+import geospaas_rest_api.models as models
+import geospaas_rest_api.processing_api.admission as admission
+import geospaas_rest_api.processing_api.bundles as bundles
+import geospaas_rest_api.processing_api.callbacks as callbacks
+import geospaas_rest_api.processing_api.outbox as outbox
+import geospaas_rest_api.processing_api.retention as retention
+import geospaas_rest_api.processing_api.schedules as schedules
+import geospaas_rest_api.processing_api.signals  # pylint: disable=unused-import
+
+
+@celery.shared_task(name='geospaas_rest_api.release_queued_jobs')
+def release_queued_jobs():
+    """Sends the queued jobs to the broker when capacity allows it"""
+    return admission.release_queued_jobs()
+
+
+@celery.shared_task(name='geospaas_rest_api.sync_stale_jobs')
+def sync_stale_jobs():
+    """Updates the status of the jobs which have been running for a
+    long time from the result backend
+    """
+    return admission.sync_stale_jobs()
+
+
+@celery.shared_task(name='geospaas_rest_api.publish_job_submissions')
+def publish_job_submissions():
+    """Sends the tasks of the jobs waiting in the outbox to the broker"""
+    return outbox.publish_pending_submissions()
+
+
+@celery.shared_task(name='geospaas_rest_api.deliver_callbacks')
+def deliver_callbacks():
+    """Sends the pending job callbacks"""
+    return callbacks.deliver_pending_callbacks()
+
+
+@celery.shared_task(name='geospaas_rest_api.purge_jobs')
+def purge_jobs():
+    """Removes the old jobs and task results according to the
+    retention settings
+    """
+    return retention.apply_retention_policy()
+
+
+@celery.shared_task(name='geospaas_rest_api.run_harvest_schedules')
+def run_harvest_schedules():
+    """Launches the harvest jobs of the schedules which are due"""
+    return schedules.run_due_schedules()
+
+
+@celery.shared_task(name='geospaas_rest_api.merge_harvest_results')
+def merge_harvest_results(results, shards=None):
+    """Last task of the sharded harvest jobs, executed when all the
+    shards are harvested
+    """
+    return {'shards': shards, 'results': results}
+
+
+@celery.shared_task(name='geospaas_rest_api.wait_for_job_tasks')
+def wait_for_job_tasks(job_id):
+    """First step of the cleanup of a cancelled job: waits until its
+    revoked tasks are not running anymore
+    """
+    models.Job.objects.get(pk=job_id).wait_for_tasks()
+
+
+@celery.shared_task(name='geospaas_rest_api.create_bundle', track_started=True)
+def create_bundle(results, name):
+    """Gathers the files produced for the datasets of a bundle in one
+    archive
+    """
+    return bundles.create_bundle(results, name)
@@ -0,0 +1,47 @@
+"""Checks made on the datasets referenced by jobs before the jobs are
+created, so that jobs which can't succeed are not queued.
+
+The services considered usable to fetch a dataset are defined by the
+GEOSPAAS_REST_API_SUPPORTED_URI_SERVICES Django setting.
+"""
+import geospaas.catalog.models
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+
+
+# Services of the DatasetURIs from which datasets can be downloaded
+DEFAULT_SUPPORTED_SERVICES = ('HTTPServer', 'OPENDAP', 'ftp', 'local')
+
+
+def get_supported_services():
+    """Returns the services of the DatasetURIs which can be used to
+    fetch datasets
+    """
+    return getattr(
+        settings, 'GEOSPAAS_REST_API_SUPPORTED_URI_SERVICES', DEFAULT_SUPPORTED_SERVICES)
+
+
+def find_unusable_datasets(dataset_ids):
+    """Returns a dictionary associating the IDs of the datasets which
+    don't exist or have no URI with a supported service to an error
+    message. The datasets are checked in one query.
+    """
+    dataset_ids = set(dataset_ids)
+    if not dataset_ids:
+        return {}
+    services = get_supported_services()
+    usable = dict(
+        geospaas.catalog.models.Dataset.objects
+        .filter(id__in=dataset_ids)
+        .annotate(fetchable=Exists(geospaas.catalog.models.DatasetURI.objects.filter(
+            dataset=OuterRef('pk'), service__in=services)))
+        .values_list('id', 'fetchable'))
+
+    errors = {}
+    for dataset_id in sorted(dataset_ids):
+        if dataset_id not in usable:
+            errors[dataset_id] = f"Dataset {dataset_id} does not exist"
+        elif not usable[dataset_id]:
+            errors[dataset_id] = (f"Dataset {dataset_id} has no URI with a supported service "
+                                  f"({', '.join(services)})")
+    return errors
@@ -1,16 +1,47 @@
 """Views for the processing API"""
+import django
 import django_celery_results.models
 import rest_framework.mixins
 import geospaas_processing.models
-from rest_framework.viewsets import GenericViewSet, ReadOnlyModelViewSet
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.viewsets import GenericViewSet, ModelViewSet, ReadOnlyModelViewSet
 
+import geospaas_rest_api.base_api.backends as base_backends
+import geospaas_rest_api.base_api.views as base_views
 import geospaas_rest_api.models as models
 import geospaas_rest_api.pagination as pagination
+import geospaas_rest_api.processing_api.downloads as downloads
+import geospaas_rest_api.processing_api.events as events
 import geospaas_rest_api.processing_api.filters as filters
+import geospaas_rest_api.processing_api.metrics as metrics
+import geospaas_rest_api.processing_api.renderers as renderers
 import geospaas_rest_api.processing_api.serializers as serializers
 
 
-class JobViewSet(rest_framework.mixins.CreateModelMixin,
+class EventsNotSupported(APIException):
+    """Error returned when the events are requested from an ASGI
+    server with a version of Django which can't stream asynchronously
+    """
+    status_code = status.HTTP_501_NOT_IMPLEMENTED
+    default_detail = 'Event streams under ASGI require Django 4.2 or later.'
+    default_code = 'events_not_supported'
+
+
+class JobAlreadyFinished(APIException):
+    """Error returned when trying to cancel a finished job"""
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The job is already finished.'
+    default_code = 'job_finished'
+
+
+class JobViewSet(base_backends.CostGuardMixin,
+                 rest_framework.mixins.CreateModelMixin,
                  rest_framework.mixins.ListModelMixin,
                  rest_framework.mixins.RetrieveModelMixin,
                  GenericViewSet):
@@ -18,6 +49,96 @@ class JobViewSet(rest_framework.mixins.CreateModelMixin,
     queryset = models.Job.objects.all()
     serializer_class = serializers.JobSerializer
     pagination_class = pagination.IdOrderedCursorPagination
+    filterset_class = filters.JobFilter
+
+    def get_serializer(self, *args, **kwargs):
+        """Allows creating several jobs by sending a list"""
+        if isinstance(kwargs.get('data'), list):
+            kwargs['many'] = True
+        return super().get_serializer(*args, **kwargs)
+
+    def get_serializer_context(self):
+        """Adds the timeline of the job to its representation if the
+        `timeline` parameter is set
+        """
+        context = super().get_serializer_context()
+        context['timeline'] = (
+            self.action == 'retrieve' and
+            self.request.query_params.get('timeline', '').lower() in ('1', 'true'))
+        return context
+
+    def cancel_job(self):
+        """Cancels the job designated by the request URL"""
+        job = self.get_object()
+        if not job.cancel():
+            raise JobAlreadyFinished()
+        return job
+
+    def destroy(self, request, *args, **kwargs):
+        """Cancels a job. The job itself is kept"""
+        self.cancel_job()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        """Cancels a job and returns its representation"""
+        return Response(self.get_serializer(self.cancel_job()).data)
+
+    @staticmethod
+    def stream_events(request, job_ids):
+        """Returns a response streaming the status changes of the jobs
+        as Server-Sent Events
+        """
+        stream = events.JobEventStream(job_ids)
+        if isinstance(request._request, ASGIRequest):
+            # Before 4.2, Django iterates over streaming responses
+            # inside the event loop, where the polling would block
+            if django.VERSION < (4, 2):
+                raise EventsNotSupported()
+            content = stream.async_events()
+        else:
+            content = stream.events()
+        response = StreamingHttpResponse(content, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @action(detail=True, methods=['get'], renderer_classes=[renderers.EventStreamRenderer])
+    def events(self, request, pk=None):
+        """Stream of the status changes of a job"""
+        return self.stream_events(request, [self.get_object().pk])
+
+    @action(detail=False, methods=['get'], url_path='events', url_name='events-list',
+            renderer_classes=[renderers.EventStreamRenderer])
+    def events_list(self, request):
+        """Stream of the status changes of several jobs, which IDs are
+        given as a comma-separated list in the `ids` parameter
+        """
+        try:
+            job_ids = [int(i) for i in request.query_params.get('ids', '').split(',') if i]
+        except ValueError as error:
+            raise ValidationError({'ids': 'Must be a comma-separated list of integers'}) from error
+        if not job_ids or len(job_ids) > events.MAX_JOBS:
+            raise ValidationError({'ids': f"Between 1 and {events.MAX_JOBS} job IDs are required"})
+        existing_ids = list(
+            self.get_queryset().filter(id__in=job_ids).values_list('id', flat=True))
+        if not existing_ids:
+            raise NotFound()
+        return self.stream_events(request, existing_ids)
+
+    @action(detail=False, methods=['get'])
+    def metrics(self, request):
+        """Per-action job counts, throughput, queue wait and duration
+        over sliding windows
+        """
+        return Response(metrics.get_job_metrics())
+
+
+class HarvestScheduleViewSet(ModelViewSet):
+    """API endpoint to manage periodic harvests"""
+    queryset = models.HarvestSchedule.objects.all()
+    serializer_class = serializers.HarvestScheduleSerializer
+    pagination_class = pagination.IdOrderedCursorPagination
 
 
 class TaskViewSet(ReadOnlyModelViewSet):
@@ -28,8 +149,46 @@ class TaskViewSet(ReadOnlyModelViewSet):
     pagination_class = pagination.DateOrderedCursorPagination
 
 
-class ProcessingResultViewSet(ReadOnlyModelViewSet):
-    """API endpoint to view ProcessingResults"""
+class ProcessingResultViewSet(base_views.CostGuardedViewSet):
+    """API endpoint to view ProcessingResults. The datasets are
+    included in the results when the `expand=dataset` parameter is
+    given.
+    """
     queryset = geospaas_processing.models.ProcessingResult.objects.all().order_by('created')
     serializer_class = serializers.ProcessingResultSerializer
     filterset_class = filters.ProcessingResultFilter
+
+    EXPANDABLE_FIELDS = ('dataset',)
+
+    def get_expanded_fields(self):
+        """Returns the fields to expand, given as a comma-separated list
+        in the `expand` parameter
+        """
+        expand = {field for field in self.request.query_params.get('expand', '').split(',')
+                  if field}
+        unknown = expand.difference(self.EXPANDABLE_FIELDS)
+        if unknown:
+            raise ValidationError({
+                'expand': f"Only these fields can be expanded: {', '.join(self.EXPANDABLE_FIELDS)}"
+            })
+        return expand
+
+    def get_queryset(self):
+        """Fetches the datasets in the same query when they are
+        expanded
+        """
+        queryset = super().get_queryset()
+        if 'dataset' in self.get_expanded_fields():
+            queryset = queryset.select_related('dataset')
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['expand_dataset'] = 'dataset' in self.get_expanded_fields()
+        return context
+
+    @action(detail=True, methods=['get'],
+            renderer_classes=[JSONRenderer, renderers.FileRenderer])
+    def download(self, request, pk=None):
+        """Sends the file of a processing result"""
+        return downloads.serve_file(request, self.get_object().path)
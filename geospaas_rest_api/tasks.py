@@ -0,0 +1,18 @@
+"""Celery tasks, exposed here so they can be found by the Celery
+autodiscovery mechanism
+"""
+try:
+    import geospaas_processing
+except ImportError:  # pragma: no cover
+    geospaas_processing = None
+
+if geospaas_processing:
+    from geospaas_rest_api.processing_api.tasks import (create_bundle,
+                                                     deliver_callbacks,
+                                                     merge_harvest_results,
+                                                     publish_job_submissions,
+                                                     purge_jobs,
+                                                     release_queued_jobs,
+                                                     run_harvest_schedules,
+                                                     sync_stale_jobs,
+                                                     wait_for_job_tasks)
@@ -1,5 +1,23 @@
 """Tests for the read-only part of the GeoSPaaS REST API"""
+import io
+import unittest.mock
+from datetime import datetime
+
+import django.core.cache
+import django.core.management
+import django.db
+import django.http
 import django.test
+import django.utils.timezone
+import geospaas.catalog.models
+import rest_framework.request
+import rest_framework.test
+import rest_framework_filters.backends
+
+import geospaas_rest_api.base_api.backends
+import geospaas_rest_api.base_api.cost
+import geospaas_rest_api.base_api.filters
+import geospaas_rest_api.base_api.views
 
 
 class BasicAPITests(django.test.TestCase):
@@ -284,3 +302,799 @@ class DatasetURIFilteringTests(django.test.TestCase):
                 "dataset": 1
             }]
         })
+
+
+class JoinFilterBackendTests(django.test.TestCase):
+    """Tests for the filter backend which uses joins and EXISTS clauses"""
+
+    fixtures = ["read_only_tests_data"]
+
+    QUERY_STRINGS = (
+        'source__instrument__short_name=HXT',
+        'source__platform__short_name__contains=A340',
+        'source__platform__short_name=A340-600&source__instrument__short_name=HXT',
+        'source__platform__short_name!=A340-600',
+        'source__platform=2',
+        'data_center__short_name=AALTO&iso_topic_category__name=Farming',
+        'geographic_location__geometry__intersects=POINT+%289+9%29',
+        'parameters__short_name=fdg',
+        'parameters__short_name=fdg&parameters__units=Hz',
+        'parameters__short_name=fdp&source__platform__short_name__contains=A340',
+        'parameters__short_name!=fdg',
+    )
+
+    def setUp(self):
+        dataset_1 = geospaas.catalog.models.Dataset.objects.get(id=1)
+        dataset_2 = geospaas.catalog.models.Dataset.objects.get(id=2)
+        dataset_1.parameters.add(1)
+        dataset_2.parameters.add(1, 2)
+
+    @staticmethod
+    def filter_datasets(backend_class, query_string):
+        """Returns the datasets filtered using `backend_class`"""
+        view = geospaas_rest_api.base_api.views.DatasetViewSet()
+        request = rest_framework.request.Request(
+            rest_framework.test.APIRequestFactory().get(f"/api/datasets/?{query_string}"))
+        view.request = request
+        return backend_class().filter_queryset(request, view.get_queryset(), view)
+
+    def test_same_results_as_default_backend(self):
+        """The join backend should return the same datasets as the
+        default backend
+        """
+        for query_string in self.QUERY_STRINGS:
+            with self.subTest(query_string=query_string):
+                expected = list(self.filter_datasets(
+                    rest_framework_filters.backends.RestFrameworkFilterBackend, query_string))
+                result = list(self.filter_datasets(
+                    geospaas_rest_api.base_api.backends.JoinFilterBackend, query_string))
+                self.assertListEqual(result, expected)
+
+    def test_no_in_subquery(self):
+        """The related filters should be applied with joins and EXISTS
+        clauses
+        """
+        queryset = self.filter_datasets(
+            geospaas_rest_api.base_api.backends.JoinFilterBackend,
+            'source__platform__short_name=A340-600&parameters__short_name=fdg')
+        sql = str(queryset.query).upper()
+        self.assertNotIn('IN (SELECT', sql)
+        self.assertIn('JOIN', sql)
+        self.assertIn('EXISTS', sql)
+
+    def test_no_duplicates_on_many_to_many(self):
+        """A dataset with several matching parameters should be returned
+        once
+        """
+        queryset = self.filter_datasets(
+            geospaas_rest_api.base_api.backends.JoinFilterBackend,
+            'parameters__units=Hz')
+        self.assertListEqual(list(queryset.values_list('id', flat=True)), [1, 2])
+
+    def test_invalid_related_value(self):
+        """An error 400 should be returned for invalid values in the
+        related filters
+        """
+        with unittest.mock.patch.object(
+                geospaas_rest_api.base_api.views.DatasetViewSet, 'filter_backends',
+                [geospaas_rest_api.base_api.backends.JoinFilterBackend]):
+            response = self.client.get('/api/datasets/?source__platform=foo')
+        self.assertEqual(response.status_code, 400)
+
+    def test_api_with_join_backend(self):
+        """The API should return the same results with the join backend"""
+        with unittest.mock.patch.object(
+                geospaas_rest_api.base_api.views.DatasetViewSet, 'filter_backends',
+                [geospaas_rest_api.base_api.backends.JoinFilterBackend]):
+            response = self.client.get(
+                '/api/datasets/?source__platform__short_name=A340-600&parameters__short_name=fdp')
+        self.assertEqual(response.status_code, 200)
+        self.assertListEqual([d['id'] for d in response.json()['results']], [2])
+
+    def test_benchmark_command(self):
+        """The benchmark command should display the latency of each
+        backend for each query
+        """
+        out = io.StringIO()
+        django.core.management.call_command(
+            'benchmark_filters', datasets=20, repeat=1,
+            query=['parameters__short_name=param_1'], stdout=out)
+        output = out.getvalue()
+        self.assertIn('parameters__short_name=param_1', output)
+        self.assertIn('subquery:', output)
+        self.assertIn('join:', output)
+        # the generated catalog is removed
+        self.assertEqual(geospaas.catalog.models.Dataset.objects.count(), 2)
+
+
+class QueryCostTests(django.test.TestCase):
+    """Tests for the cost policy of the filters"""
+
+    fixtures = ["read_only_tests_data"]
+
+    def setUp(self):
+        django.core.cache.cache.clear()
+        patcher = unittest.mock.patch.object(
+            geospaas_rest_api.base_api.views.DatasetViewSet, 'filter_backends',
+            [geospaas_rest_api.base_api.backends.CostGuardFilterBackend])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def evaluate(self, query_string):
+        """Returns the cost of a dataset query string"""
+        return geospaas_rest_api.base_api.cost.evaluate(
+            geospaas_rest_api.base_api.filters.DatasetFilter,
+            django.http.QueryDict(query_string))
+
+    def test_classify_lookups(self):
+        """The lookups should be classified depending on the index of
+        the fields and the lookup type
+        """
+        self.assertDictEqual(
+            self.evaluate(
+                'id__in=1,2'
+                '&summary=foo'
+                '&summary__iregex=^foo'
+                '&source__platform__short_name__icontains=A340'
+                '&geographic_location__geometry__contains=POINT+%289+9%29'
+                '&entry_title__icontains=').lookups,
+            {
+                'id__in': 'indexed',
+                'summary': 'scan',
+                'summary__iregex': 'expensive',
+                'source__platform__short_name__icontains': 'expensive',
+                'geographic_location__geometry__contains': 'indexed',
+            })
+
+    def test_expensive_lookups_in_budget(self):
+        """Requests with a few expensive lookups should be accepted"""
+        response = self.client.get(
+            '/api/datasets/?summary__icontains=short&entry_title__iregex=^test+child')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 1)
+
+    def test_reject_too_many_expensive_lookups(self):
+        """Requests with too many expensive lookups should be rejected
+        with an explicit error
+        """
+        response = self.client.get(
+            '/api/datasets/?summary__icontains=short&entry_title__iregex=^child'
+            '&entry_id__endswith=sen')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()['detail'],
+            'The query is too expensive: at most 2 expensive lookups are allowed '
+            '(entry_id__endswith, entry_title__iregex, summary__icontains)')
+
+    def test_classify_prefix_lookups(self):
+        """startswith should only be indexed on indexed text fields"""
+        self.assertDictEqual(
+            self.evaluate(
+                'entry_id__startswith=foo&entry_id__istartswith=foo'
+                '&summary__startswith=foo&id__startswith=1').lookups,
+            {
+                'entry_id__startswith': 'indexed',
+                'entry_id__istartswith': 'scan',
+                'summary__startswith': 'scan',
+                'id__startswith': 'scan',
+            })
+
+    def test_reject_unanchored_regex(self):
+        """Regular expressions which do not start with '^' should be
+        rejected unless allowed by the settings
+        """
+        response = self.client.get('/api/datasets/?entry_title__iregex=child')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()['detail'],
+            "The query is too expensive: the regular expression of 'entry_title__iregex' must "
+            "start with '^'")
+        with django.test.override_settings(
+                GEOSPAAS_REST_API_FILTER_ALLOW_UNANCHORED_REGEX=True):
+            response = self.client.get('/api/datasets/?entry_title__iregex=child')
+        self.assertEqual(response.status_code, 200)
+
+    def test_cost_guard_by_default(self):
+        """The default backend should be replaced with the one which
+        checks the cost of the filters
+        """
+        self.assertListEqual(
+            geospaas_rest_api.base_api.backends.CostGuardMixin().filter_backends,
+            [geospaas_rest_api.base_api.backends.CostGuardFilterBackend])
+        with django.test.override_settings(REST_FRAMEWORK={'DEFAULT_FILTER_BACKENDS': (
+                'geospaas_rest_api.base_api.backends.JoinFilterBackend',)}):
+            self.assertListEqual(
+                geospaas_rest_api.base_api.backends.CostGuardMixin().filter_backends,
+                [geospaas_rest_api.base_api.backends.JoinFilterBackend])
+
+    def test_reject_over_budget_nested_filters(self):
+        """The cost of the filters should be checked on every
+        filterable endpoint, not only on the datasets
+        """
+        for url in ('/api/dataset_uris/?dataset__summary__iregex=foo',
+                    '/api/dataset_uris/?dataset__summary__icontains=a'
+                    '&dataset__entry_title__icontains=b&dataset__entry_id__endswith=c',
+                    '/api/dataset_relationships/?child__entry_title__iregex=foo',
+                    '/api/parameters/?gcmd_science_keyword__category__iregex=foo'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 400)
+                self.assertTrue(
+                    response.json()['detail'].startswith('The query is too expensive'))
+
+    @django.test.override_settings(GEOSPAAS_REST_API_FILTER_MAX_SCAN_LOOKUPS=1)
+    def test_reject_too_many_scan_lookups(self):
+        """The number of scan lookups can be limited"""
+        response = self.client.get('/api/datasets/?summary=foo&summary__startswith=bar')
+        self.assertEqual(response.status_code, 400)
+
+    @django.test.override_settings(GEOSPAAS_REST_API_FILTER_MAX_DEPTH=1)
+    def test_reject_too_deep(self):
+        """Requests which follow too many relations should be rejected"""
+        response = self.client.get('/api/datasets/?source__platform__short_name=A340-600')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()['detail'],
+            "The query is too expensive: 'source__platform__short_name' follows more than 1 "
+            "relations")
+        self.assertEqual(
+            self.client.get('/api/datasets/?source=1').status_code, 200)
+
+    @django.test.override_settings(
+        GEOSPAAS_REST_API_FILTER_MAX_EXPENSIVE_LOOKUPS=0,
+        GEOSPAAS_REST_API_FILTER_OVER_BUDGET='throttle',
+        GEOSPAAS_REST_API_FILTER_THROTTLE_RATE='2/hour')
+    def test_throttle_over_budget(self):
+        """In throttle mode, the over budget requests should be allowed
+        at a limited rate
+        """
+        url = '/api/datasets/?summary__icontains=short'
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(response.json()['detail'].startswith('Too many expensive queries'))
+        # the requests in budget are not throttled
+        self.assertEqual(self.client.get('/api/datasets/?id=1').status_code, 200)
+
+    @django.test.override_settings(GEOSPAAS_REST_API_FILTER_STATEMENT_TIMEOUT=0.001)
+    def test_statement_timeout(self):
+        """Queries which take longer than the statement timeout should
+        be interrupted
+        """
+        with self.assertRaises(geospaas_rest_api.base_api.cost.QueryTimeout):
+            with geospaas_rest_api.base_api.cost.statement_timeout():
+                with django.db.connection.cursor() as cursor:
+                    cursor.execute(
+                        'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c '
+                        'WHERE x < 1000000000) SELECT count(*) FROM c')
+
+    @django.test.override_settings(GEOSPAAS_REST_API_FILTER_STATEMENT_TIMEOUT=10)
+    def test_list_with_statement_timeout(self):
+        """Fast queries should not be affected by the statement timeout"""
+        response = self.client.get('/api/datasets/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_list_timeout_error(self):
+        """A timeout should result in a 503 error"""
+        with unittest.mock.patch(
+                'geospaas_rest_api.base_api.cost.statement_timeout',
+                side_effect=geospaas_rest_api.base_api.cost.QueryTimeout):
+            response = self.client.get('/api/datasets/')
+        self.assertEqual(response.status_code, 503)
+
+
+class DatasetSearchTests(django.test.TestCase):
+    """Tests for the full-text search over the datasets"""
+
+    fixtures = ["read_only_tests_data"]
+
+    def search(self, terms):
+        """Returns the IDs of the results of a search"""
+        response = self.client.get('/api/datasets/', {'q': terms})
+        self.assertEqual(response.status_code, 200)
+        return [result['id'] for result in response.json()['results']]
+
+    def test_search_title(self):
+        """The words of the titles should be searched"""
+        self.assertListEqual(self.search('child'), [2])
+
+    def test_search_all_words(self):
+        """The results should contain all the words"""
+        self.assertCountEqual(self.search('test summary'), [1, 2])
+        self.assertListEqual(self.search('summary child'), [2])
+        self.assertListEqual(self.search('child nothing'), [])
+
+    def test_search_stemming(self):
+        """The words should be matched regardless of their inflection"""
+        self.assertCountEqual(self.search('summaries'), [1, 2])
+
+    def test_search_special_characters(self):
+        """The special characters of the full-text query syntax should
+        not cause errors
+        """
+        self.assertListEqual(self.search('"child" OR NEAR('), [])
+        self.assertListEqual(self.search('child*'), [2])
+
+    def test_empty_search(self):
+        """An empty search should not filter the datasets"""
+        self.assertListEqual(self.search(' '), [1, 2])
+
+    def test_search_rank(self):
+        """The results should be ordered by relevance, the titles
+        weighing more than the summaries
+        """
+        geospaas.catalog.models.Dataset.objects.filter(id=1).update(
+            summary='A short summary about sea ice')
+        geospaas.catalog.models.Dataset.objects.filter(id=2).update(entry_title='Sea ice')
+        response = self.client.get('/api/datasets/', {'q': 'sea ice'})
+        results = response.json()['results']
+        self.assertListEqual([result['id'] for result in results], [2, 1])
+        self.assertGreater(results[0]['search_rank'], results[1]['search_rank'])
+
+    def test_no_rank_without_search(self):
+        """The rank should only be present in search results"""
+        response = self.client.get('/api/datasets/1/')
+        self.assertNotIn('search_rank', response.json())
+
+    def test_index_updated(self):
+        """The index should follow the modifications of the datasets"""
+        geospaas.catalog.models.Dataset.objects.filter(id=2).update(entry_title='Wind speed')
+        self.assertListEqual(self.search('child'), [])
+        self.assertListEqual(self.search('wind'), [2])
+        dataset = geospaas.catalog.models.Dataset.objects.get(id=1)
+        dataset.summary = 'Wind over the ocean'
+        dataset.save()
+        self.assertListEqual(self.search('ocean'), [1])
+        geospaas.catalog.models.Dataset.objects.filter(id=1).delete()
+        self.assertListEqual(self.search('wind'), [2])
+
+    def test_search_related_datasets(self):
+        """The search should be available on the related datasets"""
+        response = self.client.get('/api/dataset_uris/?dataset__q=child')
+        self.assertListEqual([result['dataset'] for result in response.json()['results']], [2])
+
+    def test_search_with_join_backend(self):
+        """The search should work with the join filter backend"""
+        with unittest.mock.patch.object(
+                geospaas_rest_api.base_api.views.DatasetViewSet, 'filter_backends',
+                [geospaas_rest_api.base_api.backends.JoinFilterBackend]):
+            self.assertListEqual(self.search('child'), [2])
+
+
+class DatasetSearchPostTests(django.test.TestCase):
+    """Tests for the dataset search using a JSON filter tree"""
+
+    fixtures = ["read_only_tests_data"]
+
+    def search(self, tree, url='/api/datasets/search/', status=200):
+        """Sends a search request and returns the response"""
+        response = self.client.post(url, {'filter': tree}, content_type='application/json')
+        self.assertEqual(response.status_code, status, response.content)
+        return response.json()
+
+    def search_ids(self, tree):
+        """Returns the IDs of the datasets matching the filter tree"""
+        return [dataset['id'] for dataset in self.search(tree)['results']]
+
+    def test_lookups(self):
+        """All the lookups of a node should match"""
+        self.assertListEqual(self.search_ids({
+            'source__instrument__short_name': 'HXT',
+            'entry_title__contains': 'child',
+        }), [2])
+
+    def test_no_filter(self):
+        """All datasets should be returned without filter"""
+        self.assertListEqual(self.search_ids(None), [1, 2])
+
+    def test_or(self):
+        """One of the nodes of an 'or' should match"""
+        self.assertListEqual(self.search_ids({'or': [
+            {'source__platform__short_name': 'A340-600'},
+            {'entry_title': 'Test dataset'},
+        ]}), [1, 2])
+
+    def test_and_not(self):
+        """The 'and' and 'not' operators should be combined"""
+        self.assertListEqual(self.search_ids({'and': [
+            {'source__instrument__short_name': 'HXT'},
+            {'not': {'source__platform__short_name': 'A340-600'}},
+        ]}), [1])
+
+    def test_geojson_geometry(self):
+        """GeoJSON geometries should be accepted for geometry lookups"""
+        self.assertListEqual(self.search_ids({
+            'geographic_location__geometry__intersects': {'type': 'Point', 'coordinates': [9, 9]}
+        }), [1])
+        self.assertListEqual(self.search_ids({
+            'geographic_location__geometry__intersects': {
+                'type': 'Polygon',
+                'coordinates': [[[8, 8], [25, 8], [25, 25], [8, 25], [8, 8]]]}
+        }), [1, 2])
+
+    def test_invalid_geojson(self):
+        """An error 400 should be returned for invalid GeoJSON"""
+        self.search({'geographic_location__geometry__intersects': {'type': 'Foo'}}, status=400)
+
+    def test_time_range(self):
+        """The time ranges should match the intersecting time
+        coverages
+        """
+        self.assertListEqual(self.search_ids({'time_range': ['2010-01-02T01:00:00Z', None]}), [2])
+        self.assertListEqual(
+            self.search_ids({'time_range': ['2010-01-01T01:00:00Z', '2010-01-01T02:00:00Z']}),
+            [1])
+        self.search({'time_range': [None, None]}, status=400)
+
+    def test_many_to_many_no_duplicates(self):
+        """Datasets matching through several related objects should be
+        returned once
+        """
+        geospaas.catalog.models.Dataset.objects.get(id=2).parameters.add(1, 2)
+        self.assertListEqual(self.search_ids({'or': [
+            {'parameters__units': 'Hz'},
+            {'id': 1},
+        ]}), [1, 2])
+        self.assertListEqual(self.search_ids({'or': [
+            {'parameters': 1},
+            {'id': 1},
+        ]}), [1, 2])
+
+    def test_single_query(self):
+        """The filter tree should be compiled into a single query"""
+        with self.assertNumQueries(1):
+            self.search_ids({'or': [
+                {'source__platform__short_name': 'A340-600', 'parameters__short_name': 'fdg'},
+                {'not': {'data_center__short_name': 'AALTO'}},
+                {'q': 'child'},
+            ]})
+
+    def test_unknown_lookup(self):
+        """An error 400 should be returned for unknown lookups"""
+        self.assertDictEqual(self.search({'foo': 1}, status=400), {'foo': ['Unknown lookup']})
+
+    def test_invalid_value(self):
+        """An error 400 should be returned for invalid values"""
+        self.assertIn(
+            'time_coverage_start__lte',
+            self.search({'time_coverage_start__lte': 'foo'}, status=400))
+
+    def test_invalid_tree(self):
+        """An error 400 should be returned for invalid trees"""
+        self.search({'and': []}, status=400)
+        self.search({'or': [{'id': 1}], 'id': 2}, status=400)
+        self.search({'not': 'foo'}, status=400)
+        self.search({}, status=400)
+
+    @django.test.override_settings(GEOSPAAS_REST_API_FILTER_TREE_MAX_NODES=2)
+    def test_max_nodes(self):
+        """The size of the tree should be limited"""
+        self.search({'or': [{'id': 1}, {'id': 2}]}, status=400)
+
+    def test_cost_guard(self):
+        """The cost policy should apply to the whole tree"""
+        response = self.search({'or': [
+            {'summary__icontains': 'short'},
+            {'entry_title__iregex': 'child'},
+            {'entry_id__endswith': 'sen'},
+        ]}, status=400)
+        self.assertTrue(response['detail'].startswith('The query is too expensive'))
+
+    def test_cost_guard_repeated_lookups(self):
+        """A lookup repeated in several nodes should be counted each
+        time
+        """
+        response = self.search({'or': [
+            {'summary__icontains': 'short'},
+            {'summary__icontains': 'long'},
+            {'summary__icontains': 'test'},
+        ]}, status=400)
+        self.assertEqual(
+            response['detail'],
+            'The query is too expensive: at most 2 expensive lookups are allowed '
+            '(summary__icontains, summary__icontains, summary__icontains)')
+
+    def test_pagination(self):
+        """The results should be paged with the cursor pagination"""
+        tree = {'source__instrument__short_name': 'HXT'}
+        first_page = self.search(tree, url='/api/datasets/search/?page_size=1')
+        self.assertListEqual([dataset['id'] for dataset in first_page['results']], [1])
+        second_page = self.search(tree, url=first_page['next'])
+        self.assertListEqual([dataset['id'] for dataset in second_page['results']], [2])
+        self.assertIsNone(second_page['next'])
+
+
+class DatasetFacetsTests(django.test.TestCase):
+    """Tests for the faceted counts of the datasets"""
+
+    fixtures = ["read_only_tests_data"]
+
+    def setUp(self):
+        django.core.cache.cache.clear()
+
+    def get_facets(self, query_string, status=200):
+        """Sends a facets request and returns the response"""
+        response = self.client.get(f"/api/datasets/facets/?{query_string}")
+        self.assertEqual(response.status_code, status, response.content)
+        return response.json()
+
+    def test_facet_counts(self):
+        """The datasets should be counted for each value of the facets"""
+        self.assertDictEqual(
+            self.get_facets('facets=source__platform__short_name,source__instrument__short_name'),
+            {
+                'count': 2,
+                'facets': {
+                    'source__instrument__short_name': [{'value': 'HXT', 'count': 2}],
+                    'source__platform__short_name': [
+                        {'value': '', 'count': 1},
+                        {'value': 'A340-600', 'count': 1},
+                    ],
+                },
+            })
+
+    def test_filtered_facet_counts(self):
+        """Only the datasets matching the filters should be counted"""
+        self.assertDictEqual(
+            self.get_facets('facets=source__platform__short_name&entry_title__contains=child'),
+            {
+                'count': 1,
+                'facets': {
+                    'source__platform__short_name': [{'value': 'A340-600', 'count': 1}],
+                },
+            })
+
+    def test_many_to_many_facet(self):
+        """All the related objects of the matching datasets should be
+        counted, not only the ones matching the filters
+        """
+        geospaas.catalog.models.Dataset.objects.get(id=1).parameters.add(1)
+        geospaas.catalog.models.Dataset.objects.get(id=2).parameters.add(1, 2)
+        self.assertDictEqual(
+            self.get_facets('facets=parameters__short_name&parameters__short_name=fdp'),
+            {
+                'count': 1,
+                'facets': {
+                    'parameters__short_name': [
+                        {'value': 'fdg', 'count': 1},
+                        {'value': 'fdp', 'count': 1},
+                    ],
+                },
+            })
+        self.assertDictEqual(
+            self.get_facets('facets=parameters__short_name&parameters__units=Hz'),
+            {
+                'count': 2,
+                'facets': {
+                    'parameters__short_name': [
+                        {'value': 'fdg', 'count': 2},
+                        {'value': 'fdp', 'count': 1},
+                    ],
+                },
+            })
+
+    def test_grouped_queries(self):
+        """Each facet should be counted using one query"""
+        with self.assertNumQueries(3):
+            self.get_facets('facets=source__platform__short_name,data_center__short_name'
+                            '&source__instrument__short_name=HXT')
+
+    def test_invalid_facets(self):
+        """An error 400 should be returned for missing or invalid
+        facets
+        """
+        self.get_facets('', status=400)
+        self.assertDictEqual(self.get_facets('facets=foo', status=400),
+                             {'facets': ["Unknown facet: 'foo'"]})
+        # relations, lookups other than exact and geometries can't be
+        # used as facets
+        self.get_facets('facets=source', status=400)
+        self.get_facets('facets=entry_title__contains', status=400)
+        self.get_facets('facets=geographic_location__geometry', status=400)
+
+    @django.test.override_settings(GEOSPAAS_REST_API_MAX_FACETS=1)
+    def test_max_facets(self):
+        """The number of facets should be limited"""
+        self.get_facets('facets=entry_id,entry_title', status=400)
+
+    @django.test.override_settings(GEOSPAAS_REST_API_FACETS_LIMIT=1)
+    def test_facets_limit(self):
+        """The number of values of each facet should be limited"""
+        self.assertListEqual(
+            self.get_facets('facets=source__platform__short_name')['facets'][
+                'source__platform__short_name'],
+            [{'value': '', 'count': 1}])
+
+    @django.test.override_settings(GEOSPAAS_REST_API_FACETS_CACHE_TIMEOUT=60)
+    def test_cache(self):
+        """The counts should be cached using the normalized filter"""
+        self.get_facets('facets=entry_title&source__instrument__short_name=HXT&id__gte=1')
+        geospaas.catalog.models.Dataset.objects.filter(id=2).update(entry_title='Updated')
+        with self.assertNumQueries(0):
+            response = self.get_facets(
+                'id__gte=1&facets=entry_title,entry_title&source__instrument__short_name=HXT'
+                '&entry_id=&format=json')
+        self.assertIn({'value': 'Test child dataset', 'count': 1},
+                      response['facets']['entry_title'])
+        self.assertIn({'value': 'Updated', 'count': 1},
+                      self.get_facets('facets=entry_title')['facets']['entry_title'])
+
+    def test_no_cache_by_default(self):
+        """The counts should not be cached by default"""
+        self.get_facets('facets=entry_title')
+        geospaas.catalog.models.Dataset.objects.filter(id=2).update(entry_title='Updated')
+        self.assertIn({'value': 'Updated', 'count': 1},
+                      self.get_facets('facets=entry_title')['facets']['entry_title'])
+
+    def test_cost_guard(self):
+        """The cost policy of the filters should apply"""
+        with unittest.mock.patch.object(
+                geospaas_rest_api.base_api.views.DatasetViewSet, 'filter_backends',
+                [geospaas_rest_api.base_api.backends.CostGuardFilterBackend]):
+            self.get_facets('facets=entry_title&summary__icontains=short'
+                            '&entry_title__iregex=child&entry_id__endswith=sen', status=400)
+
+
+class DatasetHistogramTests(django.test.TestCase):
+    """Tests for the temporal histogram of the datasets"""
+
+    fixtures = ["read_only_tests_data"]
+
+    def get_histogram(self, query_string, status=200):
+        """Sends a histogram request and returns the response"""
+        response = self.client.get(f"/api/datasets/histogram/?{query_string}")
+        self.assertEqual(response.status_code, status, response.content)
+        return response.json()
+
+    def test_daily_histogram(self):
+        """The datasets should be counted per day by default"""
+        self.assertDictEqual(self.get_histogram(''), {
+            'interval': 'day',
+            'split_by': None,
+            'buckets': [
+                {'start': '2010-01-01T00:00:00Z', 'count': 1},
+                {'start': '2010-01-02T00:00:00Z', 'count': 1},
+            ],
+        })
+
+    def test_intervals(self):
+        """The buckets should match the requested interval"""
+        geospaas.catalog.models.Dataset.objects.filter(id=2).update(
+            time_coverage_start=datetime(2010, 1, 1, 5, 30, tzinfo=django.utils.timezone.utc))
+        self.assertListEqual(self.get_histogram('interval=hour')['buckets'], [
+            {'start': '2010-01-01T00:00:00Z', 'count': 1},
+            {'start': '2010-01-01T05:00:00Z', 'count': 1},
+        ])
+        self.assertListEqual(self.get_histogram('interval=month')['buckets'], [
+            {'start': '2010-01-01T00:00:00Z', 'count': 2},
+        ])
+
+    def test_filtered_histogram(self):
+        """Only the datasets matching the filters should be counted"""
+        self.assertListEqual(
+            self.get_histogram('source__platform__short_name=A340-600')['buckets'],
+            [{'start': '2010-01-02T00:00:00Z', 'count': 1}])
+
+    def test_many_to_many_no_duplicates(self):
+        """Datasets matching through several related objects should be
+        counted once
+        """
+        geospaas.catalog.models.Dataset.objects.get(id=2).parameters.add(1, 2)
+        self.assertListEqual(
+            self.get_histogram('parameters__units=Hz')['buckets'],
+            [{'start': '2010-01-02T00:00:00Z', 'count': 1}])
+
+    def test_split_by_source(self):
+        """The buckets should be split by source"""
+        self.assertListEqual(
+            self.get_histogram('interval=month&split_by=source')['buckets'], [
+                {'start': '2010-01-01T00:00:00Z', 'source': 1, 'count': 1},
+                {'start': '2010-01-01T00:00:00Z', 'source': 2, 'count': 1},
+            ])
+
+    def test_single_query(self):
+        """The histogram should be computed using one query"""
+        with self.assertNumQueries(1):
+            self.get_histogram('interval=hour&split_by=source&source__instrument__short_name=HXT')
+
+    def test_invalid_parameters(self):
+        """An error 400 should be returned for invalid parameters"""
+        self.get_histogram('interval=week', status=400)
+        self.get_histogram('split_by=parameters', status=400)
+
+    @django.test.override_settings(GEOSPAAS_REST_API_HISTOGRAM_MAX_BUCKETS=1)
+    def test_max_buckets(self):
+        """The number of buckets should be limited"""
+        self.get_histogram('interval=day', status=400)
+        self.assertListEqual(self.get_histogram('interval=month')['buckets'],
+                             [{'start': '2010-01-01T00:00:00Z', 'count': 2}])
+
+
+class DatasetGridTests(django.test.TestCase):
+    """Tests for the spatial grid aggregation of the datasets"""
+
+    fixtures = ["read_only_tests_data"]
+
+    def get_grid(self, query_string, status=200):
+        """Sends a grid request and returns the response"""
+        response = self.client.get(f"/api/datasets/grid/?{query_string}")
+        self.assertEqual(response.status_code, status, response.content)
+        return response.json()
+
+    def test_grid_counts(self):
+        """The datasets should be counted in each cell which intersects
+        their footprint
+        """
+        self.assertDictEqual(self.get_grid('resolution=10&bbox=-5,-5,35,35'), {
+            'resolution': 10,
+            'bbox': [-5, -5, 35, 35],
+            'columns': 4,
+            'rows': 4,
+            'cells': [
+                [0, 0, 1], [1, 0, 1], [0, 1, 1], [1, 1, 1],
+                [2, 2, 1], [3, 2, 1], [2, 3, 1], [3, 3, 1],
+            ],
+        })
+
+    def test_overlapping_footprints(self):
+        """A cell should count all the footprints which intersect it"""
+        self.assertListEqual(
+            self.get_grid('resolution=40&bbox=-5,-5,35,35')['cells'], [[0, 0, 2]])
+
+    def test_bbox(self):
+        """Only the cells of the bounding box should be returned"""
+        self.assertListEqual(
+            self.get_grid('resolution=10&bbox=15,15,35,35')['cells'],
+            [[0, 0, 1], [1, 0, 1], [0, 1, 1], [1, 1, 1]])
+
+    def test_filtered_grid(self):
+        """Only the datasets matching the filters should be counted"""
+        self.assertListEqual(
+            self.get_grid('resolution=10&bbox=-5,-5,35,35'
+                          '&source__platform__short_name=A340-600')['cells'],
+            [[2, 2, 1], [3, 2, 1], [2, 3, 1], [3, 3, 1]])
+
+    def test_many_to_many_no_duplicates(self):
+        """Datasets matching through several related objects should be
+        counted once
+        """
+        geospaas.catalog.models.Dataset.objects.get(id=2).parameters.add(1, 2)
+        self.assertListEqual(
+            self.get_grid('resolution=40&bbox=-5,-5,35,35&parameters__units=Hz')['cells'],
+            [[0, 0, 1]])
+
+    def test_geojson_output(self):
+        """The cells should be returned as GeoJSON features"""
+        response = self.get_grid('resolution=10&bbox=15,15,35,35&output=geojson')
+        self.assertEqual(response['type'], 'FeatureCollection')
+        self.assertEqual(len(response['features']), 4)
+        self.assertDictEqual(response['features'][0], {
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Polygon',
+                'coordinates': [[[15, 15], [25, 15], [25, 25], [15, 25], [15, 15]]],
+            },
+            'properties': {'column': 0, 'row': 0, 'count': 1},
+        })
+
+    def test_single_query(self):
+        """The grid should be computed using one query"""
+        with self.assertNumQueries(1):
+            self.get_grid('resolution=5&source__instrument__short_name=HXT')
+
+    def test_invalid_parameters(self):
+        """An error 400 should be returned for invalid parameters"""
+        self.get_grid('resolution=0', status=400)
+        self.get_grid('resolution=foo', status=400)
+        self.get_grid('bbox=1,2,3', status=400)
+        self.get_grid('bbox=10,0,0,10', status=400)
+        self.get_grid('bbox=0,0,10,100', status=400)
+        self.get_grid('output=png', status=400)
+
+    @django.test.override_settings(GEOSPAAS_REST_API_GRID_MAX_CELLS=10)
+    def test_max_cells(self):
+        """The number of cells should be limited"""
+        self.get_grid('resolution=10', status=400)
+        self.get_grid('resolution=10&bbox=0,0,20,20')
@@ -1,26 +1,70 @@
 """Tests for the long-running tasks endpoint of the GeoSPaaS REST API"""
+import gzip
+import hashlib
+import hmac
+import http.server
 import importlib
+import io
+import json
 import os
+import tarfile
+import tempfile
+import threading
 import unittest
 import unittest.mock as mock
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import celery
 import celery.result
+import django.apps
+import django.core.management
 import django.db
 import django.test
+import django.test.utils
+import django.utils.timezone
+import django_celery_results.models
+import geospaas.catalog.models
+import geospaas_processing.models
 import geospaas_processing.tasks.core as tasks_core
 import geospaas_processing.tasks.idf as tasks_idf
 import geospaas_processing.tasks.syntool as tasks_syntool
 from rest_framework.exceptions import ErrorDetail, ValidationError
 
 import geospaas_rest_api.models as models
+import geospaas_rest_api.processing_api.admission as admission
+import geospaas_rest_api.processing_api.bundles as bundles
+import geospaas_rest_api.processing_api.callbacks as callbacks
+import geospaas_rest_api.processing_api.colocation as colocation
+import geospaas_rest_api.processing_api.events as events
+import geospaas_rest_api.processing_api.executors as executors
+import geospaas_rest_api.processing_api.metrics as metrics
+import geospaas_rest_api.processing_api.outbox as outbox
+import geospaas_rest_api.processing_api.retention as retention
+import geospaas_rest_api.processing_api.schedules as schedules
 import geospaas_rest_api.processing_api.serializers as serializers
+import geospaas_rest_api.processing_api.sharding as sharding
+import geospaas_rest_api.processing_api.signals as signals
+import geospaas_rest_api.processing_api.validation as validation
+import geospaas_rest_api.processing_api.views as views
 
 
 os.environ.setdefault('GEOSPAAS_REST_API_ENABLE_PROCESSING', 'true')
 
 
+@celery.shared_task
+def noop_task(*args, **kwargs):
+    """Task used to test the dispatching of jobs"""
+    return args, kwargs
+
+
+@celery.shared_task
+def increment_task(value):
+    """Task used to test the execution of chains"""
+    if value < 0:
+        raise ValueError('negative value')
+    return value + 1
+
+
 class TaskViewSetTests(django.test.TestCase):
     """Test tasks/ endpoints"""
 
@@ -140,18 +184,19 @@ class JobModelTests(django.test.TestCase):
         with self.assertRaises(NotImplementedError):
             models.Job.make_task_parameters({})
 
-    def test_run_job(self):
-        """
-        `Job.run()` must launch the celery tasks and
-        return a job instance pointing to the first task
+    def test_build_job(self):
+        """`Job.build()` must assign the task IDs of the job's signature
+        without sending it, and return the arguments of the first task
         """
         with mock.patch.object(models.Job, 'get_signature') as mock_get_signature, \
              mock.patch.object(models.Job, 'make_task_parameters') as mock_make_params:
-            mock_get_signature.return_value.delay.return_value.task_id = 1
             mock_make_params.side_effect = lambda p: ([], p)
-            job = models.Job.run({'foo': 'bar'})
-        mock_get_signature.return_value.delay.assert_called_with(foo='bar')
-        self.assertIsInstance(job, models.Job)
+            signature, result, args, kwargs = models.Job.build({'foo': 'bar'})
+        self.assertIs(signature, mock_get_signature.return_value)
+        self.assertIs(result, signature.freeze.return_value)
+        signature.delay.assert_not_called()
+        self.assertListEqual(args, [])
+        self.assertDictEqual(kwargs, {'foo': 'bar'})
 
     def test_get_current_task_result(self):
         """
@@ -178,6 +223,88 @@ class JobModelTests(django.test.TestCase):
         )
 
 
+    def test_dispatch(self):
+        """`dispatch()` must assign the task IDs of the job and send
+        its tasks once the transaction is committed
+        """
+        job = models.Job(action='download', parameters={'dataset_id': 1}, status=models.Job.QUEUED)
+        mock_executor = mock.Mock()
+        with mock.patch.object(executors, 'get_executor', return_value=mock_executor), \
+             mock.patch.object(models.DownloadJob, 'get_signature',
+                               return_value=noop_task.signature()):
+            with self.captureOnCommitCallbacks(execute=True):
+                job.dispatch()
+                job.save()
+                mock_executor.submit.assert_not_called()
+        mock_executor.submit.assert_called_once()
+        self.assertIsNotNone(job.task_id)
+        self.assertEqual(job.status, celery.states.PENDING)
+        self.assertIsNotNone(models.Job.objects.get(id=job.id).date_dispatched)
+
+    def test_publish_failure(self):
+        """A job whose tasks can't be sent must be marked as failed"""
+        job = models.Job.objects.get(id=1)
+        mock_executor = mock.Mock()
+        mock_executor.submit.side_effect = ConnectionError
+        with mock.patch.object(executors, 'get_executor', return_value=mock_executor):
+            with self.assertRaises(ConnectionError):
+                job.publish(noop_task.signature())
+        self.assertEqual(models.Job.objects.get(id=1).status, celery.states.FAILURE)
+
+    def test_update_status(self):
+        """The status must be saved when it changes, and the date must
+        be set when the job is finished
+        """
+        job = models.Job.objects.get(id=1)
+        job.steps = [{'task_id': 'first', 'name': 'first', 'stage': 0},
+                     {'task_id': job.task_id, 'name': 'last', 'stage': 1}]
+        first_result = django_celery_results.models.TaskResult.objects.create(
+            task_id='first', status='STARTED')
+        self.assertTrue(job.update_status())
+        self.assertEqual(models.Job.objects.get(id=1).status, 'STARTED')
+        self.assertIsNone(models.Job.objects.get(id=1).date_done)
+        self.assertFalse(job.update_status())
+
+        # the job stays started between its steps
+        first_result.status = 'SUCCESS'
+        first_result.save()
+        self.assertFalse(job.update_status())
+        self.assertEqual(models.Job.objects.get(id=1).status, 'STARTED')
+
+        django_celery_results.models.TaskResult.objects.create(
+            task_id=job.task_id, status='SUCCESS')
+        self.assertTrue(job.update_status())
+        self.assertEqual(models.Job.objects.get(id=1).status, 'SUCCESS')
+        self.assertIsNotNone(models.Job.objects.get(id=1).date_done)
+
+    def test_get_status_from_states(self):
+        """The status of a job must be derived from the states of all
+        its steps
+        """
+        job = models.Job(task_id='c', steps=[
+            {'task_id': 'a', 'name': 'a', 'stage': 0},
+            {'task_id': 'b', 'name': 'b', 'stage': 1},
+            {'task_id': 'c', 'name': 'c', 'stage': 2},
+        ])
+        self.assertEqual(job.get_status_from_states({}), 'PENDING')
+        self.assertEqual(job.get_status_from_states({'a': 'STARTED'}), 'STARTED')
+        self.assertEqual(job.get_status_from_states({'a': 'SUCCESS'}), 'STARTED')
+        self.assertEqual(job.get_status_from_states({'a': 'SUCCESS', 'b': 'RETRY'}), 'RETRY')
+        self.assertEqual(job.get_status_from_states({'a': 'SUCCESS', 'b': 'FAILURE'}), 'FAILURE')
+        self.assertEqual(
+            job.get_status_from_states({'a': 'SUCCESS', 'b': 'SUCCESS', 'c': 'SUCCESS'}),
+            'SUCCESS')
+
+    def test_update_status_finished_job(self):
+        """The result backend must not be queried for finished or
+        queued jobs
+        """
+        with mock.patch.object(models.Job, 'get_task_states') as mock_get_result:
+            self.assertFalse(models.Job(task_id='foo', status='SUCCESS').update_status())
+            self.assertFalse(models.Job(status=models.Job.QUEUED).update_status())
+        mock_get_result.assert_not_called()
+
+
 class DownloadJobTests(unittest.TestCase):
     """Tests for the DownloadJob class"""
 
@@ -243,7 +370,7 @@ class DownloadJobTests(unittest.TestCase):
             raised.exception.detail,
             [ErrorDetail(
                 string="The download action accepts only the following parameters:"
-                       " ('dataset_id', 'bounding_box', 'publish', 'copy_to')",
+                       " ('dataset_id', 'bounding_box', 'publish', 'copy_to', 'dataset_ids')",
                 code='invalid')])
 
     def test_check_parameters_extra_param(self):
@@ -254,7 +381,7 @@ class DownloadJobTests(unittest.TestCase):
         self.assertListEqual(
             raised.exception.detail,
             [ErrorDetail(string="The download action accepts only the following parameters:"
-                                " ('dataset_id', 'bounding_box', 'publish', 'copy_to')",
+                                " ('dataset_id', 'bounding_box', 'publish', 'copy_to', 'dataset_ids')",
                          code='invalid')])
 
     def test_check_parameters_wrong_id_type(self):
@@ -285,6 +412,65 @@ class DownloadJobTests(unittest.TestCase):
         with self.assertRaises(ValidationError):
             models.DownloadJob.check_parameters({'dataset_id': 1, 'publish': 1})
 
+    def test_check_parameters_bundle(self):
+        """Several datasets can be downloaded in a bundle"""
+        parameters = {'dataset_ids': [1, 2], 'bounding_box': [0, 20, 20, 0], 'publish': True}
+        self.assertEqual(models.DownloadJob.check_parameters(parameters), parameters)
+
+    def test_check_parameters_wrong_bundle(self):
+        """`check_parameters()` must raise an exception if the bundle
+        parameters are invalid
+        """
+        for parameters in ({}, {'dataset_id': 1, 'dataset_ids': [2]}, {'dataset_ids': []},
+                           {'dataset_ids': 1}, {'dataset_ids': [1, '2']},
+                           {'dataset_ids': [1, 1]}):
+            with self.subTest(parameters=parameters), self.assertRaises(ValidationError):
+                models.DownloadJob.check_parameters(parameters)
+        with django.test.override_settings(GEOSPAAS_REST_API_MAX_BUNDLE_SIZE=2):
+            with self.assertRaises(ValidationError):
+                models.DownloadJob.check_parameters({'dataset_ids': [1, 2, 3]})
+
+    def test_get_bundle_signature(self):
+        """The datasets of a bundle must be processed in parallel, then
+        archived together and published
+        """
+        with mock.patch.object(models.tasks_core, 'download', noop_task), \
+             mock.patch.object(models.tasks_core, 'copy', noop_task), \
+             mock.patch.object(models.tasks_core, 'unarchive', noop_task), \
+             mock.patch.object(models.tasks_core, 'crop', noop_task), \
+             mock.patch.object(models.tasks_core, 'publish', increment_task):
+            signature = models.DownloadJob.get_signature(
+                {'dataset_ids': [1, 2], 'bounding_box': [0, 20, 20, 0], 'publish': True})
+        self.assertEqual(signature['subtask_type'], 'chain')
+        chord, publish = signature.tasks
+        self.assertEqual(publish.task, increment_task.name)
+        self.assertEqual(chord.body.task, 'geospaas_rest_api.create_bundle')
+        branches = chord.tasks.tasks
+        self.assertListEqual([branch.tasks[0].args for branch in branches], [((1,),), ((2,),)])
+        self.assertListEqual([len(branch.tasks) for branch in branches], [4, 4])
+
+    def test_bundle_task_parameters(self):
+        """The arguments of a bundle are given to each branch"""
+        self.assertTupleEqual(
+            models.DownloadJob.make_task_parameters({'dataset_ids': [1, 2]}), ((), {}))
+        self.assertTupleEqual(models.DownloadJob.get_dataset_ids({'dataset_ids': [1, 2]}), (1, 2))
+
+    def test_create_bundle(self):
+        """The files of all the datasets must be written in one archive"""
+        with tempfile.TemporaryDirectory() as working_directory:
+            os.makedirs(os.path.join(working_directory, 'dataset_1'))
+            for path in ('dataset_1/file1.nc', 'file2.nc'):
+                with open(os.path.join(working_directory, path), 'w', encoding='utf-8') as f:
+                    f.write(path)
+            name, paths = bundles.create_bundle(
+                [(1, ['dataset_1']), (2, 'file2.nc')], 'bundle_foo', working_directory)
+            self.assertEqual(name, 'bundle_foo')
+            self.assertListEqual(paths, ['bundles/bundle_foo.tar.gz'])
+            with tarfile.open(os.path.join(working_directory, paths[0])) as archive:
+                self.assertCountEqual(
+                    archive.getnames(),
+                    ['1/dataset_1', '1/dataset_1/file1.nc', '2/file2.nc'])
+
 
 class ConvertJobTests(unittest.TestCase):
     """Tests for the ConvertJob class"""
@@ -619,6 +805,118 @@ class SyntoolCompareJobTests(unittest.TestCase):
             }),
             ((((123, '/foo'), ((456, '/bar'), (789, '/baz'))),), {}))
 
+    def test_check_parameters_profiles_selection(self):
+        """The profiles must be selected when profiles_selection is
+        given
+        """
+        selection = {'source': {'platform': 'ARGO'}, 'time_tolerance': {'hours': 12}, 'buffer': 1}
+        with mock.patch('geospaas_rest_api.processing_api.colocation.select_profiles',
+                        return_value=[(456, ['/bar'])]) as mock_select:
+            self.assertDictEqual(
+                models.SyntoolCompareJob.check_parameters({
+                    'model': (123, ['/foo']),
+                    'profiles_selection': selection,
+                }),
+                {
+                    'model': (123, ['/foo']),
+                    'profiles_selection': selection,
+                    'profiles': [(456, ['/bar'])],
+                })
+        mock_select.assert_called_once_with(
+            123, source={'platform': 'ARGO'}, time_tolerance={'hours': 12}, buffer=1)
+
+    def test_check_parameters_no_selected_profiles(self):
+        """An error must be raised if no profile matches the selection
+        criteria
+        """
+        with mock.patch('geospaas_rest_api.processing_api.colocation.select_profiles',
+                        return_value=[]):
+            with self.assertRaises(ValidationError):
+                models.SyntoolCompareJob.check_parameters(
+                    {'model': (123, ['/foo']), 'profiles_selection': {}})
+
+    def test_check_parameters_wrong_profiles_selection(self):
+        """An error must be raised if the profiles selection is invalid
+        """
+        for parameters in (
+                {'model': (123, ['/foo']), 'profiles': ((456, '/bar'),),
+                 'profiles_selection': {}},
+                {'model': (123, ['/foo']), 'profiles_selection': []},
+                {'model': (123, ['/foo']), 'profiles_selection': {'foo': 'bar'}},
+                {'model': (123, ['/foo']), 'profiles_selection': {'source': {'foo': 'bar'}}},
+                {'model': (123, ['/foo']), 'profiles_selection': {'source': {'platform': 1}}},
+                {'model': (123, ['/foo']), 'profiles_selection': {'time_tolerance': 2}},
+                {'model': (123, ['/foo']), 'profiles_selection': {'time_tolerance': {'a': 1}}},
+                {'model': (123, ['/foo']),
+                 'profiles_selection': {'time_tolerance': {'days': 1e10}}},
+                {'model': (123, ['/foo']),
+                 'profiles_selection': {'time_tolerance': {'days': 1000}}},
+                {'model': (123, ['/foo']),
+                 'profiles_selection': {'time_tolerance': {'hours': -1}}},
+                {'model': (123, ['/foo']),
+                 'profiles_selection': {'time_tolerance': {'days': float('nan')}}},
+                {'model': (123, ['/foo']), 'profiles_selection': {'buffer': -1}},
+                {'model': (123, ['/foo']), 'profiles_selection': {'buffer': '1'}}):
+            with self.subTest(parameters=parameters), self.assertRaises(ValidationError):
+                models.SyntoolCompareJob.check_parameters(parameters)
+
+
+class ColocationTests(django.test.TestCase):
+    """Tests for the selection of the profiles co-located with a model"""
+
+    fixtures = ['processing_tests_data']
+
+    def test_select_profiles(self):
+        """The profiles which intersect the model in time and space
+        must be selected in one query, excluding the model itself
+        """
+        with self.assertNumQueries(2):
+            self.assertListEqual(
+                colocation.select_profiles(2, time_tolerance={'days': 365}, buffer=150),
+                [(1, ['ingested/product_name/granule_name_1/'])])
+
+    def test_select_profiles_no_tolerance(self):
+        """Profiles which do not intersect the model must not be
+        selected
+        """
+        self.assertListEqual(colocation.select_profiles(2), [])
+        self.assertListEqual(colocation.select_profiles(2, buffer=150), [])
+        self.assertListEqual(colocation.select_profiles(2, time_tolerance={'days': 365}), [])
+
+    def test_select_profiles_source(self):
+        """The profiles must be filtered by source"""
+        self.assertListEqual(
+            colocation.select_profiles(
+                2, source={'platform': 'sentinel-3a'}, time_tolerance={'days': 365}, buffer=150),
+            [(1, ['ingested/product_name/granule_name_1/'])])
+        self.assertListEqual(
+            colocation.select_profiles(
+                2, source={'instrument': 'SLSTR'}, time_tolerance={'days': 365}, buffer=150),
+            [])
+
+    def test_select_profiles_missing_model(self):
+        """An error must be raised if the model does not exist"""
+        with self.assertRaises(ValidationError):
+            colocation.select_profiles(999)
+
+    def test_select_profiles_incomplete_model(self):
+        """An error must be raised if the model has no time coverage or
+        no location
+        """
+        geospaas.catalog.models.Dataset.objects.filter(id=2).update(time_coverage_end=None)
+        with self.assertRaises(ValidationError):
+            colocation.select_profiles(2)
+
+    def test_select_profiles_tolerance_overflow(self):
+        """A tolerance which goes beyond the representable dates must
+        leave the time range open
+        """
+        geospaas.catalog.models.Dataset.objects.filter(id=2).update(
+            time_coverage_end=datetime(9999, 12, 1, tzinfo=django.utils.timezone.utc))
+        self.assertListEqual(
+            colocation.select_profiles(2, time_tolerance={'days': 365}, buffer=150),
+            [(1, ['ingested/product_name/granule_name_1/'])])
+
 
 class HarvestJobTests(unittest.TestCase):
     """Tests for the HarvestJob class"""
@@ -659,6 +957,172 @@ class HarvestJobTests(unittest.TestCase):
             models.HarvestJob.make_task_parameters({'search_config_dict': {'foo': 'bar'}}),
             (({'foo': 'bar'},), {}))
 
+    SEARCH_CONFIG = {
+        'common': {'start_time': '2023-01-01', 'end_time': '2023-01-10'},
+        'searches': [{'provider_name': 'foo'}, {'provider_name': 'bar'}],
+    }
+
+    def test_get_signature_sharded(self):
+        """Configurations with several searches must be harvested in
+        parallel, then the results merged
+        """
+        with mock.patch.object(models.tasks_harvesting, 'start_harvest', noop_task), \
+             django.test.override_settings(GEOSPAAS_REST_API_HARVEST_DEFAULT_CONCURRENCY=2):
+            signature = models.HarvestJob.get_signature(
+                {'search_config_dict': self.SEARCH_CONFIG, 'shard_days': 3})
+        self.assertEqual(signature['subtask_type'], 'chord')
+        lanes = signature.tasks.tasks
+        # 3 time windows for each provider, at most 2 at the same time
+        self.assertListEqual([len(lane.tasks) for lane in lanes], [2, 1, 2, 1])
+        self.assertTrue(lanes[0].tasks[0].immutable)
+        self.assertEqual(lanes[0].tasks[0].args[0]['searches'], [{'provider_name': 'foo'}])
+        self.assertEqual(signature.body.task, 'geospaas_rest_api.merge_harvest_results')
+        self.assertDictEqual(signature.body.kwargs, {'shards': 6})
+
+    def test_make_task_parameters_sharded(self):
+        """The shards tasks have their own configuration, so no
+        argument must be given to the job
+        """
+        self.assertTupleEqual(
+            models.HarvestJob.make_task_parameters({'search_config_dict': self.SEARCH_CONFIG}),
+            ((), {}))
+
+    def test_check_parameters_shard_days(self):
+        """shard_days must be a positive integer or None"""
+        for shard_days in (1, None):
+            self.assertDictEqual(
+                models.HarvestJob.check_parameters(
+                    {'search_config_dict': self.SEARCH_CONFIG, 'shard_days': shard_days}),
+                {'search_config_dict': self.SEARCH_CONFIG, 'shard_days': shard_days})
+        for shard_days in (0, -1, '1', True, 1.5):
+            with self.subTest(shard_days=shard_days), self.assertRaises(ValidationError):
+                models.HarvestJob.check_parameters(
+                    {'search_config_dict': self.SEARCH_CONFIG, 'shard_days': shard_days})
+
+    def test_check_parameters_wrong_time_range(self):
+        """An error should be raised when the time range can't be
+        split
+        """
+        for common in ({'start_time': 'foo', 'end_time': '2023-01-10'},
+                       {'start_time': '2023-01-10', 'end_time': '2023-01-01'}):
+            with self.subTest(common=common), self.assertRaises(ValidationError):
+                models.HarvestJob.check_parameters({
+                    'search_config_dict': {'common': common, 'searches': [{}]},
+                    'shard_days': 1,
+                })
+
+
+class ShardingTests(unittest.TestCase):
+    """Tests for the splitting of harvest configurations"""
+
+    def test_split_search_config(self):
+        """The configuration must be split by search and time window,
+        the times defined in a search overriding the common ones
+        """
+        self.assertListEqual(
+            sharding.split_search_config({
+                'common': {'start_time': '2023-01-01', 'end_time': '2023-01-05', 'foo': 'bar'},
+                'searches': [
+                    {'provider_name': 'p1'},
+                    {'provider_name': 'p2', 'start_time': '2023-01-04T12:00:00Z'},
+                ],
+            }, window_days=2),
+            [
+                ('p1', {
+                    'common': {'foo': 'bar', 'start_time': '2023-01-01T00:00:00+00:00',
+                               'end_time': '2023-01-03T00:00:00+00:00'},
+                    'searches': [{'provider_name': 'p1'}]}),
+                ('p1', {
+                    'common': {'foo': 'bar', 'start_time': '2023-01-03T00:00:00+00:00',
+                               'end_time': '2023-01-05T00:00:00+00:00'},
+                    'searches': [{'provider_name': 'p1'}]}),
+                ('p2', {
+                    'common': {'foo': 'bar', 'start_time': '2023-01-04T12:00:00+00:00',
+                               'end_time': '2023-01-05T00:00:00+00:00'},
+                    'searches': [{'provider_name': 'p2'}]}),
+            ])
+
+    def test_split_search_config_no_window(self):
+        """Without window length, the configuration must only be split
+        by search
+        """
+        self.assertListEqual(
+            sharding.split_search_config({
+                'common': {'start_time': '2023-01-01', 'end_time': '2023-01-05'},
+                'searches': [{'provider_name': 'p1'}, {'provider_name': 'p2'}],
+            }),
+            [
+                ('p1', {'common': {'start_time': '2023-01-01', 'end_time': '2023-01-05'},
+                        'searches': [{'provider_name': 'p1'}]}),
+                ('p2', {'common': {'start_time': '2023-01-01', 'end_time': '2023-01-05'},
+                        'searches': [{'provider_name': 'p2'}]}),
+            ])
+
+    @django.test.override_settings(GEOSPAAS_REST_API_HARVEST_MAX_SHARDS=4)
+    def test_split_search_config_max_shards(self):
+        """The time windows must be widened so that the number of
+        shards does not exceed the limit
+        """
+        shards = sharding.split_search_config({
+            'common': {'start_time': '2023-01-01', 'end_time': '2023-01-31'},
+            'searches': [{'provider_name': 'p1'}, {'provider_name': 'p2'}],
+        }, window_days=1)
+        self.assertEqual(len(shards), 4)
+        self.assertListEqual(
+            [shard['common'] for _, shard in shards[:2]],
+            [{'start_time': '2023-01-01T00:00:00+00:00', 'end_time': '2023-01-16T00:00:00+00:00'},
+             {'start_time': '2023-01-16T00:00:00+00:00', 'end_time': '2023-01-31T00:00:00+00:00'}])
+        with self.assertRaises(ValidationError):
+            sharding.split_search_config(
+                {'searches': [{'provider_name': f"p{i}"} for i in range(5)]})
+
+    def test_split_time_range_long_window(self):
+        """A window longer than the time range must produce one window
+        """
+        self.assertEqual(
+            len(sharding.split_time_range('2023-01-01', '2023-01-05', 10 ** 12)), 1)
+
+    @django.test.override_settings(GEOSPAAS_REST_API_HARVEST_PROVIDER_CONCURRENCY={'p1': 2},
+                                   GEOSPAAS_REST_API_HARVEST_DEFAULT_CONCURRENCY=1)
+    def test_distribute_shards(self):
+        """The shards of a provider must be distributed among at most
+        as many lanes as its concurrency limit
+        """
+        self.assertListEqual(
+            sharding.distribute_shards([
+                ('p1', 1), ('p1', 2), ('p1', 3), ('p2', 4), ('p2', 5), ('p3', 6)]),
+            [[1, 3], [2], [4, 5], [6]])
+
+
+class HarvestProgressTests(django.test.TestCase):
+    """Tests for the progress reported by sharded harvest jobs"""
+
+    def test_get_progress(self):
+        """The number of shards in each state must be reported"""
+        steps = [
+            {'task_id': 'shard1', 'name': noop_task.name, 'stage': 0},
+            {'task_id': 'shard2', 'name': noop_task.name, 'stage': 0},
+            {'task_id': 'shard3', 'name': noop_task.name, 'stage': 1},
+            {'task_id': 'merge', 'name': 'geospaas_rest_api.merge_harvest_results', 'stage': 2},
+        ]
+        django_celery_results.models.TaskResult.objects.create(task_id='shard1', status='SUCCESS')
+        django_celery_results.models.TaskResult.objects.create(task_id='shard2', status='STARTED')
+        job = models.Job(action='harvest', steps=steps)
+        with mock.patch.object(models.tasks_harvesting, 'start_harvest', noop_task), \
+             self.assertNumQueries(1):
+            self.assertDictEqual(
+                job.get_progress(),
+                {'shards': 3, 'finished': 1,
+                 'states': {'SUCCESS': 1, 'STARTED': 1, 'PENDING': 1}})
+
+    def test_get_progress_not_sharded(self):
+        """Jobs which are not sharded must not report progress"""
+        with mock.patch.object(models.tasks_harvesting, 'start_harvest', noop_task):
+            self.assertIsNone(models.Job(
+                action='harvest',
+                steps=[{'task_id': 'foo', 'name': noop_task.name, 'stage': 0}]).get_progress())
+        self.assertIsNone(models.Job(action='download', steps=[]).get_progress())
+
 
 class WorkdirCleanupJobTests(unittest.TestCase):
     """Tests for WorkdirCleanupJob"""
@@ -767,6 +1231,50 @@ class JobViewSetTests(django.test.TestCase):
             response = self.client.get('/api/jobs/1/')
             self.assertJSONEqual(response.content, expected_job)
 
+    def test_filter_jobs(self):
+        """Test that the jobs can be filtered by action, status,
+        dataset and date
+        """
+        models.Job.objects.filter(id=1).update(
+            action='convert', parameters={'dataset_id': 123, 'format': 'idf'}, status='FAILURE')
+        models.Job.objects.filter(id=2).update(
+            action='download', parameters={'dataset_id': 123}, status='SUCCESS')
+        models.Job.objects.create(
+            action='convert', parameters={'dataset_id': 124}, task_id='foo', status='FAILURE')
+        models.Job.objects.create(
+            action='download', parameters={'dataset_ids': [122, 123]}, task_id='bar',
+            status='SUCCESS')
+
+        with mock.patch.object(models.Job, 'get_current_task_result') as mock_get_result:
+            mock_result = mock.Mock(spec=celery.result.AsyncResult)
+            mock_result.state = 'PLACEHOLDER'
+            mock_get_result.return_value = (mock_result, False)
+            for query, expected_ids in (
+                    ('action=convert', [3, 1]),
+                    ('action__in=convert,download', [4, 3, 2, 1]),
+                    ('status=FAILURE', [3, 1]),
+                    ('dataset_id=123', [4, 2, 1]),
+                    ('dataset_id=122', [4]),
+                    ('action=convert&status=FAILURE&dataset_id=123', [1]),
+                    ('date_created__lt=2020-07-16T13:55:00Z', [1]),
+                    ('action=harvest', [])):
+                with self.subTest(query=query):
+                    response = self.client.get(f"/api/jobs/?{query}")
+                    self.assertEqual(response.status_code, 200)
+                    self.assertListEqual(
+                        [job['id'] for job in response.json()['results']], expected_ids)
+
+    def test_filter_jobs_pagination(self):
+        """Filtered listings must be paginated"""
+        models.Job.objects.bulk_create(
+            models.Job(action='download', task_id=str(i), status='SUCCESS') for i in range(3))
+        with mock.patch('geospaas_rest_api.pagination.IdOrderedCursorPagination.page_size', 2):
+            response = self.client.get('/api/jobs/?status=SUCCESS')
+            self.assertEqual(len(response.json()['results']), 2)
+            response = self.client.get(response.json()['next'])
+            self.assertEqual(len(response.json()['results']), 1)
+            self.assertIsNone(response.json()['next'])
+
 
 class JobSerializerTests(django.test.TestCase):
     """Tests for the JobSerializer"""
@@ -939,6 +1447,16 @@ class JobSerializerTests(django.test.TestCase):
                 serializers.JobSerializer().to_representation(models.Job.objects.get(id=1)),
                 {**expected_base_dict, 'result': 'error happened'})
 
+    def test_representation_is_read_only(self):
+        """Serializing a job must not update it in the database"""
+        with mock.patch.object(models.Job, 'get_current_task_result') as mock_get_result, \
+             mock.patch.object(models.Job, 'set_status') as mock_set_status:
+            mock_result = mock.Mock(spec=celery.result.AsyncResult, state='SUCCESS')
+            mock_get_result.return_value = (mock_result, True)
+            serializers.JobSerializer().to_representation(models.Job.objects.get(id=1))
+        mock_set_status.assert_not_called()
+        self.assertEqual(models.Job.objects.get(id=1).status, 'PENDING')
+
     def test_choose_job_class(self):
         """Test getting the right class based on the action parameter
         """
@@ -960,6 +1478,1483 @@ class JobSerializerTests(django.test.TestCase):
             models.SyntoolCleanupJob)
 
 
+class AdmissionTests(django.test.TestCase):
+    """Tests for the admission control of jobs"""
+
+    fixtures = ['processing_tests_data']
+
+    def setUp(self):
+        # the fixture jobs are considered running
+        mock_update_status = mock.patch.object(models.Job, 'update_status')
+        self.mock_update_status = mock_update_status.start()
+        self.addCleanup(mock_update_status.stop)
+
+    def test_admit_without_limits(self):
+        """Jobs must be admitted when no limit is set"""
+        with self.assertNumQueries(0):
+            self.assertTrue(admission.admit(models.Job(action='download')))
+
+    @django.test.override_settings(GEOSPAAS_REST_API_MAX_RUNNING_JOBS=3)
+    def test_admit_under_global_limit(self):
+        """Jobs must be admitted when the global limit is not reached"""
+        self.assertTrue(admission.admit(models.Job(action='download')))
+        self.mock_update_status.assert_not_called()
+
+    @django.test.override_settings(GEOSPAAS_REST_API_MAX_RUNNING_JOBS=2)
+    def test_reject_over_global_limit(self):
+        """Jobs must be rejected when the global limit is reached,
+        without querying the result backend
+        """
+        with self.assertRaises(admission.JobLimitExceeded) as raised:
+            admission.admit(models.Job(action='download'))
+        self.assertEqual(raised.exception.status_code, 429)
+        self.assertEqual(raised.exception.wait, 3600)
+        self.mock_update_status.assert_not_called()
+
+    @django.test.override_settings(GEOSPAAS_REST_API_MAX_RUNNING_JOBS=3)
+    def test_submit_takes_lock(self):
+        """The admission lock must be held while a job is admitted and
+        saved when a limit applies
+        """
+        with mock.patch.object(admission, 'lock') as mock_lock, \
+             mock.patch.object(models.Job, 'dispatch') as mock_dispatch:
+            admission.submit(models.Job(action='download'))
+        mock_lock.assert_called_once_with()
+        mock_dispatch.assert_called_once_with()
+        # the dispatch was mocked, so the new job is not running
+        with self.assertRaises(admission.JobLimitExceeded), \
+             django.test.override_settings(GEOSPAAS_REST_API_MAX_RUNNING_JOBS=2):
+            admission.submit(models.Job(action='download'))
+        self.assertEqual(models.Job.objects.count(), 3)
+
+    @django.test.override_settings(GEOSPAAS_REST_API_MAX_RUNNING_JOBS_PER_ACTION={'convert': 1})
+    def test_action_limit(self):
+        """The limit of an action must only apply to jobs performing
+        this action
+        """
+        models.Job.objects.filter(id=1).update(action='convert')
+        self.assertTrue(admission.admit(models.Job(action='download')))
+        with self.assertRaises(admission.JobLimitExceeded):
+            admission.admit(models.Job(action='convert'))
+
+    @django.test.override_settings(GEOSPAAS_REST_API_MAX_RUNNING_JOBS=0,
+                                   GEOSPAAS_REST_API_QUEUE_EXCESS_JOBS=True)
+    def test_queue_over_limit(self):
+        """Jobs must be queued when the limit is reached if the
+        settings say so
+        """
+        job = models.Job(action='download')
+        self.assertFalse(admission.admit(job))
+        self.assertEqual(job.status, models.Job.QUEUED)
+
+    @django.test.override_settings(GEOSPAAS_REST_API_MAX_RUNNING_JOBS=10,
+                                   GEOSPAAS_REST_API_QUEUE_EXCESS_JOBS=True)
+    def test_queue_behind_waiting_jobs(self):
+        """New jobs must not overtake queued jobs"""
+        models.Job.objects.create(action='download', status=models.Job.QUEUED)
+        job = models.Job(action='download')
+        self.assertFalse(admission.admit(job))
+        self.assertEqual(job.status, models.Job.QUEUED)
+
+    @django.test.override_settings(GEOSPAAS_REST_API_THROUGHPUT_WINDOW=600)
+    def test_estimate_wait(self):
+        """The waiting time must be based on the recent throughput"""
+        models.Job.objects.filter(id__in=(1, 2)).update(
+            status='SUCCESS', date_done=django.utils.timezone.now())
+        # 2 jobs finished in 600 seconds
+        self.assertEqual(admission.estimate_wait(1), 300)
+        self.assertEqual(admission.estimate_wait(3), 900)
+
+    @django.test.override_settings(GEOSPAAS_REST_API_STALE_JOB_TIMEOUT=3600)
+    def test_sync_stale_jobs(self):
+        """The status of the old running jobs must be read from the
+        result backend, and the jobs without results must expire
+        """
+        django_celery_results.models.TaskResult.objects.create(
+            task_id='733d3a63-7a5a-4a1e-8cf0-750ae393dd99', status='SUCCESS')
+        recent_job = models.Job.objects.create(
+            action='download', task_id='recent', date_dispatched=django.utils.timezone.now())
+
+        self.assertEqual(admission.sync_stale_jobs(), 2)
+        self.assertEqual(models.Job.objects.get(id=1).status, models.Job.EXPIRED)
+        self.assertEqual(models.Job.objects.get(id=2).status, 'SUCCESS')
+        self.assertEqual(models.Job.objects.get(id=recent_job.id).status, 'PENDING')
+        self.assertEqual(admission.sync_stale_jobs(), 0)
+
+    @django.test.override_settings(GEOSPAAS_REST_API_MAX_RUNNING_JOBS=3,
+                                   GEOSPAAS_REST_API_MAX_RUNNING_JOBS_PER_ACTION={'convert': 1})
+    def test_release_queued_jobs(self):
+        """Queued jobs must be dispatched in order while the limits
+        allow it
+        """
+        models.Job.objects.filter(id=1).update(action='convert')
+        first = models.Job.objects.create(action='convert', status=models.Job.QUEUED)
+        second = models.Job.objects.create(action='download', status=models.Job.QUEUED)
+        third = models.Job.objects.create(action='download', status=models.Job.QUEUED)
+
+        def dispatch(job):
+            job.task_id = f"task_{job.pk}"
+            job.status = 'PENDING'
+
+        with mock.patch.object(models.Job, 'dispatch', autospec=True, side_effect=dispatch):
+            self.assertEqual(admission.release_queued_jobs(), 1)
+
+        self.assertEqual(models.Job.objects.get(id=first.id).status, models.Job.QUEUED)
+        self.assertEqual(models.Job.objects.get(id=second.id).task_id, f"task_{second.id}")
+        self.assertEqual(models.Job.objects.get(id=third.id).status, models.Job.QUEUED)
+
+    @django.test.override_settings(GEOSPAAS_REST_API_MAX_RUNNING_JOBS=2)
+    def test_post_job_over_limit(self):
+        """A 429 response with a Retry-After header must be returned
+        when a job is rejected
+        """
+        with mock.patch.object(models.Job, 'dispatch') as mock_dispatch:
+            response = self.client.post(
+                '/api/jobs/',
+                {'action': 'download', 'parameters': {'dataset_id': 1}},
+                'application/json')
+        mock_dispatch.assert_not_called()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '3600')
+
+    @django.test.override_settings(GEOSPAAS_REST_API_MAX_RUNNING_JOBS=2,
+                                   GEOSPAAS_REST_API_QUEUE_EXCESS_JOBS=True)
+    def test_post_queued_job(self):
+        """A queued job must be saved without task and its status must
+        be returned
+        """
+        with mock.patch.object(models.Job, 'dispatch') as mock_dispatch:
+            response = self.client.post(
+                '/api/jobs/',
+                {'action': 'download', 'parameters': {'dataset_id': 1}},
+                'application/json')
+        mock_dispatch.assert_not_called()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['status'], models.Job.QUEUED)
+        job = models.Job.objects.get(id=response.json()['id'])
+        self.assertIsNone(job.task_id)
+        self.assertEqual(job.action, 'download')
+        self.assertDictEqual(job.parameters, {'dataset_id': 1})
+
+
+class FairShareSchedulingTests(django.test.TestCase):
+    """Tests for the sharing of running jobs slots between clients"""
+
+    fixtures = ['processing_tests_data']
+
+    def setUp(self):
+        # the fixture jobs are considered running
+        mock_update_status = mock.patch.object(models.Job, 'update_status')
+        mock_update_status.start()
+        self.addCleanup(mock_update_status.stop)
+
+    @staticmethod
+    def create_queued_jobs(client, number):
+        """Creates `number` queued jobs for `client`"""
+        return [
+            models.Job.objects.create(action='download', client=client, status=models.Job.QUEUED)
+            for _ in range(number)
+        ]
+
+    @staticmethod
+    def release():
+        """Runs release_queued_jobs() and returns the set of dispatched
+        job IDs
+        """
+        dispatched = set()
+
+        def dispatch(job):
+            job.task_id = f"task_{job.pk}"
+            job.status = 'PENDING'
+            dispatched.add(job.pk)
+
+        with mock.patch.object(models.Job, 'dispatch', autospec=True, side_effect=dispatch):
+            admission.release_queued_jobs()
+        return dispatched
+
+    def test_get_client_id(self):
+        """The client must be identified by its user name, token or
+        address
+        """
+        user = mock.Mock(is_authenticated=True)
+        user.get_username.return_value = 'alice'
+        self.assertEqual(
+            admission.get_client_id(mock.Mock(user=user)),
+            'user:alice')
+        self.assertRegex(
+            admission.get_client_id(mock.Mock(user=None, auth=mock.Mock(key='secret'))),
+            r'^token:[0-9a-f]{16}$')
+        self.assertEqual(
+            admission.get_client_id(
+                mock.Mock(user=None, auth=None, META={'REMOTE_ADDR': '10.0.0.1'})),
+            'address:10.0.0.1')
+        self.assertEqual(admission.get_client_id(None), '')
+
+    @django.test.override_settings(GEOSPAAS_REST_API_MAX_RUNNING_JOBS=5)
+    def test_share_slots_between_clients(self):
+        """A client with a lot of queued jobs must not prevent other
+        clients' jobs from running
+        """
+        a_jobs = self.create_queued_jobs('A', 4)
+        b_jobs = self.create_queued_jobs('B', 1)
+        self.assertSetEqual(self.release(), {a_jobs[0].pk, b_jobs[0].pk, a_jobs[1].pk})
+
+    @django.test.override_settings(GEOSPAAS_REST_API_MAX_RUNNING_JOBS=8,
+                                   GEOSPAAS_REST_API_CLIENT_WEIGHTS={'A': 2})
+    def test_client_weights(self):
+        """Clients must get a number of slots proportional to their
+        weight
+        """
+        a_jobs = self.create_queued_jobs('A', 5)
+        b_jobs = self.create_queued_jobs('B', 5)
+        self.assertSetEqual(
+            self.release(),
+            {*(j.pk for j in a_jobs[:4]), *(j.pk for j in b_jobs[:2])})
+
+    @django.test.override_settings(GEOSPAAS_REST_API_MAX_RUNNING_JOBS=3)
+    def test_release_from_deep_queue(self):
+        """The number of queries must not depend on the length of the
+        queues, and no more jobs than free slots must be released
+        """
+        query_counts = []
+        for number in (2, 3 * admission.QUEUE_LOOKAHEAD):
+            models.Job.objects.filter(status=models.Job.QUEUED).delete()
+            jobs = self.create_queued_jobs('A', number)
+            with django.test.utils.CaptureQueriesContext(django.db.connection) as queries:
+                self.assertSetEqual(self.release(), {jobs[0].pk})
+            query_counts.append(len(queries))
+            models.Job.objects.filter(id=jobs[0].pk).delete()
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_client_queue_lookahead(self):
+        """At most QUEUE_LOOKAHEAD jobs of a client must be loaded"""
+        jobs = self.create_queued_jobs('A', admission.QUEUE_LOOKAHEAD + 2)
+        client_queue = admission.ClientQueue('A', jobs[0].pk)
+        self.assertEqual(client_queue.pop(admission.RunningJobsCounter()), jobs[0])
+        self.assertListEqual(client_queue.jobs, jobs[1:admission.QUEUE_LOOKAHEAD])
+        self.assertEqual(client_queue.first_id, jobs[1].pk)
+        self.assertFalse(client_queue.is_empty())
+
+    @django.test.override_settings(GEOSPAAS_REST_API_CLIENT_QUOTAS={'A': 1})
+    def test_client_quota(self):
+        """A client must not have more running jobs than its quota"""
+        a_jobs = self.create_queued_jobs('A', 2)
+        b_jobs = self.create_queued_jobs('B', 2)
+        self.assertSetEqual(
+            self.release(),
+            {a_jobs[0].pk, b_jobs[0].pk, b_jobs[1].pk})
+
+    @django.test.override_settings(GEOSPAAS_REST_API_MAX_RUNNING_JOBS_PER_CLIENT=1)
+    def test_reject_over_client_quota(self):
+        """Jobs over the client quota must be rejected when queuing is
+        disabled
+        """
+        models.Job.objects.create(action='download', task_id='foo', client='A')
+        self.assertTrue(admission.admit(models.Job(action='download', client='B')))
+        with self.assertRaises(admission.JobLimitExceeded):
+            admission.admit(models.Job(action='download', client='A'))
+
+    @django.test.override_settings(GEOSPAAS_REST_API_MAX_RUNNING_JOBS=4,
+                                   GEOSPAAS_REST_API_QUEUE_EXCESS_JOBS=True)
+    def test_fair_share_eager_mode(self):
+        """Test the scheduling of jobs submitted through the API with
+        Celery in eager mode
+        """
+        app = celery.current_app
+        previous_eager = app.conf.task_always_eager
+        app.conf.task_always_eager = True
+        self.addCleanup(setattr, app.conf, 'task_always_eager', previous_eager)
+
+        def post_job(address):
+            response = self.client.post(
+                '/api/jobs/',
+                {'action': 'download', 'parameters': {'dataset_id': 1}},
+                'application/json',
+                REMOTE_ADDR=address)
+            return models.Job.objects.get(id=response.json()['id'])
+
+        mock_result = mock.Mock(spec=celery.result.AsyncResult, state='PENDING')
+        with mock.patch.object(models.DownloadJob, 'get_signature',
+                               return_value=noop_task.signature()), \
+             mock.patch.object(models.Job, 'get_current_task_result',
+                               return_value=(mock_result, False)):
+            a_jobs = [post_job('10.0.0.1') for _ in range(4)]
+            b_job = post_job('10.0.0.2')
+
+            # 2 slots were free for client A
+            self.assertListEqual(
+                [j.status for j in a_jobs],
+                ['PENDING', 'PENDING', models.Job.QUEUED, models.Job.QUEUED])
+            self.assertEqual(b_job.status, models.Job.QUEUED)
+
+            # when a slot frees up, it goes to client B
+            models.Job.objects.filter(id=a_jobs[0].id).update(status='SUCCESS')
+            self.assertEqual(admission.release_queued_jobs(), 1)
+
+        self.assertIsNotNone(models.Job.objects.get(id=b_job.id).task_id)
+        self.assertEqual(models.Job.objects.get(id=a_jobs[2].id).status, models.Job.QUEUED)
+        self.assertEqual(models.Job.objects.get(id=a_jobs[3].id).status, models.Job.QUEUED)
+
+
+class JobSignalsTests(django.test.TestCase):
+    """Tests for the Celery signal handlers which update the jobs
+    status
+    """
+
+    fixtures = ['processing_tests_data']
+
+    def setUp(self):
+        models.Job.objects.filter(id=1).update(root_task_id='root')
+
+    def test_get_task_jobs(self):
+        """Jobs must be found from the root ID or the ID of their last
+        task
+        """
+        self.assertListEqual(
+            [j.id for j in signals.get_task_jobs('foo', 'root')], [1])
+        self.assertListEqual(
+            [j.id for j in signals.get_task_jobs('733d3a63-7a5a-4a1e-8cf0-750ae393dd99', None)],
+            [2])
+        models.Job.objects.filter(id=1).update(status='SUCCESS')
+        self.assertListEqual(list(signals.get_task_jobs('foo', 'root')), [])
+
+    def test_mark_job_started(self):
+        """The job must be marked as started when one of its tasks
+        starts
+        """
+        signals.mark_job_started(task_id='foo', task=mock.Mock(request=mock.Mock(root_id='root')))
+        self.assertEqual(models.Job.objects.get(id=1).status, 'STARTED')
+        self.assertEqual(models.Job.objects.get(id=2).status, 'PENDING')
+
+    def test_refresh_job_status(self):
+        """The job status must be updated when one of its tasks
+        finishes
+        """
+        with mock.patch.object(models.Job, 'update_status', autospec=True) as mock_update:
+            signals.refresh_job_status(
+                task_id='foo', task=mock.Mock(request=mock.Mock(root_id='root')))
+            signals.refresh_revoked_job_status(request=mock.Mock(id='bar', root_id='root'))
+        self.assertListEqual([c[0][0].id for c in mock_update.call_args_list], [1, 1])
+
+    @django.test.override_settings(GEOSPAAS_REST_API_QUEUE_EXCESS_JOBS=True)
+    def test_release_queued_jobs_when_job_ends(self):
+        """Queued jobs must be released when a job ends, and only then
+        """
+        models.Job.objects.create(action='download', status=models.Job.QUEUED)
+
+        def update_status(job):
+            job.status = 'SUCCESS'
+
+        with mock.patch.object(admission, 'release_queued_jobs') as mock_release:
+            with mock.patch.object(models.Job, 'update_status', autospec=True):
+                signals.refresh_jobs('foo', 'root')
+            mock_release.assert_not_called()
+            with mock.patch.object(models.Job, 'update_status', autospec=True,
+                                   side_effect=update_status):
+                signals.refresh_jobs('foo', 'root')
+            mock_release.assert_called_once_with()
+
+
+class JobEventsTests(django.test.TestCase):
+    """Tests for the Server-Sent Events streams of jobs status"""
+
+    fixtures = ['processing_tests_data']
+
+    def test_poll(self):
+        """An event must be produced only when the status of a job
+        changes
+        """
+        stream = events.JobEventStream([1, 2])
+        self.assertListEqual(stream.poll(), [
+            'event: status\ndata: {"id": 1, "status": "PENDING", "date_done": null}\n\n',
+            'event: status\ndata: {"id": 2, "status": "PENDING", "date_done": null}\n\n',
+        ])
+        self.assertListEqual(stream.poll(), [])
+        self.assertFalse(stream.finished)
+
+        models.Job.objects.filter(id=2).update(status='STARTED')
+        self.assertListEqual(stream.poll(), [
+            'event: status\ndata: {"id": 2, "status": "STARTED", "date_done": null}\n\n',
+        ])
+
+    @django.test.override_settings(GEOSPAAS_REST_API_EVENTS_POLL_INTERVAL=0,
+                                   GEOSPAAS_REST_API_EVENTS_HEARTBEAT_INTERVAL=0)
+    def test_events_end_when_jobs_finished(self):
+        """The stream must send heartbeats while nothing happens and end
+        when all the jobs are finished
+        """
+        stream = events.JobEventStream([1])
+        generator = stream.events()
+        self.assertEqual(next(generator), 'retry: 0\n\n')
+        self.assertIn('"status": "PENDING"', next(generator))
+        self.assertEqual(next(generator), ': heartbeat\n\n')
+        models.Job.objects.filter(id=1).update(status='FAILURE')
+        self.assertIn('"status": "FAILURE"', next(generator))
+        with self.assertRaises(StopIteration):
+            next(generator)
+
+    @django.test.override_settings(GEOSPAAS_REST_API_EVENTS_TIMEOUT=0)
+    def test_events_timeout(self):
+        """The stream must end after the timeout"""
+        self.assertEqual(len(list(events.JobEventStream([1]).events())), 2)
+
+    def test_job_events_endpoint(self):
+        """The events of a single job must be streamed"""
+        models.Job.objects.filter(id=1).update(status='SUCCESS')
+        response = self.client.get('/api/jobs/1/events/', HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = b''.join(response.streaming_content).decode()
+        self.assertIn('"id": 1, "status": "SUCCESS"', content)
+
+    def test_job_events_endpoint_asgi(self):
+        """The events must be refused under ASGI if Django can't stream
+        them asynchronously
+        """
+        request = mock.Mock(_request=mock.Mock(spec=views.ASGIRequest))
+        with mock.patch.object(django, 'VERSION', (3, 2, 0, 'final', 0)):
+            with self.assertRaises(views.EventsNotSupported):
+                views.JobViewSet.stream_events(request, [1])
+
+    def test_job_events_endpoint_not_found(self):
+        """A 404 error must be returned for unknown jobs"""
+        self.assertEqual(self.client.get('/api/jobs/100/events/').status_code, 404)
+
+    def test_multiple_jobs_events_endpoint(self):
+        """The events of several jobs must be streamed"""
+        models.Job.objects.filter(id__in=(1, 2)).update(status='SUCCESS')
+        response = self.client.get('/api/jobs/events/?ids=1,2,100')
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content).decode()
+        self.assertIn('"id": 1, "status": "SUCCESS"', content)
+        self.assertIn('"id": 2, "status": "SUCCESS"', content)
+
+    def test_multiple_jobs_events_endpoint_errors(self):
+        """Errors must be returned for invalid or unknown IDs"""
+        self.assertEqual(self.client.get('/api/jobs/events/').status_code, 400)
+        self.assertEqual(self.client.get('/api/jobs/events/?ids=a,b').status_code, 400)
+        self.assertEqual(self.client.get('/api/jobs/events/?ids=100').status_code, 404)
+
+
+class CallbackReceiver(http.server.BaseHTTPRequestHandler):
+    """Local HTTP server request handler which records the callbacks
+    it receives
+    """
+    received = []
+    response_status = 200
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Record the request and send the configured response"""
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.received.append((dict(self.headers), body))
+        self.send_response(self.response_status)
+        if self.response_status == 302:
+            self.send_header('Location', '/elsewhere')
+        self.end_headers()
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Do not log the requests"""
+
+
+@django.test.override_settings(GEOSPAAS_REST_API_CALLBACK_ALLOWED_HOSTS=['127.0.0.1'])
+class JobCallbackTests(django.test.TestCase):
+    """Tests for the job callbacks"""
+
+    fixtures = ['processing_tests_data']
+
+    def setUp(self):
+        CallbackReceiver.received = []
+        CallbackReceiver.response_status = 200
+        self.server = http.server.HTTPServer(('127.0.0.1', 0), CallbackReceiver)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/callback"
+
+    def finish_job(self, job_id, callback_url):
+        """Sets the callback URL of a job and updates its status to
+        SUCCESS
+        """
+        models.Job.objects.filter(id=job_id).update(callback_url=callback_url)
+        job = models.Job.objects.get(id=job_id)
+        job.set_status('SUCCESS')
+        return job
+
+    def test_callback_created_when_job_finished(self):
+        """A callback must be created once when a job with a callback
+        URL finishes
+        """
+        job = self.finish_job(1, self.url)
+        # a concurrent update must not create a second callback
+        models.Job(id=1, task_id=job.task_id, callback_url=self.url, status='STARTED') \
+            .set_status('FAILURE')
+        self.assertEqual(models.JobCallback.objects.count(), 1)
+        callback = models.JobCallback.objects.get()
+        self.assertEqual(callback.url, self.url)
+        self.assertEqual(callback.payload['id'], 1)
+        self.assertEqual(callback.payload['status'], 'SUCCESS')
+
+    def test_no_callback_without_url(self):
+        """No callback must be created for jobs without callback URL"""
+        self.finish_job(1, '')
+        self.assertFalse(models.JobCallback.objects.exists())
+
+    @django.test.override_settings(GEOSPAAS_REST_API_CALLBACK_SECRET='secret')
+    def test_deliver_signed_batch(self):
+        """The callbacks for the same URL must be sent in one signed
+        request
+        """
+        self.finish_job(1, self.url)
+        self.finish_job(2, self.url)
+        self.assertEqual(callbacks.deliver_pending_callbacks(), 2)
+
+        self.assertEqual(len(CallbackReceiver.received), 1)
+        headers, body = CallbackReceiver.received[0]
+        self.assertListEqual([e['id'] for e in json.loads(body)['events']], [1, 2])
+        expected_signature = hmac.new(
+            b'secret', f"{headers['X-Geospaas-Timestamp']}.".encode() + body,
+            hashlib.sha256).hexdigest()
+        self.assertEqual(headers['X-Geospaas-Signature'], f"sha256={expected_signature}")
+        self.assertFalse(
+            models.JobCallback.objects.exclude(status=models.JobCallback.DELIVERED).exists())
+
+        # nothing left to deliver
+        self.assertEqual(callbacks.deliver_pending_callbacks(), 0)
+        self.assertEqual(len(CallbackReceiver.received), 1)
+
+    @django.test.override_settings(GEOSPAAS_REST_API_CALLBACK_BATCH_SIZE=1)
+    def test_batch_size(self):
+        """Batches must not be larger than the configured size"""
+        self.finish_job(1, self.url)
+        self.finish_job(2, self.url)
+        self.assertEqual(callbacks.deliver_pending_callbacks(), 2)
+        self.assertEqual(len(CallbackReceiver.received), 2)
+
+    @django.test.override_settings(GEOSPAAS_REST_API_CALLBACK_RETRY_DELAY=10,
+                                   GEOSPAAS_REST_API_CALLBACK_MAX_ATTEMPTS=3)
+    def test_retry_with_backoff(self):
+        """Failed deliveries must be retried with an exponential
+        backoff, then abandoned
+        """
+        CallbackReceiver.response_status = 500
+        self.finish_job(1, self.url)
+
+        for attempt in range(1, 4):
+            before = django.utils.timezone.now()
+            self.assertEqual(callbacks.deliver_pending_callbacks(), 0)
+            callback = models.JobCallback.objects.get()
+            self.assertEqual(callback.attempts, attempt)
+            self.assertIn('500', callback.last_error)
+            if attempt < 3:
+                self.assertEqual(callback.status, models.JobCallback.PENDING)
+                self.assertGreaterEqual(
+                    callback.next_attempt - before,
+                    timedelta(seconds=10 * 2 ** (attempt - 1)))
+                # make the callback due again
+                models.JobCallback.objects.update(next_attempt=before)
+        self.assertEqual(callback.status, models.JobCallback.FAILED)
+        self.assertEqual(len(CallbackReceiver.received), 3)
+
+    def test_unreachable_receiver(self):
+        """Connection errors must be recorded"""
+        self.finish_job(1, 'http://127.0.0.1:1/callback')
+        self.assertEqual(callbacks.deliver_pending_callbacks(), 0)
+        self.assertNotEqual(models.JobCallback.objects.get().last_error, '')
+
+    def test_forbidden_address(self):
+        """Callbacks must not be sent to non-public addresses which are
+        not explicitly allowed
+        """
+        self.finish_job(1, self.url)
+        with django.test.override_settings(GEOSPAAS_REST_API_CALLBACK_ALLOWED_HOSTS=[]):
+            self.assertEqual(callbacks.deliver_pending_callbacks(), 0)
+        self.assertEqual(CallbackReceiver.received, [])
+        self.assertIn("can't be sent to 127.0.0.1", models.JobCallback.objects.get().last_error)
+
+        self.assertTrue(callbacks.is_allowed_address('example.com', '93.184.216.34'))
+        self.assertFalse(callbacks.is_allowed_address('example.com', '169.254.169.254'))
+        with django.test.override_settings(
+                GEOSPAAS_REST_API_CALLBACK_ALLOWED_HOSTS=['10.1.0.0/16', 'hooks']):
+            self.assertTrue(callbacks.is_allowed_address('example.com', '10.1.2.3'))
+            self.assertTrue(callbacks.is_allowed_address('hooks', '10.2.0.1'))
+            self.assertFalse(callbacks.is_allowed_address('example.com', '10.2.0.1'))
+
+    def test_redirect_not_followed(self):
+        """Redirections must be treated as failures"""
+        CallbackReceiver.response_status = 302
+        self.finish_job(1, self.url)
+        self.assertEqual(callbacks.deliver_pending_callbacks(), 0)
+        self.assertEqual(len(CallbackReceiver.received), 1)
+        self.assertIn('302', models.JobCallback.objects.get().last_error)
+
+    @django.test.override_settings(GEOSPAAS_REST_API_CALLBACK_BATCH_SIZE=1,
+                                   GEOSPAAS_REST_API_CALLBACK_WORKERS=1)
+    def test_acquire_limit(self):
+        """A limited number of callbacks must be acquired at a time"""
+        self.finish_job(1, self.url)
+        self.finish_job(2, self.url)
+        self.assertEqual(len(callbacks.acquire_due_callbacks(1)), 1)
+        models.JobCallback.objects.update(next_attempt=django.utils.timezone.now())
+        self.assertEqual(callbacks.deliver_pending_callbacks(), 2)
+
+    def test_post_job_with_callback_url(self):
+        """The callback URL must be stored when a job is created"""
+        with mock.patch.object(models.Job, 'dispatch'), \
+             mock.patch.object(serializers.JobSerializer, 'to_representation', return_value={}):
+            self.client.post(
+                '/api/jobs/',
+                {'action': 'download', 'parameters': {'dataset_id': 1}, 'callback_url': self.url},
+                'application/json')
+        self.assertEqual(models.Job.objects.latest('id').callback_url, self.url)
+
+    def test_post_job_with_invalid_callback_url(self):
+        """Only HTTP(S) callback URLs must be accepted"""
+        response = self.client.post(
+            '/api/jobs/',
+            {'action': 'download', 'parameters': {'dataset_id': 1},
+             'callback_url': 'ftp://example.com/callback'},
+            'application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class JobCancellationTests(django.test.TestCase):
+    """Tests for the cancellation of jobs"""
+
+    fixtures = ['processing_tests_data']
+
+    def setUp(self):
+        models.Job.objects.filter(id=1).update(
+            action='download', parameters={'dataset_id': 1}, root_task_id='root')
+        self.get_task_ids = models.Job.get_task_ids
+        mock_revoke = mock.patch.object(celery.current_app.control, 'revoke')
+        self.mock_revoke = mock_revoke.start()
+        self.addCleanup(mock_revoke.stop)
+        mock_get_task_ids = mock.patch.object(
+            models.Job, 'get_task_ids', return_value=['root', 'foo'])
+        mock_get_task_ids.start()
+        self.addCleanup(mock_get_task_ids.stop)
+        mock_tasks_core = mock.patch('geospaas_rest_api.processing_api.models.tasks_core')
+        self.mock_tasks_core = mock_tasks_core.start()
+        self.addCleanup(mock_tasks_core.stop)
+
+    def test_get_task_ids(self):
+        """The IDs of the tasks must be read from the steps, or be the
+        first and last ones for the jobs without steps
+        """
+        job = models.Job(task_id='last', root_task_id='root', steps=[
+            {'task_id': 'root', 'name': 'a', 'stage': 0},
+            {'task_id': 'g1', 'name': 'b', 'stage': 1},
+            {'task_id': 'g2', 'name': 'b', 'stage': 1},
+            {'task_id': 'last', 'name': 'c', 'stage': 2},
+        ])
+        self.assertListEqual(self.get_task_ids(job), ['root', 'g1', 'g2', 'last'])
+        self.assertListEqual(
+            self.get_task_ids(models.Job(task_id='last', root_task_id='root')), ['root', 'last'])
+
+    def test_cancel_running_job(self):
+        """The tasks of a running job must be revoked and the
+        downloaded files removed once they are stopped
+        """
+        cleanup_signature = noop_task.signature(immutable=True)
+        self.mock_tasks_core.remove_downloaded.signature.return_value = cleanup_signature
+        job = models.Job.objects.get(id=1)
+        with mock.patch.object(executors.CeleryExecutor, 'submit') as mock_submit:
+            self.assertTrue(job.cancel())
+        self.mock_revoke.assert_called_once_with(['root', 'foo'], terminate=True)
+        self.mock_tasks_core.remove_downloaded.signature.assert_called_once_with(
+            args=((1,),), immutable=True)
+        submitted = mock_submit.call_args[0][0]
+        self.assertEqual(submitted.tasks[0].task, 'geospaas_rest_api.wait_for_job_tasks')
+        self.assertEqual(submitted.tasks[0].args, (1,))
+        self.assertEqual(submitted.tasks[1], cleanup_signature)
+        job = models.Job.objects.get(id=1)
+        self.assertEqual(job.status, models.Job.CANCELLED)
+        self.assertIsNotNone(job.date_done)
+
+    def test_wait_for_tasks(self):
+        """Waiting for the tasks of a job must end when none of them is
+        running anymore, or time out
+        """
+        django_celery_results.models.TaskResult.objects.create(task_id='root', status='SUCCESS')
+        task_result = django_celery_results.models.TaskResult.objects.create(
+            task_id='foo', status='STARTED')
+        job = models.Job.objects.get(id=1)
+        with self.assertRaises(TimeoutError):
+            job.wait_for_tasks(timeout=0)
+        task_result.status = 'REVOKED'
+        task_result.save()
+        job.wait_for_tasks(timeout=0)
+
+    def test_cancel_job_dataset_in_use(self):
+        """The downloaded files must not be removed if another job uses
+        the same dataset
+        """
+        models.Job.objects.create(
+            action='convert', parameters={'dataset_id': 1}, task_id='bar', status='STARTED')
+        with mock.patch.object(executors.CeleryExecutor, 'submit') as mock_submit:
+            self.assertTrue(models.Job.objects.get(id=1).cancel())
+        self.mock_revoke.assert_called_once()
+        mock_submit.assert_not_called()
+
+    def test_cancel_queued_job(self):
+        """A queued job must be cancelled without revoking anything"""
+        job = models.Job.objects.create(
+            action='download', parameters={'dataset_id': 1}, status=models.Job.QUEUED)
+        self.assertTrue(job.cancel())
+        self.mock_revoke.assert_not_called()
+        self.assertEqual(models.Job.objects.get(id=job.id).status, models.Job.CANCELLED)
+        # a cancelled job must not be released
+        self.assertFalse(admission.queued_jobs().exists())
+
+    def test_cancel_finished_job(self):
+        """A finished job can't be cancelled"""
+        models.Job.objects.filter(id=1).update(status='SUCCESS')
+        job = models.Job.objects.get(id=1)
+        self.assertFalse(job.cancel())
+        self.assertEqual(job.status, 'SUCCESS')
+        self.mock_revoke.assert_not_called()
+
+    def test_delete_job(self):
+        """A DELETE request must cancel the job"""
+        response = self.client.delete('/api/jobs/1/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(models.Job.objects.get(id=1).status, models.Job.CANCELLED)
+        self.mock_revoke.assert_called_once()
+
+    def test_cancel_endpoint(self):
+        """A POST request to the cancel endpoint must cancel the job
+        and return its representation
+        """
+        response = self.client.post('/api/jobs/1/cancel/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], models.Job.CANCELLED)
+        self.assertIn('date_done', response.json())
+
+    def test_cancel_finished_job_endpoint(self):
+        """A 409 error must be returned when cancelling a finished job"""
+        models.Job.objects.filter(id=1).update(status='FAILURE')
+        self.assertEqual(self.client.post('/api/jobs/1/cancel/').status_code, 409)
+        self.assertEqual(self.client.delete('/api/jobs/1/').status_code, 409)
+
+
+class JobTimelineTests(django.test.TestCase):
+    """Tests for the per-step timing of jobs"""
+
+    fixtures = ['processing_tests_data']
+
+    def setUp(self):
+        self.dispatch_date = datetime(2020, 7, 16, 14, 0, 0, tzinfo=django.utils.timezone.utc)
+        models.Job.objects.filter(id=1).update(
+            date_dispatched=self.dispatch_date,
+            steps=[
+                {'task_id': 'a', 'name': 'download', 'stage': 0},
+                {'task_id': 'b1', 'name': 'convert', 'stage': 1},
+                {'task_id': 'b2', 'name': 'convert', 'stage': 1},
+                {'task_id': 'c', 'name': 'publish', 'stage': 2},
+            ])
+
+    def create_task_result(self, task_id, task_status, start, end):
+        """Creates a TaskResult started and finished at the given
+        number of seconds after the dispatch date
+        """
+        django_celery_results.models.TaskResult.objects.create(
+            task_id=task_id, status=task_status, worker='worker1')
+        django_celery_results.models.TaskResult.objects.filter(task_id=task_id).update(
+            date_created=self.dispatch_date + timedelta(seconds=start),
+            date_done=self.dispatch_date + timedelta(seconds=end))
+
+    def test_get_steps(self):
+        """The tasks of a frozen signature must be listed in execution
+        order, with the tasks running in parallel in the same stage
+        """
+        signature = celery.chain(
+            noop_task.signature(),
+            celery.group(noop_task.signature(), noop_task.signature()),
+            noop_task.signature())
+        signature.freeze()
+        steps, next_stage = models.Job.get_steps(signature)
+        self.assertListEqual([step['stage'] for step in steps], [0, 1, 1, 2])
+        self.assertEqual(next_stage, 3)
+        self.assertEqual(len({step['task_id'] for step in steps}), 4)
+        self.assertTrue(all(step['name'] == noop_task.name for step in steps))
+
+    def test_run_records_steps(self):
+        """The task IDs recorded when running a job must be the IDs
+        of the tasks sent to the broker
+        """
+        signature = celery.chain(noop_task.signature(), noop_task.signature())
+        job = models.DownloadJob(action='download', parameters={})
+        with mock.patch.object(models.DownloadJob, 'get_signature', return_value=signature), \
+             mock.patch.object(models.DownloadJob, 'make_task_parameters',
+                               return_value=((), {})), \
+             mock.patch('celery.app.task.Task.apply_async') as mock_apply_async, \
+             self.captureOnCommitCallbacks(execute=True):
+            admission.submit(job)
+        first_task_id = mock_apply_async.call_args[1]['task_id']
+        self.assertEqual(job.steps[0]['task_id'], first_task_id)
+        self.assertEqual(len(job.steps), 2)
+        self.assertIsNotNone(job.date_dispatched)
+
+    def test_get_timeline(self):
+        """The timeline must contain the dates and durations of each
+        step, retrieved in one query
+        """
+        self.create_task_result('a', 'SUCCESS', 2, 10)
+        self.create_task_result('b1', 'SUCCESS', 11, 20)
+        self.create_task_result('b2', 'STARTED', 15, 15)
+        job = models.Job.objects.get(id=1)
+        with self.assertNumQueries(1):
+            timeline = job.get_timeline()
+
+        self.assertDictEqual(timeline[0], {
+            'task_id': 'a',
+            'name': 'download',
+            'stage': 0,
+            'status': 'SUCCESS',
+            'worker': 'worker1',
+            'date_queued': self.dispatch_date,
+            'date_started': self.dispatch_date + timedelta(seconds=2),
+            'date_done': self.dispatch_date + timedelta(seconds=10),
+            'queued': 2.0,
+            'duration': 8.0,
+        })
+        self.assertEqual(timeline[1]['queued'], 1.0)
+        self.assertEqual(timeline[1]['duration'], 9.0)
+        self.assertEqual(timeline[2]['queued'], 5.0)
+        # the task is still running
+        self.assertIsNone(timeline[2]['date_done'])
+        self.assertIsNone(timeline[2]['duration'])
+        # the last task can't be queued before the whole stage 1 is finished
+        self.assertEqual(timeline[3]['status'], 'PENDING')
+        self.assertIsNone(timeline[3]['date_queued'])
+        self.assertIsNone(timeline[3]['date_started'])
+
+    def test_timeline_parameter(self):
+        """The timeline must only be included in the representation of
+        a job when requested
+        """
+        with mock.patch.object(models.Job, 'get_current_task_result') as mock_get_result:
+            mock_result = mock.Mock(spec=celery.result.AsyncResult)
+            mock_result.state = 'STARTED'
+            mock_get_result.return_value = (mock_result, False)
+            self.assertNotIn('timeline', self.client.get('/api/jobs/1/').json())
+            self.assertNotIn('timeline', self.client.get('/api/jobs/?timeline=true').json())
+            timeline = self.client.get('/api/jobs/1/?timeline=true').json()['timeline']
+        self.assertListEqual([step['task_id'] for step in timeline], ['a', 'b1', 'b2', 'c'])
+
+
+@django.test.override_settings(GEOSPAAS_REST_API_METRICS_WINDOWS=(3600,))
+class JobMetricsTests(django.test.TestCase):
+    """Tests for the job metrics"""
+
+    def setUp(self):
+        self.now = django.utils.timezone.now()
+
+    def create_job(self, action, job_status, created, started=None, done=None):
+        """Creates a job and the result of its first task. The dates
+        are given in seconds before now.
+        """
+        job = models.Job.objects.create(action=action, status=job_status, task_id=None)
+        dates = {'date_created': self.now - timedelta(seconds=created)}
+        if started is not None:
+            task_id = f"task_{job.id}"
+            django_celery_results.models.TaskResult.objects.create(task_id=task_id)
+            django_celery_results.models.TaskResult.objects.filter(task_id=task_id).update(
+                date_created=self.now - timedelta(seconds=started))
+            dates.update(task_id=task_id, root_task_id=task_id)
+        if done is not None:
+            dates['date_done'] = self.now - timedelta(seconds=done)
+        models.Job.objects.filter(id=job.id).update(**dates)
+
+    def test_compute_job_metrics(self):
+        """The counts, throughput and latency percentiles must be
+        computed for each action
+        """
+        # durations from 10 to 100 seconds, queue wait from 1 to 10 seconds
+        for i in range(1, 11):
+            self.create_job('download', 'SUCCESS', created=1000, started=1000 - i,
+                            done=1000 - i - 10 * i)
+        self.create_job('download', 'QUEUED', created=10)
+        self.create_job('convert', 'FAILURE', created=500, started=490, done=400)
+        # outside of the window
+        self.create_job('convert', 'SUCCESS', created=5000, started=4990, done=4900)
+
+        result = metrics.compute_job_metrics(self.now)
+        self.assertEqual(len(result['windows']), 1)
+        actions = result['windows'][0]['actions']
+
+        self.assertDictEqual(actions['download']['status'], {'SUCCESS': 10, 'QUEUED': 1})
+        self.assertEqual(actions['download']['finished'], 10)
+        self.assertEqual(actions['download']['throughput'], 10.)
+        self.assertDictEqual(actions['download']['duration'], {
+            'count': 10, 'mean': 55., 'p50': 50., 'p95': 100., 'p99': 100.})
+        self.assertEqual(actions['download']['queue_wait']['p50'], 5.)
+
+        self.assertDictEqual(actions['convert']['status'], {'FAILURE': 1})
+        self.assertDictEqual(actions['convert']['duration'], {
+            'count': 1, 'mean': 90., 'p50': 90., 'p95': 90., 'p99': 90.})
+
+    def test_metrics_endpoint(self):
+        """The metrics must be cached"""
+        self.create_job('download', 'SUCCESS', created=100, started=90, done=80)
+        with mock.patch.object(metrics, 'compute_job_metrics',
+                               wraps=metrics.compute_job_metrics) as mock_compute:
+            with django.test.override_settings(
+                    CACHES={'default': {
+                        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+                first = self.client.get('/api/jobs/metrics/')
+                second = self.client.get('/api/jobs/metrics/')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json(), second.json())
+        mock_compute.assert_called_once()
+        self.assertEqual(
+            first.json()['windows'][0]['actions']['download']['duration']['p99'], 10.)
+
+
+class RetentionTests(django.test.TestCase):
+    """Tests for the removal of old jobs and task results"""
+
+    def setUp(self):
+        self.now = django.utils.timezone.now()
+        old = self.now - timedelta(days=40)
+        recent = self.now - timedelta(days=10)
+        self.old_jobs = [
+            models.Job.objects.create(task_id=f"old_{i}", status='SUCCESS', date_done=old)
+            for i in range(3)
+        ]
+        # finished before the finish date was stored
+        self.old_jobs.append(models.Job.objects.create(task_id='legacy', status='SUCCESS'))
+        models.Job.objects.filter(task_id='legacy').update(date_created=old)
+        self.kept_jobs = [
+            models.Job.objects.create(task_id='recent', status='FAILURE', date_done=recent),
+            models.Job.objects.create(
+                task_id='running', root_task_id='old_first_step', status='STARTED',
+                steps=[{'task_id': task_id, 'name': 'foo', 'stage': stage}
+                       for stage, task_id in enumerate(
+                           ('old_first_step', 'old_middle_step', 'running'))]),
+            models.Job.objects.create(task_id='callback', status='SUCCESS', date_done=old),
+        ]
+        models.Job.objects.filter(task_id='running').update(date_created=old)
+        models.JobCallback.objects.create(job=self.kept_jobs[2], url='http://foo', payload={})
+
+        django_celery_results.models.TaskResult.objects.bulk_create([
+            django_celery_results.models.TaskResult(task_id=f"old_{i}", status='SUCCESS')
+            for i in range(3)
+        ] + [
+            django_celery_results.models.TaskResult(task_id='recent', status='FAILURE'),
+            django_celery_results.models.TaskResult(task_id='old_running', status='STARTED'),
+            # first step of a job which is still running
+            django_celery_results.models.TaskResult(task_id='old_first_step', status='SUCCESS'),
+            django_celery_results.models.TaskResult(task_id='old_middle_step', status='SUCCESS'),
+        ])
+        django_celery_results.models.TaskResult.objects.exclude(task_id='recent').update(
+            date_done=old)
+        django_celery_results.models.TaskResult.objects.filter(task_id='recent').update(
+            date_done=recent)
+
+    def test_purge(self):
+        """Only finished jobs and task results older than the
+        retention period must be removed
+        """
+        self.assertDictEqual(
+            retention.purge(30, batch_size=2, now=self.now),
+            {'jobs': 4, 'task_results': 3})
+        self.assertCountEqual(
+            models.Job.objects.values_list('id', flat=True),
+            [job.id for job in self.kept_jobs])
+        self.assertCountEqual(
+            django_celery_results.models.TaskResult.objects.values_list('task_id', flat=True),
+            ['recent', 'old_running', 'old_first_step', 'old_middle_step'])
+
+    def test_purge_batches(self):
+        """The rows must be deleted in batches, each in its own
+        transaction
+        """
+        with mock.patch.object(retention, 'transaction') as mock_transaction:
+            retention.purge(30, batch_size=2, now=self.now)
+        # 2 full batches of jobs and an empty one, 2 batches of task
+        # results
+        self.assertEqual(mock_transaction.atomic.call_count, 5)
+
+    def test_purge_archive(self):
+        """The removed rows must be written to a compressed archive"""
+        with tempfile.TemporaryDirectory() as archive_dir:
+            retention.purge(30, archive_dir=archive_dir, now=self.now)
+            archive_files = os.listdir(archive_dir)
+            self.assertEqual(len(archive_files), 1)
+            with gzip.open(os.path.join(archive_dir, archive_files[0]), 'rt') as archive:
+                lines = [json.loads(line) for line in archive]
+        self.assertListEqual(
+            [line['model'] for line in lines],
+            ['geospaas_rest_api.job'] * 4 + ['django_celery_results.taskresult'] * 3)
+        self.assertListEqual(
+            [line['fields']['task_id'] for line in lines],
+            ['old_0', 'old_1', 'old_2', 'legacy', 'old_0', 'old_1', 'old_2'])
+
+    def test_apply_retention_policy(self):
+        """Nothing must be removed if no retention period is set"""
+        self.assertIsNone(retention.apply_retention_policy())
+        with django.test.override_settings(GEOSPAAS_REST_API_RETENTION_DAYS=30):
+            self.assertDictEqual(
+                retention.apply_retention_policy(), {'jobs': 4, 'task_results': 3})
+
+    def test_purge_jobs_command(self):
+        """The management command must remove the old jobs"""
+        out = io.StringIO()
+        django.core.management.call_command('purge_jobs', days=30, stdout=out)
+        self.assertIn('Removed 4 jobs and 3 task results', out.getvalue())
+        with self.assertRaises(django.core.management.CommandError):
+            django.core.management.call_command('purge_jobs')
+
+
+@django.test.override_settings(GEOSPAAS_REST_API_JOB_OUTBOX=True)
+class LegacyJobsMigrationTests(django.test.TestCase):
+    """Tests for the migration which sets the status of legacy jobs"""
+
+    def test_sync_legacy_jobs(self):
+        """The legacy jobs must get the state of their tasks, and the
+        ones without result must stay pending
+        """
+        migration = importlib.import_module(
+            'geospaas_rest_api.migrations.0017_sync_legacy_jobs')
+        for task_id, root_task_id in (('done', 'done_root'), ('running', 'running_root'),
+                                      ('queued', 'queued_root')):
+            models.Job.objects.create(task_id=task_id, root_task_id=root_task_id, status='')
+        django_celery_results.models.TaskResult.objects.create(task_id='done', status='SUCCESS')
+        django_celery_results.models.TaskResult.objects.create(
+            task_id='running_root', status='SUCCESS')
+
+        migration.sync_legacy_jobs(django.apps.apps, None)
+
+        self.assertDictEqual(
+            dict(models.Job.objects.values_list('task_id', 'status')),
+            {'done': 'SUCCESS', 'running': 'STARTED', 'queued': 'PENDING'})
+        self.assertIsNone(models.Job.objects.get(task_id='queued').date_done)
+
+
+class JobOutboxTests(django.test.TestCase):
+    """Tests for the submission of jobs through the outbox"""
+
+    fixtures = ['processing_tests_data']
+
+    def setUp(self):
+        mock_get_signature = mock.patch.object(
+            models.DownloadJob, 'get_signature',
+            side_effect=lambda p: celery.chain(noop_task.signature(), noop_task.signature()))
+        mock_get_signature.start()
+        self.addCleanup(mock_get_signature.stop)
+        mock_apply_async = mock.patch('celery.app.task.Task.apply_async')
+        self.mock_apply_async = mock_apply_async.start()
+        self.addCleanup(mock_apply_async.stop)
+
+    def submit_job(self):
+        """Submits a download job and returns it"""
+        with mock.patch.object(outbox.dispatcher, 'wake') as mock_wake, \
+             mock.patch.object(models.Job, 'get_current_task_result',
+                               return_value=(mock.Mock(spec=celery.result.AsyncResult,
+                                                       state='PENDING'), False)):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    '/api/jobs/',
+                    {'action': 'download', 'parameters': {'dataset_id': 1}},
+                    'application/json')
+        mock_wake.assert_called_once_with()
+        self.assertEqual(response.status_code, 201)
+        return models.Job.objects.get(id=response.json()['id'])
+
+    def test_submit_job(self):
+        """The job and its submission must be saved without sending
+        the tasks to the broker
+        """
+        job = self.submit_job()
+        self.mock_apply_async.assert_not_called()
+        self.assertEqual(job.status, 'PENDING')
+        self.assertEqual(len(job.steps), 2)
+        self.assertEqual(job.steps[-1]['task_id'], job.task_id)
+        self.assertEqual(job.steps[0]['task_id'], job.root_task_id)
+        self.assertTrue(models.JobSubmission.objects.filter(job=job).exists())
+
+    def test_publish_pending_submissions(self):
+        """The submissions must be published with the task IDs assigned
+        when the job was created, then removed
+        """
+        job = self.submit_job()
+        self.assertEqual(outbox.publish_pending_submissions(), 1)
+        self.assertEqual(self.mock_apply_async.call_args[1]['task_id'], job.root_task_id)
+        self.assertFalse(models.JobSubmission.objects.exists())
+        self.assertGreater(models.Job.objects.get(id=job.id).date_dispatched, job.date_created)
+
+    def test_publish_failure(self):
+        """Failed publications must be retried later"""
+        job = self.submit_job()
+        self.mock_apply_async.side_effect = OSError('broker unavailable')
+        self.assertEqual(outbox.publish_pending_submissions(), 0)
+        submission = models.JobSubmission.objects.get(job=job)
+        self.assertEqual(submission.attempts, 1)
+        self.assertEqual(submission.last_error, 'broker unavailable')
+        self.assertGreater(submission.next_attempt, django.utils.timezone.now())
+        # not retried before the next attempt date
+        self.mock_apply_async.side_effect = None
+        self.assertEqual(outbox.publish_pending_submissions(), 0)
+
+    def test_publish_claimed_submissions(self):
+        """The submissions must be claimed before they are published, so
+        that no other publisher picks them meanwhile
+        """
+        job = self.submit_job()
+        claims = []
+        self.mock_apply_async.side_effect = lambda *args, **kwargs: claims.append(
+            models.JobSubmission.objects.get(job=job).next_attempt)
+        self.assertEqual(outbox.publish_pending_submissions(), 1)
+        self.assertGreater(claims[0], django.utils.timezone.now())
+        self.assertFalse(models.JobSubmission.objects.exists())
+
+    def test_revoke_job_cancelled_while_published(self):
+        """A job cancelled while it was being published must be revoked
+        """
+        job = self.submit_job()
+
+        def cancel(*args, **kwargs):
+            models.JobSubmission.objects.filter(job=job).delete()
+            models.Job.objects.filter(id=job.id).update(status=models.Job.CANCELLED)
+
+        self.mock_apply_async.side_effect = cancel
+        with mock.patch.object(executors.CeleryExecutor, 'revoke') as mock_revoke:
+            self.assertEqual(outbox.publish_pending_submissions(), 1)
+        mock_revoke.assert_called_once()
+        self.assertEqual(mock_revoke.call_args[0][0].id, job.id)
+
+    def test_cancel_unpublished_job(self):
+        """Cancelling a job which is still in the outbox must remove its
+        submission without revoking anything
+        """
+        job = self.submit_job()
+        with mock.patch.object(celery.current_app.control, 'revoke') as mock_revoke:
+            self.assertTrue(job.cancel())
+        mock_revoke.assert_not_called()
+        self.assertFalse(models.JobSubmission.objects.exists())
+        self.assertEqual(outbox.publish_pending_submissions(), 0)
+
+
+@django.test.override_settings(
+    GEOSPAAS_REST_API_JOB_EXECUTOR='geospaas_rest_api.processing_api.executors.LocalExecutor')
+class LocalExecutorTests(django.test.TestCase):
+    """Tests for the execution of jobs in the API process"""
+
+    def setUp(self):
+        self.addCleanup(executors._executors.clear)
+        self.executor = executors.get_executor()
+        self.executor.pool = mock.Mock()
+
+    def make_job(self, *args):
+        """Runs a job made of a chain of increment tasks in the current
+        thread and returns it
+        """
+        signature = celery.chain(increment_task.signature(), increment_task.signature())
+        job = models.DownloadJob(action='download', parameters={})
+        with mock.patch.object(models.DownloadJob, 'get_signature', return_value=signature), \
+             mock.patch.object(models.DownloadJob, 'make_task_parameters',
+                               return_value=(args, {})), \
+             self.captureOnCommitCallbacks(execute=True):
+            admission.submit(job)
+        ((function, *run_args), _) = self.executor.pool.submit.call_args
+        self.assertIs(function, executors.run_in_worker)
+        return job, run_args
+
+    def test_get_executor(self):
+        """The executor must be chosen using the settings"""
+        self.assertIsInstance(self.executor, executors.LocalExecutor)
+        with django.test.override_settings(GEOSPAAS_REST_API_JOB_EXECUTOR=executors.DEFAULT_EXECUTOR):
+            self.assertIsInstance(executors.get_executor(), executors.CeleryExecutor)
+
+    def test_run_job(self):
+        """The steps of a job must be run in order and their state
+        stored in the database
+        """
+        job, run_args = self.make_job(1)
+        self.assertEqual(job.get_current_task_result()[0].state, 'PENDING')
+
+        executors.run_signature(*run_args)
+
+        current_result, finished = job.get_current_task_result()
+        self.assertTrue(finished)
+        self.assertEqual(current_result.state, 'SUCCESS')
+        self.assertEqual(current_result.result, 3)
+        self.assertEqual(current_result.id, job.task_id)
+        self.assertEqual(
+            django_celery_results.models.TaskResult.objects.filter(status='SUCCESS').count(), 2)
+        self.assertEqual(models.Job.objects.get(id=job.id).status, 'SUCCESS')
+
+    def test_run_failing_job(self):
+        """The steps following a failed step must not be run"""
+        job, run_args = self.make_job(-1)
+        executors.run_signature(*run_args)
+        current_result, finished = job.get_current_task_result()
+        self.assertTrue(finished)
+        self.assertEqual(current_result.state, 'FAILURE')
+        self.assertEqual(current_result.id, job.root_task_id)
+        self.assertFalse(django_celery_results.models.TaskResult.objects.filter(
+            task_id=job.task_id).exists())
+        self.assertEqual(models.Job.objects.get(id=job.id).status, 'FAILURE')
+
+    def test_cancel_job(self):
+        """The steps of a cancelled job must not be run"""
+        job, run_args = self.make_job(1)
+        self.assertTrue(job.cancel())
+        executors.run_signature(*run_args)
+        self.assertFalse(django_celery_results.models.TaskResult.objects.filter(
+            status='SUCCESS').exists())
+        self.assertEqual(models.Job.objects.get(id=job.id).status, models.Job.CANCELLED)
+
+
+    def test_check(self):
+        """Signatures whose tasks start other signatures must be
+        rejected
+        """
+        self.executor.check(celery.chain(increment_task.signature(), noop_task.signature()))
+        with self.assertRaises(ValueError):
+            self.executor.check(celery.chain(
+                increment_task.signature(),
+                noop_task.signature(kwargs={'to_execute': celery.chain(
+                    increment_task.signature(), increment_task.signature())})))
+        with self.assertRaises(ValueError):
+            self.executor.check(celery.group(
+                noop_task.signature(args=(increment_task.signature(),))))
+
+    def test_reject_job_starting_tasks(self):
+        """A job whose tasks start other tasks must not be created"""
+        signature = noop_task.signature(kwargs={'to_execute': increment_task.signature()})
+        with mock.patch.object(models.DownloadJob, 'get_signature', return_value=signature), \
+             mock.patch.object(serializers, 'check_datasets', return_value=[[]]), \
+             mock.patch.object(models.Job, 'dispatch') as mock_dispatch:
+            response = self.client.post(
+                '/api/jobs/',
+                {'action': 'download', 'parameters': {'dataset_id': 1}},
+                'application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("can't be run locally", response.json()['non_field_errors'][0])
+        mock_dispatch.assert_not_called()
+        self.assertFalse(models.Job.objects.exists())
+
+class JobDatasetValidationTests(django.test.TestCase):
+    """Tests for the validation of the datasets referenced by jobs"""
+
+    fixtures = ['processing_tests_data']
+
+    def setUp(self):
+        mock_dispatch = mock.patch.object(models.Job, 'dispatch')
+        self.mock_dispatch = mock_dispatch.start()
+        self.addCleanup(mock_dispatch.stop)
+        mock_representation = mock.patch.object(
+            serializers.JobSerializer, 'to_representation', return_value={})
+        mock_representation.start()
+        self.addCleanup(mock_representation.stop)
+
+    def test_find_unusable_datasets(self):
+        """All the datasets must be checked in one query"""
+        with self.assertNumQueries(1):
+            errors = validation.find_unusable_datasets([1, 2, 999])
+        self.assertDictEqual(errors, {999: 'Dataset 999 does not exist'})
+
+    def test_find_unusable_datasets_empty(self):
+        """No query must be made if there is no dataset to check"""
+        with self.assertNumQueries(0):
+            self.assertDictEqual(validation.find_unusable_datasets([]), {})
+
+    @django.test.override_settings(GEOSPAAS_REST_API_SUPPORTED_URI_SERVICES=('ftp',))
+    def test_find_unusable_datasets_unsupported_service(self):
+        """Datasets which have no URI with a supported service must be
+        reported
+        """
+        self.assertDictEqual(
+            validation.find_unusable_datasets([1]),
+            {1: 'Dataset 1 has no URI with a supported service (ftp)'})
+
+    def test_reject_missing_dataset(self):
+        """A job referencing a dataset which does not exist must not
+        be created
+        """
+        response = self.client.post(
+            '/api/jobs/',
+            {'action': 'download', 'parameters': {'dataset_id': 999}},
+            'application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'non_field_errors': ['Dataset 999 does not exist']})
+        self.assertFalse(models.Job.objects.filter(parameters__dataset_id=999).exists())
+        self.mock_dispatch.assert_not_called()
+
+    def test_create_several_jobs(self):
+        """A list of jobs must be created in one request"""
+        jobs_count = models.Job.objects.count()
+        response = self.client.post(
+            '/api/jobs/',
+            [
+                {'action': 'download', 'parameters': {'dataset_id': 1}},
+                {'action': 'download', 'parameters': {'dataset_id': 2}},
+            ],
+            'application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(models.Job.objects.count(), jobs_count + 2)
+        self.assertEqual(self.mock_dispatch.call_count, 2)
+
+    def test_reject_several_jobs(self):
+        """If one of the jobs is invalid, none must be created and the
+        errors must identify the jobs
+        """
+        jobs_count = models.Job.objects.count()
+        serializer = serializers.JobSerializer(
+            data=[
+                {'action': 'download', 'parameters': {'dataset_id': 1}},
+                {'action': 'download', 'parameters': {'dataset_id': 998}},
+                {'action': 'download', 'parameters': {'dataset_id': 999}},
+            ],
+            many=True)
+        with self.assertNumQueries(1):
+            self.assertFalse(serializer.is_valid())
+        self.assertListEqual(
+            serializer.errors['non_field_errors'],
+            ['Job 1: Dataset 998 does not exist', 'Job 2: Dataset 999 does not exist'])
+        self.assertEqual(models.Job.objects.count(), jobs_count)
+
+    @django.test.override_settings(GEOSPAAS_REST_API_MAX_JOBS_PER_REQUEST=1)
+    def test_too_many_jobs(self):
+        """The number of jobs created in one request must be limited"""
+        response = self.client.post(
+            '/api/jobs/',
+            [
+                {'action': 'download', 'parameters': {'dataset_id': 1}},
+                {'action': 'download', 'parameters': {'dataset_id': 2}},
+            ],
+            'application/json')
+        self.assertEqual(response.status_code, 400)
+        self.mock_dispatch.assert_not_called()
+
+
+class HarvestScheduleTests(django.test.TestCase):
+    """Tests for the incremental harvests run from schedules"""
+
+    def setUp(self):
+        mock_dispatch = mock.patch.object(models.Job, 'dispatch')
+        self.mock_dispatch = mock_dispatch.start()
+        self.addCleanup(mock_dispatch.stop)
+        self.start = datetime(2023, 1, 1, tzinfo=django.utils.timezone.utc)
+        self.schedule = models.HarvestSchedule.objects.create(
+            name='test',
+            search_config_dict={'common': {'foo': 'bar'}, 'searches': [{'provider_name': 'p'}]},
+            interval=timedelta(hours=1),
+            high_water_mark=self.start,
+            next_run=self.start)
+
+    def run_schedules(self, now):
+        """Runs the due schedules and returns the updated schedule"""
+        schedules.run_due_schedules(now)
+        return models.HarvestSchedule.objects.select_related('last_job').get(id=self.schedule.id)
+
+    def test_create_schedule(self):
+        """Schedules must be created through the API"""
+        response = self.client.post('/api/harvest_schedules/', {
+            'name': 'new',
+            'search_config_dict': {'searches': [{'provider_name': 'p'}]},
+            'interval': '01:00:00',
+            'high_water_mark': '2023-01-01T00:00:00Z',
+        }, 'application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(models.HarvestSchedule.objects.get(name='new').interval,
+                         timedelta(hours=1))
+
+    def test_create_schedule_with_time_range(self):
+        """The time range of the searches is managed by the schedule"""
+        response = self.client.post('/api/harvest_schedules/', {
+            'name': 'new',
+            'search_config_dict': {'common': {'start_time': '2023-01-01'}, 'searches': []},
+            'interval': '01:00:00',
+            'high_water_mark': '2023-01-01T00:00:00Z',
+        }, 'application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_run_schedule(self):
+        """A harvest job covering the time since the high-water mark
+        must be launched
+        """
+        now = self.start + timedelta(hours=2)
+        schedule = self.run_schedules(now)
+        self.mock_dispatch.assert_called_once()
+        self.assertEqual(schedule.last_job.action, 'harvest')
+        self.assertEqual(schedule.last_job.client, 'schedule:test')
+        self.assertDictEqual(schedule.last_job.parameters, {'search_config_dict': {
+            'common': {'foo': 'bar', 'start_time': self.start.isoformat(),
+                       'end_time': now.isoformat()},
+            'searches': [{'provider_name': 'p'}],
+        }})
+        self.assertEqual(schedule.pending_mark, now)
+        self.assertEqual(schedule.high_water_mark, self.start)
+        self.assertEqual(schedule.next_run, now + timedelta(hours=1))
+
+    def test_run_schedule_not_due(self):
+        """Schedules which are not due or disabled must not run"""
+        self.run_schedules(self.start - timedelta(minutes=1))
+        models.HarvestSchedule.objects.update(enabled=False)
+        self.run_schedules(self.start + timedelta(hours=1))
+        self.mock_dispatch.assert_not_called()
+
+    def test_run_schedule_job_limit_exceeded(self):
+        """A schedule whose job is rejected by the admission control
+        must be retried after the estimated delay
+        """
+        now = self.start + timedelta(hours=2)
+        with mock.patch.object(admission, 'admit',
+                               side_effect=admission.JobLimitExceeded(wait=60)):
+            schedule = self.run_schedules(now)
+        self.mock_dispatch.assert_not_called()
+        self.assertFalse(models.Job.objects.exists())
+        self.assertIsNone(schedule.last_job)
+        self.assertIsNone(schedule.pending_mark)
+        self.assertEqual(schedule.next_run, now + timedelta(seconds=60))
+
+        schedule = self.run_schedules(now + timedelta(minutes=1))
+        self.mock_dispatch.assert_called_once()
+        self.assertEqual(schedule.pending_mark, now + timedelta(minutes=1))
+
+    def test_advance_high_water_mark(self):
+        """Once the job succeeded, the next run must start from the end
+        of the harvested range
+        """
+        first_run = self.start + timedelta(hours=2)
+        schedule = self.run_schedules(first_run)
+        schedule.last_job.set_status('SUCCESS')
+        schedule = self.run_schedules(first_run + timedelta(hours=1))
+        self.assertEqual(schedule.high_water_mark, first_run)
+        self.assertEqual(schedule.last_job.parameters['search_config_dict']['common']['start_time'],
+                         first_run.isoformat())
+
+    def test_retry_after_failure(self):
+        """If the job failed, the next run must harvest the same range
+        again
+        """
+        schedule = self.run_schedules(self.start + timedelta(hours=2))
+        schedule.last_job.set_status('FAILURE')
+        schedule = self.run_schedules(self.start + timedelta(hours=3))
+        self.assertEqual(schedule.high_water_mark, self.start)
+        self.assertEqual(schedule.last_job.parameters['search_config_dict']['common']['start_time'],
+                         self.start.isoformat())
+
+    def test_wait_for_running_job(self):
+        """No job must be launched while the previous one is running"""
+        schedule = self.run_schedules(self.start + timedelta(hours=2))
+        first_job = schedule.last_job
+        first_job.set_status('STARTED')
+        schedule = self.run_schedules(self.start + timedelta(hours=3))
+        self.assertEqual(schedule.last_job, first_job)
+        self.assertEqual(self.mock_dispatch.call_count, 1)
+
+    def test_overlap(self):
+        """The overlap must be harvested again at each run"""
+        models.HarvestSchedule.objects.update(overlap=timedelta(minutes=30))
+        schedule = self.run_schedules(self.start + timedelta(hours=2))
+        self.assertEqual(schedule.last_job.parameters['search_config_dict']['common']['start_time'],
+                         (self.start - timedelta(minutes=30)).isoformat())
+
+
 class ProcessingResultsViewSetTests(django.test.TestCase):
     """Test processing_results/ endpoints"""
 
@@ -1000,3 +2995,176 @@ class ProcessingResultsViewSetTests(django.test.TestCase):
             "created": "2023-10-25T15:38:47Z",
             "ttl": None,
         })
+
+    def get_result_ids(self, query):
+        """Returns the IDs of the processing results matching a query"""
+        response = self.client.get(f"/api/processing_results/?{query}")
+        self.assertEqual(response.status_code, 200)
+        return [result['id'] for result in response.json()['results']]
+
+    def test_filter_time_overlaps(self):
+        """The results whose dataset's time coverage intersects the
+        time range must be returned
+        """
+        self.assertListEqual(
+            self.get_result_ids('time_overlaps=2018-12-01T00:00:00Z,2018-12-31T00:00:00Z'), [1])
+        self.assertListEqual(self.get_result_ids('time_overlaps=,2018-05-01T00:00:00'), [2])
+        self.assertListEqual(self.get_result_ids('time_overlaps=2018-04-05T00:45:00Z,'), [1, 2])
+        self.assertListEqual(self.get_result_ids('time_overlaps=2019-01-01T00:00:00Z,'), [])
+
+    def test_filter_bbox(self):
+        """The results whose dataset's footprint intersects the
+        bounding box must be returned
+        """
+        self.assertListEqual(self.get_result_ids('bbox=100,25,125,45'), [1])
+        self.assertListEqual(self.get_result_ids('bbox=-40,-50,-20,-35'), [2])
+        self.assertListEqual(self.get_result_ids('bbox=0,0,1,1'), [])
+
+    def test_filter_joins(self):
+        """The spatio-temporal filters must be applied in a single query
+        without subquery
+        """
+        with django.test.utils.CaptureQueriesContext(django.db.connection) as queries:
+            self.assertListEqual(self.get_result_ids(
+                'bbox=100,25,125,45&time_overlaps=2018-12-01T00:00:00Z,2018-12-31T00:00:00Z'),
+                [1])
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(queries[0]['sql'].count('SELECT'), 1)
+
+    def test_filter_invalid_values(self):
+        """Invalid filter values must be rejected"""
+        for query in ('time_overlaps=foo', 'time_overlaps=foo,', 'time_overlaps=,',
+                      'time_overlaps=2019-01-01T00:00:00Z,2018-01-01T00:00:00Z',
+                      'bbox=1,2,3', 'bbox=a,b,c,d', 'bbox=10,0,0,10'):
+            with self.subTest(query=query):
+                self.assertEqual(
+                    self.client.get(f"/api/processing_results/?{query}").status_code, 400)
+
+    def test_reject_over_budget_filters(self):
+        """Filters on the datasets of the results must be checked by
+        the cost policy
+        """
+        response = self.client.get('/api/processing_results/?dataset__summary__iregex=foo')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()['detail'],
+            "The query is too expensive: the regular expression of "
+            "'dataset__summary__iregex' must start with '^'")
+
+    def test_expand_dataset(self):
+        """The datasets must be included in the results, using one
+        query
+        """
+        with django.test.utils.CaptureQueriesContext(django.db.connection) as queries:
+            response = self.client.get('/api/processing_results/?expand=dataset')
+        self.assertEqual(len(queries), 1)
+        dataset = response.json()['results'][0]['dataset']
+        self.assertEqual(dataset['id'], 1)
+        self.assertEqual(dataset['entry_id'], 'e85b95d7-785a-4830-b193-96cfb77f1828')
+        self.assertEqual(
+            self.client.get('/api/processing_results/1/?expand=dataset').json()['dataset']['id'],
+            1)
+
+    def test_expand_unknown_field(self):
+        """Only the dataset can be expanded"""
+        self.assertEqual(
+            self.client.get('/api/processing_results/?expand=foo').status_code, 400)
+
+
+class ProcessingResultDownloadTests(django.test.TestCase):
+    """Tests for the download of processing results files"""
+
+    fixtures = ['processing_tests_data']
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.root.cleanup)
+        os.makedirs(os.path.join(self.root.name, 'results'))
+        with open(os.path.join(self.root.name, 'results', 'file.nc'), 'wb') as result_file:
+            result_file.write(b'0123456789')
+        self.result = geospaas_processing.models.ProcessingResult.objects.create(
+            dataset_id=1, path='results/file.nc', type='syntool',
+            created=django.utils.timezone.now())
+        settings_override = django.test.override_settings(
+            GEOSPAAS_REST_API_RESULTS_ROOT=self.root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def download(self, result_id=None, **headers):
+        """Sends a download request"""
+        return self.client.get(
+            f"/api/processing_results/{result_id or self.result.id}/download/", **headers)
+
+    def test_download(self):
+        """The whole file must be sent"""
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Disposition'], "attachment; filename*=utf-8''file.nc")
+
+    def test_download_range(self):
+        """Only the requested byte range must be sent"""
+        for range_header, content_range, content in (
+                ('bytes=2-5', 'bytes 2-5/10', b'2345'),
+                ('bytes=7-', 'bytes 7-9/10', b'789'),
+                ('bytes=-3', 'bytes 7-9/10', b'789'),
+                ('bytes=8-20', 'bytes 8-9/10', b'89')):
+            with self.subTest(range=range_header):
+                response = self.download(HTTP_RANGE=range_header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response['Content-Range'], content_range)
+                self.assertEqual(response['Content-Length'], str(len(content)))
+                self.assertEqual(b''.join(response.streaming_content), content)
+
+    def test_download_unsatisfiable_range(self):
+        """A 416 error must be returned if the range is outside of the
+        file
+        """
+        response = self.download(HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_download_multiple_ranges(self):
+        """Multiple ranges are not supported, so the whole file must be
+        sent
+        """
+        response = self.download(HTTP_RANGE='bytes=0-1,4-5')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+    def test_download_x_accel_redirect(self):
+        """The transfer must be delegated to nginx"""
+        with django.test.override_settings(GEOSPAAS_REST_API_RESULTS_SENDFILE='x-accel-redirect',
+                                           GEOSPAAS_REST_API_RESULTS_ACCEL_PREFIX='/internal/'):
+            response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/internal/results/file.nc')
+        self.assertEqual(response.content, b'')
+
+    def test_download_x_sendfile(self):
+        """The transfer must be delegated to the front-end server"""
+        with django.test.override_settings(GEOSPAAS_REST_API_RESULTS_SENDFILE='x-sendfile'):
+            response = self.download()
+        self.assertEqual(response['X-Sendfile'],
+                         os.path.join(os.path.realpath(self.root.name), 'results', 'file.nc'))
+
+    def test_download_outside_root(self):
+        """Files outside of the results directory must not be served"""
+        result = geospaas_processing.models.ProcessingResult.objects.create(
+            dataset_id=1, path='../../etc/passwd', type='syntool',
+            created=django.utils.timezone.now())
+        self.assertEqual(self.download(result.id).status_code, 404)
+
+    def test_download_directory(self):
+        """Directories can't be downloaded"""
+        # the path of the processing result 1 is a directory
+        os.makedirs(os.path.join(self.root.name, 'ingested/product_name/granule_name_1'))
+        self.assertEqual(self.download(1).status_code, 404)
+
+    def test_download_not_configured(self):
+        """Files must not be served if the results directory is not
+        configured
+        """
+        with django.test.override_settings(GEOSPAAS_REST_API_RESULTS_ROOT=None):
+            self.assertEqual(self.download().status_code, 404)
@@ -37,6 +37,7 @@ if os.environ.get('GEOSPAAS_REST_API_ENABLE_PROCESSING', 'false').lower() == 'tr
     import geospaas_rest_api.processing_api.views as processing_views
     router.register(r'tasks', processing_views.TaskViewSet)
     router.register(r'jobs', processing_views.JobViewSet)
+    router.register(r'harvest_schedules', processing_views.HarvestScheduleViewSet)
     router.register(r'processing_results', processing_views.ProcessingResultViewSet)
 
 urlpatterns = router.urls